@@ -1,11 +1,19 @@
 # coding=utf-8
 """Code by Alejandro Gutierrez Almansa"""
-from datetime import datetime
-from PySide6.QtWidgets import QApplication
-from pathlib import Path
-from source import Gui
-from source.Notepad import PrepareDatabase
-import sys
+from source.Tracer import Tracer
+TRACER = Tracer.get()  # <-- Before anything else, so the imports are measured too
+with TRACER.span("import PySide6"):
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+with TRACER.span("import source"):
+    from datetime import datetime
+    from pathlib import Path
+    from source import Gui
+    from source.ContentCodec import convert_contents
+    from source.Importer import import_notes
+    from source.Notepad import PrepareDatabase
+    from source.Storage import Storage
+    import sys
 
 MAIN_FOLDER = Path.cwd()
 
@@ -14,15 +22,101 @@ def loader():
     """Loader"""
     print(f"{datetime.now()}: Checking database integration...")
     make_sure_folder_exists(MAIN_FOLDER.joinpath("notes"))
-    PrepareDatabase()
+    with TRACER.span("PrepareDatabase"):
+        PrepareDatabase()
     print(f"{datetime.now()}: Creating GUI...")
-    app = QApplication(sys.argv)
-    main_window = Gui.GUI(app=app)
+    with TRACER.span("QApplication"):
+        app = QApplication(sys.argv)
+    with TRACER.span("GUI"):
+        main_window = Gui.GUI(app=app)
     print(f"{datetime.now()}: Executing application endless event loop.")
-    main_window.show()
+    with TRACER.span("show"):
+        main_window.show()
+    QTimer.singleShot(0, TRACER.finish)  # <-- The first time the event loop is idle, the window is on screen
     sys.exit(app.exec())
 
 
+def convert_database(compress: bool = None, compact: bool = None):
+    """Offline migration: rewrite every stored note in the format of the settings, or the one asked for,
+       and show how much it changed"""
+    make_sure_folder_exists(MAIN_FOLDER.joinpath("notes"))
+    PrepareDatabase()
+    storage = Storage.get()
+    if compress is not None:
+        storage.compress_content = compress
+    if compact is not None:
+        storage.compact_html = compact
+    db_file = storage.db_path
+    size_before = db_file.stat().st_size
+    print(f"{datetime.now()}: Rewriting the notes (compressed: {storage.compress_content}, "
+          f"compact HTML: {storage.compact_html})...")
+    with storage.write_lock:
+        stats = convert_contents(storage.connection, encode=storage.encode_content)
+        storage.connection.execute("VACUUM")  # <-- Give the freed pages back, so the file shrinks too
+        storage.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    storage.close()
+    size_after = db_file.stat().st_size
+    ratio = stats["bytes_after"] / stats["bytes_before"] if stats["bytes_before"] else 1
+    print(f"Notes: {stats['rows']} ({stats['converted']} converted)")
+    print(f"Contents: {stats['bytes_before']:,} bytes -> {stats['bytes_after']:,} bytes ({ratio:.1%})")
+    print(f"Database file: {size_before:,} bytes -> {size_after:,} bytes")
+    print(f"Time: {stats['decode_seconds']:.3f}s decoding, {stats['encode_seconds']:.3f}s encoding")
+    print("New saves follow compress_content and compact_html from the [Database] section of program_settings.ini")
+
+
+def vacuum_database():
+    """Offline maintenance: rewrite the whole database without its free pages, which also lets the space of the
+       purged notes be given back a little at a time from then on, see migration 6 in source/Migrations.py"""
+    make_sure_folder_exists(MAIN_FOLDER.joinpath("notes"))
+    PrepareDatabase()
+    storage = Storage.get()
+    db_file = storage.db_path
+    size_before = db_file.stat().st_size
+    print(f"{datetime.now()}: Vacuuming the database...")
+    with storage.write_lock:
+        storage.connection.execute("VACUUM")
+        storage.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        incremental = storage.connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    storage.close()
+    print(f"Database file: {size_before:,} bytes -> {db_file.stat().st_size:,} bytes")
+    print(f"Space of the purged notes given back on the fly: {'yes' if incremental else 'no'}")
+
+
+def import_files(arguments: list):
+    """Offline import: add every text, markdown and HTML file in the paths, or inside their zip archives, as notes
+       Usage: python Main.py --import PATH [PATH ...] [--private] [--processes N]"""
+    usage = "Usage: python Main.py --import PATH [PATH ...] [--private] [--processes N]"
+    table = "private_notes" if "--private" in arguments else "notes"
+    processes = None
+    if "--processes" in arguments:
+        index = arguments.index("--processes")
+        value = arguments.pop(index + 1) if index + 1 < len(arguments) else ""
+        if not value.isdigit():
+            print(f"--processes needs how many processes, 0 or more. {usage}")
+            return
+        processes = int(value)
+    paths = [argument for argument in arguments if not argument.startswith("--")]
+    if not paths:
+        print(f"Nothing to import. {usage}")
+        return
+    make_sure_folder_exists(MAIN_FOLDER.joinpath("notes"))
+    PrepareDatabase()
+    storage = Storage.get()
+    print(f"{datetime.now()}: Importing {', '.join(paths)} into {table}...")
+
+    def show_progress(stats: dict) -> None:
+        print(f"\r{stats['imported']:,} notes ({stats['imported'] / (stats['seconds'] or 1):,.0f} notes/s)",
+              end="", flush=True)
+
+    stats = import_notes(storage, paths, table=table, processes=processes, progress=show_progress)
+    storage.close()
+    seconds = stats["seconds"] or 1e-9
+    print(f"\rImported {stats['imported']:,} notes from {stats['files']:,} files in {stats['seconds']:.2f}s "
+          f"({stats['imported'] / seconds:,.0f} notes/s, {stats['bytes'] / seconds / 1e6:.1f} MB/s)")
+    for title, error in stats["errors"]:
+        print(f"Not imported: {title}: {error}")
+
+
 def make_sure_folder_exists(fullpath: Path):
     """Dinamycally create the folder if it doesn't exist."""
     fullpath.mkdir(parents=True, exist_ok=True)
@@ -30,4 +124,19 @@ def make_sure_folder_exists(fullpath: Path):
 
 # Initialize the program
 if __name__ == "__main__":
-    loader()
+    if "--compress-db" in sys.argv:
+        convert_database(compress=True)
+    elif "--decompress-db" in sys.argv:
+        convert_database(compress=False)
+    elif "--compact-db" in sys.argv:
+        convert_database(compact=True)
+    elif "--expand-db" in sys.argv:
+        convert_database(compact=False)
+    elif "--rewrite-db" in sys.argv:
+        convert_database()
+    elif "--vacuum" in sys.argv:
+        vacuum_database()
+    elif "--import" in sys.argv:
+        import_files(sys.argv[sys.argv.index("--import") + 1:])
+    else:
+        loader()
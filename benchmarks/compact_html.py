@@ -0,0 +1,87 @@
+# coding=utf-8
+"""Code by Aens
+
+Benchmark of the canonical compact HTML against what QTextEdit.toHtml() writes.
+The compact form is smaller on disk, but it's expanded back before QTextEdit parses it, so loading a note into the
+editor is never faster: it costs the same setHtml plus the expanding.
+Run it from the main folder with: python -m benchmarks.compact_html [amount of notes]"""
+from PySide6.QtGui import QTextCursor, QTextListFormat
+from PySide6.QtWidgets import QApplication, QTextEdit
+import random
+import sys
+import time
+from source.ContentCodec import encode_content, decode_content
+from source.NoteText import compact_html, expand_html, html_to_text
+
+EDITOR_ROUNDS = 3  # <-- The loads into the editor are the best of these many rounds, they are the noisiest
+WORDS = "hola mundo nota compra leche pan reunión martes proyecto código revisar llamar enviar factura".split()
+
+
+def build_notes(amount: int) -> list:
+    """Write notes with paragraphs, empty lines, lists and some formatting, like a user would"""
+    random.seed(1)
+    text_edit = QTextEdit()
+    notes = []
+    for _ in range(amount):
+        lines = [" ".join(random.choices(WORDS, k=random.randint(2, 12))) for _ in range(random.randint(3, 40))]
+        text_edit.setPlainText("\n".join(line if random.random() > 0.15 else "" for line in lines))
+        cursor = text_edit.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        if random.random() > 0.5:
+            cursor.insertList(QTextListFormat.ListDisc)
+            for word in random.choices(WORDS, k=random.randint(1, 6)):
+                cursor.insertText(word)
+                cursor.insertBlock()
+        cursor.insertHtml(f"<b>{random.choice(WORDS)}</b>")
+        notes.append(text_edit.toHtml())
+    return notes
+
+
+def measure(function, values: list) -> tuple:
+    """Return (seconds, results) of calling the function with every value"""
+    started = time.perf_counter()
+    results = [function(value) for value in values]
+    return time.perf_counter() - started, results
+
+
+def main(amount: int) -> None:
+    """Print the sizes and times of both formats"""
+    app = QApplication.instance() or QApplication(sys.argv)
+    notes = build_notes(amount)
+    compact_time, compacts = measure(compact_html, notes)
+    expand_time, expanded = measure(expand_html, compacts)
+    assert expanded == notes, "The compact form must expand back to the exact same HTML"
+    text_edit = QTextEdit()
+    qt_time, _ = measure(text_edit.setHtml, notes)
+    editor_full_time = editor_compact_time = float("inf")
+    for _ in range(EDITOR_ROUNDS):  # <-- Taking turns, so the warm up of Qt doesn't favour any of them
+        editor_full_time = min(editor_full_time, measure(lambda v: text_edit.setHtml(decode_content(v)), notes)[0])
+        editor_compact_time = min(editor_compact_time,
+                                  measure(lambda v: text_edit.setHtml(decode_content(v)), compacts)[0])
+    text_full_time, texts_full = measure(html_to_text, notes)
+    text_compact_time, texts_compact = measure(html_to_text, compacts)
+    assert texts_full == texts_compact
+    zlib_full_time, zipped_full = measure(encode_content, notes)
+    zlib_compact_time, zipped_compact = measure(encode_content, compacts)
+    unzip_full_time, _ = measure(decode_content, zipped_full)
+    unzip_compact_time, _ = measure(decode_content, zipped_compact)  # <-- It includes expanding them
+
+    def size(values: list) -> int:
+        return sum(len(value.encode("UTF-8") if isinstance(value, str) else value) for value in values)
+
+    print(f"{amount} notes ({app.platformName()})")
+    print(f"{'':<28}{'Qt HTML':>14}{'Compact':>14}")
+    print(f"{'Size (bytes)':<28}{size(notes):>14,}{size(compacts):>14,}")
+    print(f"{'Size compressed (bytes)':<28}{size(zipped_full):>14,}{size(zipped_compact):>14,}")
+    print(f"{'Plain text extraction (ms)':<28}{text_full_time * 1000:>14.1f}{text_compact_time * 1000:>14.1f}")
+    print(f"{'Compression (ms)':<28}{zlib_full_time * 1000:>14.1f}{zlib_compact_time * 1000:>14.1f}")
+    print(f"{'Load from storage (ms)':<28}{unzip_full_time * 1000:>14.1f}{unzip_compact_time * 1000:>14.1f}")
+    print(f"{'Load into the editor (ms)':<28}{editor_full_time * 1000:>14.1f}{editor_compact_time * 1000:>14.1f}")
+    print(f"Canonicalizing: {compact_time * 1000:.1f} ms, expanding: {expand_time * 1000:.1f} ms, "
+          f"QTextEdit.setHtml of the same notes: {qt_time * 1000:.1f} ms")
+    print(f"Loading a compact note into the editor parses the same HTML after expanding it, "
+          f"{expand_time / qt_time:.1%} more than setHtml alone")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
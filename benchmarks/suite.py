@@ -0,0 +1,241 @@
+# coding=utf-8
+"""Code by Aens
+
+Benchmark suite of the whole program on synthetic databases, without showing any window.
+Run it from the main folder with: python -m benchmarks.suite [--sizes 100,10000,100000] [--repeat 5] [--classic]
+                                                             [--output results.json]
+and compare two runs with: python -m benchmarks.suite --compare old.json new.json
+
+Each database is generated once in benchmarks/corpora and every size is measured in a process of its own,
+on a fresh copy of it. The results go to benchmarks/results as JSON, named after the date and the commit"""
+from datetime import datetime
+from pathlib import Path
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MAIN_FOLDER = Path(__file__).resolve().parent.parent
+CORPORA = MAIN_FOLDER.joinpath("benchmarks", "corpora")
+RESULTS = MAIN_FOLDER.joinpath("benchmarks", "results")
+CORPUS_VERSION = 3  # <-- Change it when the generated notes change, so old corpora are not reused
+SIZES = (100, 10000, 100000)
+REPEAT = 5
+DISTINCT_BODIES = 300  # <-- Written by a real QTextEdit, the rest are copies with a paragraph of their own
+SAVES_PER_SAMPLE = 100
+
+
+def generate_corpus(size: int, folder: Path) -> None:
+    """Write a notes.db with that many notes, plus a tenth of it as private notes and another tenth in the trash.
+       It runs in a process of its own, with the folder as working directory"""
+    from PySide6.QtWidgets import QApplication
+    from benchmarks.compact_html import build_notes
+    from source.NoteText import QT_BLOCK_STYLE, TEXT_COLUMNS, get_text_columns
+    from source.Notepad import PrepareDatabase
+    from source.Storage import Storage
+    app = QApplication.instance() or QApplication(sys.argv)
+    bodies = build_notes(DISTINCT_BODIES)
+    folder.joinpath("notes").mkdir(parents=True, exist_ok=True)
+    PrepareDatabase()
+    storage = Storage.get()
+
+    def rows(amount: int, name: str):
+        for i in range(amount):
+            body = bodies[i % len(bodies)].replace(
+                "</body>", f'\n<p style=" {QT_BLOCK_STYLE}">{name} {i}</p></body>')
+            yield f"{name} {i}", storage.encode_content(body), *get_text_columns(body)
+
+    columns = f"title, content, {', '.join(TEXT_COLUMNS)}"
+    marks = ", ".join("?" * (len(TEXT_COLUMNS) + 2))
+    with storage.write() as connection:
+        connection.executemany(f"INSERT INTO notes ({columns}) VALUES ({marks})", rows(size, "nota"))
+        connection.executemany(f"INSERT INTO private_notes ({columns}) VALUES ({marks})", rows(size // 10, "privada"))
+        connection.executemany(f"INSERT INTO notes_deleted ({columns}, deleted_at, deleted_from) "
+                               f"VALUES ({marks}, ?, ?)",
+                               ((*row, f"2024-{i % 12 + 1:02}-{i % 28 + 1:02} 10:00:{i % 60:02}",
+                                 "notes" if i % 3 else "private_notes")
+                                for i, row in enumerate(rows(size // 10, "borrada"))))
+    with storage.write() as connection:
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # <-- The copies only need notes.db
+    storage.close()
+    del app
+
+
+def get_stats(samples: list) -> dict:
+    """Summary of the samples of a measure, in milliseconds"""
+    return {"median_ms": round(statistics.median(samples), 3), "min_ms": round(min(samples), 3),
+            "max_ms": round(max(samples), 3), "samples": [round(sample, 3) for sample in samples]}
+
+
+def measure_size(repeat: int) -> dict:
+    """Measure every phase on the database in the working directory. It runs in a process of its own"""
+    started = time.perf_counter()
+    from PySide6.QtWidgets import QApplication
+    from source.Notepad import PrepareDatabase
+    from source.Storage import Storage
+    imported = time.perf_counter()
+    results = {"import": [(imported - started) * 1000]}
+
+    def timed(name: str, function, times: int = repeat, wait=None) -> None:
+        for _ in range(times):
+            sample = time.perf_counter()
+            function()
+            if wait is not None:
+                wait()
+            results.setdefault(name, []).append((time.perf_counter() - sample) * 1000)
+
+    timed("PrepareDatabase", PrepareDatabase, times=1)
+    app = QApplication.instance() or QApplication(sys.argv)
+    from source import Gui
+    gui = None
+
+    def build_gui():
+        nonlocal gui
+        gui = Gui.GUI(app=app)
+    timed("GUI", build_gui, times=1)
+    timed("GUI.show", gui.show, times=1, wait=app.processEvents)
+    worker = Storage.get().get_worker()
+
+    def settle():
+        while worker.pending:
+            app.processEvents()
+            time.sleep(0.0005)
+        app.processEvents()
+
+    notepad = gui.notes.notepad
+    timed("SQLNotepad.reload_notes", notepad.reload_notes)
+    timed("SQLNotepad.reload_private_notes", notepad.reload_private_notes)
+    timed("SQLNotepad.reload_deleted_notes", notepad.reload_deleted_notes)
+    timed("NotesTab.populate_notes_layout", gui.notes.populate_notes_layout, wait=app.processEvents)
+    # Saves: what the GUI thread pays for each one, and then what the writer needs to store them
+    ids = list(notepad.notes.keys())[:SAVES_PER_SAMPLE]
+    body = notepad.notes[ids[0]][1]
+    for sample in range(repeat):
+        started = time.perf_counter()
+        for _id in ids:
+            notepad.save_note(_id, notepad.notes[_id][0], body.replace("</body>", f"{sample}</body>"), "notes")
+        results.setdefault("SQLNotepad.save_note", []).append((time.perf_counter() - started) * 1000 / len(ids))
+        timed(f"NotepadWriter.flush ({len(ids)} saves)", notepad.writer.flush, times=1)
+    # Trash: building the tab, then reloading its first page
+    timed("DeletedNotesTab", lambda: gui.tab_widget.setCurrentWidget(gui.deleted_notes_tab), times=1, wait=settle)
+    timed("DeletedNotesTab.populate_table", gui.deleted_notes.populate_table, wait=settle)
+    storage = Storage.get()
+    settings = {"virtual_notes": gui.settings.VIRTUAL_NOTES, "lazy_bodies": storage.lazy_bodies,
+                "compress_content": storage.compress_content, "compact_html": storage.compact_html,
+                "notes": len(notepad.notes), "private_notes": len(notepad.private_notes),
+                "deleted_notes": len(notepad.deleted_notes),
+                "db_bytes": storage.db_path.stat().st_size}
+    gui.close()
+    notepad.close()
+    return {"settings": settings, "results": {name: get_stats(samples) for name, samples in results.items()}}
+
+
+def prepare_run(size: int, classic: bool) -> Path:
+    """Return a new working directory with a copy of the corpus of that size, generating it the first time"""
+    corpus = CORPORA.joinpath(f"v{CORPUS_VERSION}_{size}")
+    if not corpus.joinpath("notes", "notes.db").exists():
+        print(f"Generating a database with {size:,} notes in {corpus}...")
+        shutil.rmtree(corpus, ignore_errors=True)
+        corpus.mkdir(parents=True)
+        run_child(["--generate", str(size)], corpus)
+    folder = Path(tempfile.mkdtemp(prefix=f"unmemorize_bench_{size}_"))
+    folder.joinpath("notes").mkdir()
+    shutil.copy(corpus.joinpath("notes", "notes.db"), folder.joinpath("notes", "notes.db"))
+    shutil.copytree(MAIN_FOLDER.joinpath("resources"), folder.joinpath("resources"))
+    with open(folder.joinpath("program_settings.ini"), "w", encoding="UTF-8") as file:
+        file.write(f"[Settings]\ntheme=0\nvirtual_notes={'false' if classic else 'true'}\n")
+    return folder
+
+
+def run_child(arguments: list, folder: Path) -> str:
+    """Run this module in another process, inside the folder, without a screen. Returns what it printed"""
+    environment = dict(os.environ, QT_QPA_PLATFORM="offscreen", PYTHONPATH=str(MAIN_FOLDER))
+    environment.pop("UNMEMORIZE_TRACE", None)
+    process = subprocess.run([sys.executable, "-m", "benchmarks.suite", *arguments], cwd=folder, env=environment,
+                             capture_output=True, text=True, encoding="UTF-8")
+    if process.returncode != 0:
+        raise RuntimeError(f"The benchmark process failed:\n{process.stderr}")
+    return process.stdout
+
+
+def get_commit() -> str:
+    """Return the commit being measured, with a + if there are uncommitted changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=MAIN_FOLDER, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=MAIN_FOLDER,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("+" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes: list, repeat: int, classic: bool, output: Path = None) -> Path:
+    """Measure every size and write the results"""
+    import PySide6
+    commit = get_commit()
+    report = {"commit": commit, "date": datetime.now().isoformat(timespec="seconds"),
+              "platform": platform.platform(), "python": platform.python_version(), "pyside": PySide6.__version__,
+              "repeat": repeat, "sizes": {}}
+    for size in sizes:
+        folder = prepare_run(size, classic)
+        try:
+            print(f"Measuring {size:,} notes...")
+            report["sizes"][str(size)] = json.loads(run_child(["--measure", str(repeat)], folder).splitlines()[-1])
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        print_results(report["sizes"][str(size)]["results"])
+    if output is None:
+        RESULTS.mkdir(parents=True, exist_ok=True)
+        output = RESULTS.joinpath(f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{commit.replace('+', '-dirty')}.json")
+    with open(output, "w", encoding="UTF-8") as file:
+        json.dump(report, file, indent=1)
+    print(f"Results written to {output}")
+    return output
+
+
+def print_results(results: dict) -> None:
+    """Print the measures of a size as a table"""
+    print(f"{'':<44}{'Median ms':>12}{'Min ms':>12}{'Max ms':>12}")
+    for name, stats in results.items():
+        print(f"{name:<44}{stats['median_ms']:>12.2f}{stats['min_ms']:>12.2f}{stats['max_ms']:>12.2f}")
+
+
+def compare(old_path: Path, new_path: Path) -> None:
+    """Print the medians of two runs side by side"""
+    with open(old_path, encoding="UTF-8") as file:
+        old = json.load(file)
+    with open(new_path, encoding="UTF-8") as file:
+        new = json.load(file)
+    print(f"{old['commit']} ({old['date']}) -> {new['commit']} ({new['date']})")
+    for size in sorted(set(old["sizes"]) & set(new["sizes"]), key=int):
+        print(f"\n{int(size):,} notes{'':<33}{'Before ms':>12}{'After ms':>12}{'Change':>10}")
+        old_results, new_results = old["sizes"][size]["results"], new["sizes"][size]["results"]
+        for name in new_results:
+            if name in old_results:
+                before, after = old_results[name]["median_ms"], new_results[name]["median_ms"]
+                change = f"{after / before - 1:+.0%}" if before else ""
+                print(f"{name:<44}{before:>12.2f}{after:>12.2f}{change:>10}")
+
+
+def get_option(name: str, default):
+    """Return the value after an option of the command line"""
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if "--generate" in sys.argv:
+        generate_corpus(int(get_option("--generate", 0)), Path.cwd())
+    elif "--measure" in sys.argv:
+        print(json.dumps(measure_size(int(get_option("--measure", REPEAT)))))
+    elif "--compare" in sys.argv:
+        compare(Path(get_option("--compare", "")), Path(sys.argv[sys.argv.index("--compare") + 2]))
+    else:
+        run([int(size) for size in str(get_option("--sizes", ",".join(map(str, SIZES)))).split(",")],
+            int(get_option("--repeat", REPEAT)), "--classic" in sys.argv,
+            Path(get_option("--output", None)) if "--output" in sys.argv else None)
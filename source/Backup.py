@@ -0,0 +1,141 @@
+# coding=utf-8
+"""Code by Aens"""
+from datetime import datetime, timedelta
+from pathlib import Path
+import gzip
+import shutil
+import sqlite3
+import time
+from source.StorageWorker import StorageWorker
+
+BACKUP_PREFIX = "notes_backup_"  # <-- Every backup in the notes folder is named like this, old ones included
+MIGRATION_PREFIX = "notes_premigration_"  # <-- The ones made before updating the database, never rotated
+BACKUP_SUFFIXES = (".db", ".db.gz")
+PAGES_PER_STEP = 256  # <-- 1MB with the default 4KB pages, copied each step
+STEP_PAUSE = 0.005  # <-- Seconds to wait between steps, so the disk is never hogged by the backup
+MAX_RESTARTS = 3  # <-- Times the copy can start again because of a write, then it's copied in a single step
+KEEP_BACKUPS = 10
+INTERVAL_HOURS = 24  # <-- Time between scheduled backups, 0 to not make them
+
+
+class BackupRestarted(Exception):
+    """The database was written too many times while it was being copied"""
+
+
+def create_backup(storage, folder: Path, compress: bool = False, pages: int = PAGES_PER_STEP,
+                  pause: float = STEP_PAUSE, prefix: str = BACKUP_PREFIX) -> Path:
+    """Copy the live database into a new backup file with the SQLite backup API, a few pages at a time.
+       It reads through its own read-only connection, so it never blocks anyone, and SQLite makes sure the copy is
+       consistent: if the database is written in the middle, the copy starts again. After MAX_RESTARTS it's copied
+       in a single step instead, which reads a single snapshot and can't start again. Returns the path of the backup"""
+    name = f"{prefix}{datetime.now().strftime('%y-%m-%d %H_%M_%S')}"
+    path = folder.joinpath(f"{name}.db")
+    copy = 1
+    while path.exists() or path.with_suffix(".db.gz").exists():  # <-- Never overwrite one made the same second
+        copy += 1
+        path = folder.joinpath(f"{name}_{copy}.db")
+    source = storage.connect(readonly=True)
+    target = sqlite3.connect(path)
+    steps = {"remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        if steps["remaining"] is not None and remaining >= steps["remaining"]:  # <-- It started again
+            steps["restarts"] += 1
+            if steps["restarts"] > MAX_RESTARTS:
+                raise BackupRestarted()
+        steps["remaining"] = remaining
+        time.sleep(pause)
+
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except BackupRestarted:
+            source.backup(target, pages=-1)
+        result = target.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"The backup is damaged: {result}")
+        target.execute("PRAGMA journal_mode = DELETE")  # <-- A single file, the backup has no WAL next to it
+    except BaseException:
+        target.close()
+        path.unlink(missing_ok=True)
+        raise
+    finally:
+        source.close()
+    target.close()
+    if compress:
+        compressed = path.with_suffix(".db.gz")
+        with open(path, "rb") as file, gzip.open(compressed, "wb", compresslevel=6) as gzip_file:
+            shutil.copyfileobj(file, gzip_file, 1024 * 1024)
+        path.unlink()
+        path = compressed
+    return path
+
+
+def list_backups(folder: Path) -> list:
+    """Return the backups in the folder, the newest first"""
+    backups = [path for path in folder.glob(f"{BACKUP_PREFIX}*") if path.name.endswith(BACKUP_SUFFIXES)]
+    return sorted(backups, key=lambda path: path.stat().st_mtime, reverse=True)
+
+
+def rotate_backups(folder: Path, keep: int) -> list:
+    """Delete the oldest backups, so only the newest ones are kept. Returns the deleted ones"""
+    deleted = list_backups(folder)[max(1, keep):]  # <-- The newest is never deleted
+    for path in deleted:
+        path.unlink(missing_ok=True)
+    return deleted
+
+
+class BackupManager:
+    """Makes the backups of notes.db in a thread of its own, when asked for and every few hours,
+       and deletes the oldest ones so only the last few are kept"""
+
+    def __init__(self, storage, folder: Path):
+        """Nothing runs until a backup is asked for. It must be created from the GUI thread"""
+        self.storage = storage
+        self.folder = folder
+        self.compress = False
+        self.keep = KEEP_BACKUPS
+        self.interval_hours = INTERVAL_HOURS
+        self.worker = StorageWorker()  # <-- Not the one of the notepads, a backup must not delay their commands
+        self.running = False
+
+    def backup(self, callback=None, errback=None) -> bool:
+        """Make a backup in the background and rotate the old ones. Returns False if one is already running
+           :param callback: callable(path) that runs in the GUI thread once it's done
+           :param errback: callable(error) that runs in the GUI thread if it failed"""
+        if self.running:
+            return False
+        self.running = True
+
+        def done(path):
+            self.running = False
+            if callback is not None:
+                callback(path)
+
+        def failed(error):
+            self.running = False
+            if errback is not None:
+                errback(error)
+
+        self.worker.run(self.make_backup, self.compress, self.keep, callback=done, errback=failed)
+        return True
+
+    def make_backup(self, compress: bool, keep: int) -> Path:
+        """Runs in the backup thread"""
+        path = create_backup(self.storage, self.folder, compress=compress)
+        rotate_backups(self.folder, keep)
+        return path
+
+    def is_due(self) -> bool:
+        """Check if it's time for a scheduled backup"""
+        if self.interval_hours <= 0 or self.running:
+            return False
+        backups = list_backups(self.folder)
+        if not backups:
+            return True
+        last = datetime.fromtimestamp(backups[0].stat().st_mtime)
+        return datetime.now() - last >= timedelta(hours=self.interval_hours)
+
+    def close(self) -> None:
+        """Wait for a backup that is still running"""
+        self.worker.close()
@@ -0,0 +1,156 @@
+# coding=utf-8
+"""Code by Aens"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import sys
+from source.ContentCodec import decode_content
+
+FETCH_CHUNK = 500  # <-- Bodies read per query when many are needed at once
+
+
+class BodyCache:
+    """The contents of the notes, read from the database only when something needs them.
+       The least used ones are forgotten once the cache goes over its memory limit"""
+
+    def __init__(self, storage, max_bytes: int):
+        """Initialize the empty cache"""
+        self.storage = storage  # <-- Pointer to the storage that owns the connections
+        self.max_bytes = max_bytes
+        self.bodies = OrderedDict()  # The content is {("notes", 1): content}, the newest used last
+        self.size = 0  # <-- Bytes used by the cached contents
+        # Status
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, table: str, _id: int):
+        """Return the content of a note, reading it from the database if it isn't cached"""
+        key = (table, _id)
+        if key in self.bodies:
+            self.hits += 1
+            self.bodies.move_to_end(key)
+            return self.bodies[key]
+        self.misses += 1
+        with self.storage.read() as connection:
+            row = connection.execute(f"SELECT content FROM {table} WHERE id = ?", (_id,)).fetchone()
+        content = decode_content(row[0]) if row else None
+        self.put(table, _id, content)
+        return content
+
+    def get_many(self, table: str, ids: list) -> dict:
+        """Return the contents of many notes as {_id: content}, reading the missing ones with a few queries"""
+        contents = {}
+        missing = []
+        for _id in ids:
+            if (table, _id) in self.bodies:
+                self.hits += 1
+                contents[_id] = self.bodies[(table, _id)]
+            else:
+                missing.append(_id)
+        self.misses += len(missing)
+        with self.storage.read() as connection:
+            for start in range(0, len(missing), FETCH_CHUNK):
+                chunk = missing[start:start + FETCH_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                for _id, content in connection.execute(f"SELECT id, content FROM {table} "
+                                                       f"WHERE id IN ({placeholders})", chunk):
+                    contents[_id] = decode_content(content)
+        for _id in missing:
+            self.put(table, _id, contents.setdefault(_id, None))
+        return contents
+
+    def peek(self, table: str, _id: int, default=None):
+        """Return the content of a note only if it's cached, never reading the database"""
+        key = (table, _id)
+        if key not in self.bodies:
+            return default
+        self.hits += 1
+        self.bodies.move_to_end(key)
+        return self.bodies[key]
+
+    def put(self, table: str, _id: int, content) -> None:
+        """Remember the newest content of a note, forgetting the least used ones if there is no room"""
+        self.forget(table, _id)
+        self.bodies[(table, _id)] = content
+        self.size += sys.getsizeof(content)
+        while self.size > self.max_bytes and len(self.bodies) > 1:
+            _, old_content = self.bodies.popitem(last=False)
+            self.size -= sys.getsizeof(old_content)
+            self.evictions += 1
+
+    def forget(self, table: str, _id: int) -> None:
+        """Drop the content of a note, because it changed somewhere else or it no longer exists"""
+        if (table, _id) in self.bodies:
+            self.size -= sys.getsizeof(self.bodies.pop((table, _id)))
+
+    def get_status(self) -> dict:
+        """Return how full the cache is and how well it's doing"""
+        return {"entries": len(self.bodies),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
+
+
+class LazyRecords(MutableMapping):
+    """The notes of a table as {_id: (title, content, *metadata)}, like the dicts of SQLNotepad.
+       Only the titles and metadata live here, the contents are asked to the body cache when they are read"""
+
+    def __init__(self, bodies: BodyCache, table: str):
+        """Initialize the empty records of the table"""
+        self.bodies = bodies
+        self.table = table
+        self.fields = {}  # The content is {1: (title, *metadata)}, in the order they must be shown
+        self.overrides = {}  # The content is {1: content}, contents that were set here and must win over the cache
+
+    def add(self, _id: int, title: str, *metadata) -> None:
+        """Add a note without reading its content"""
+        self.fields[_id] = (title, *metadata)
+
+    def __getitem__(self, _id: int) -> tuple:
+        title, *metadata = self.fields[_id]
+        content = self.overrides[_id] if _id in self.overrides else self.bodies.get(self.table, _id)
+        return title, content, *metadata
+
+    def get_title(self, _id: int) -> str:
+        """Return the title of a note without reading its content"""
+        return self.fields[_id][0]
+
+    def peek(self, _id: int, content) -> tuple:
+        """Return the record of a note without reading the database: if its content isn't cached it's this one.
+           Only for contents that are known to be current, every change of a content goes through the body cache"""
+        title, *metadata = self.fields[_id]
+        content = self.overrides[_id] if _id in self.overrides else self.bodies.peek(self.table, _id, content)
+        return title, content, *metadata
+
+    def __setitem__(self, _id: int, record: tuple) -> None:
+        self.fields[_id] = (record[0], *record[2:])
+        self.overrides[_id] = record[1]
+
+    def __delitem__(self, _id: int) -> None:
+        del self.fields[_id]
+        self.overrides.pop(_id, None)
+
+    def __contains__(self, _id) -> bool:
+        return _id in self.fields  # <-- Without reading the content
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def clear(self) -> None:
+        self.fields.clear()
+        self.overrides.clear()
+
+    def items(self):
+        """Yield every (_id, record), reading the missing contents in chunks instead of one by one"""
+        ids = list(self.fields)
+        for start in range(0, len(ids), FETCH_CHUNK):
+            chunk = ids[start:start + FETCH_CHUNK]
+            contents = self.bodies.get_many(self.table, [_id for _id in chunk if _id not in self.overrides])
+            for _id in chunk:
+                title, *metadata = self.fields[_id]
+                yield _id, (title, self.overrides.get(_id, contents.get(_id)), *metadata)
@@ -0,0 +1,161 @@
+# coding=utf-8
+"""Code by Aens"""
+import threading
+from source.ContentCodec import decode_content
+from source.Metrics import Metrics
+from source.NoteText import TEXT_COLUMNS, get_text_columns
+
+WATCHED_TABLES = ("notes", "private_notes", "notes_deleted")
+MAX_CHANGED_ROWS = 500  # <-- Past this many changed notes in a table, reloading it whole is cheaper than merging
+METRICS = Metrics.get()
+
+
+class ChangeWatcher:
+    """Notices what other programs, or another instance of this one, changed in notes.db, and reads only those notes.
+       PRAGMA data_version tells for almost free if anyone else committed, and then the watermarks of each table,
+       its amount of notes and the last change stamp (see migration 8), tell which tables and which notes changed.
+       The commits of this program also move data_version, they only advance the watermarks without reading notes.
+       It only works with the database, the GUI polls it and runs the reads in the storage worker"""
+
+    def __init__(self, storage):
+        """Take the watermarks of what is in the database right now, so only what changes from here is reported"""
+        self.storage = storage
+        # Its own connection: data_version only changes with the commits of the other ones, and must be always
+        # compared on the same connection
+        self.connection = storage.connect(readonly=True)
+        self.lock = threading.Lock()  # <-- The GUI thread polls while the storage worker may be reading
+        self.data_version = None
+        self.foreign_version = None  # <-- See Storage.get_foreign_version
+        self.watermarks = {}  # The content is {"notes": (count, last_stamp)}
+        self.ids = {}  # The content is {"notes": {1, 2, 3}}, to tell which notes were deleted
+        # Status
+        self.checks = 0
+        self.fetched_rows = 0
+        self.full_reloads = 0
+        self.refreshed_texts = 0
+        self.skipped_fetches = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget what was reported so far and take the watermarks again"""
+        with self.lock:
+            self.data_version = self.get_data_version()
+            self.foreign_version = self.storage.get_foreign_version()
+            with self.snapshot() as connection:
+                for table in WATCHED_TABLES:
+                    self.watermarks[table] = self.read_watermark(connection, table)
+                    self.ids[table] = {_id for (_id,) in connection.execute(f"SELECT id FROM {table}")}
+
+    def get_data_version(self) -> int:
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def snapshot(self):
+        """Read everything that follows in a single transaction, so the tables don't change in the middle"""
+        self.connection.execute("BEGIN")
+        return self.connection  # <-- Used as a context manager, it commits at the end
+
+    @staticmethod
+    def read_watermark(connection, table: str) -> tuple:
+        """Return the (count, last_stamp) of a table, both are read from the index of the stamps"""
+        count = connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        stamp = connection.execute(f"SELECT ifnull(max(changed), 0) FROM {table}").fetchone()[0]
+        return count, stamp
+
+    def has_changed(self) -> bool:
+        """Check if anything was committed since the last look, it only asks the connection for a number"""
+        with self.lock:
+            self.checks += 1
+            return self.get_data_version() != self.data_version
+
+    @METRICS.timed()
+    def fetch_changes(self) -> dict:
+        """Read the notes that changed since the last look, it runs in the storage worker.
+           Returns {table: (rows, removed_ids)} with only the tables that changed, where rows are [(id, title, content)]
+           with the content as it's stored, new notes included. A table with too many changes to merge them is
+           {table: None}, it must be reloaded whole"""
+        changes = {}
+        stale = []  # The content is [(table, _id, content, text_columns)], see refresh_text_columns
+        with self.lock:
+            self.data_version = self.get_data_version()  # <-- First, anything committed from here is seen next time
+            foreign_version = self.storage.get_foreign_version()
+            try:
+                with self.snapshot() as connection:
+                    watermarks = {table: self.read_watermark(connection, table) for table in WATCHED_TABLES}
+                    # Nothing else committed before or while the snapshot was taken, so it only has own commits
+                    own = foreign_version == self.foreign_version == self.storage.get_foreign_version()
+                    for table, watermark in watermarks.items():
+                        if watermark == self.watermarks[table]:
+                            continue
+                        if own:
+                            self.read_own_changes(connection, table, watermark)
+                        else:
+                            changes[table] = self.read_table_changes(connection, table, watermark, stale)
+                        self.watermarks[table] = watermark
+            except Exception:
+                self.data_version = None  # <-- So the next check tries again
+                raise
+            self.foreign_version = foreign_version
+            if own:
+                self.skipped_fetches += 1
+        if stale:
+            self.refresh_text_columns(stale)
+        return changes
+
+    def read_table_changes(self, connection, table: str, watermark: tuple, stale: list):
+        """Return the (rows, removed_ids) of a table whose watermark moved, or None if it must be reloaded whole.
+           The notes whose stored text no longer matches their content are added to stale"""
+        count, _ = watermark
+        last_stamp = self.watermarks[table][1]
+        changed = connection.execute(f"SELECT count(*) FROM {table} WHERE changed > ?", (last_stamp,)).fetchone()[0]
+        if changed > MAX_CHANGED_ROWS:
+            self.ids[table] = {_id for (_id,) in connection.execute(f"SELECT id FROM {table}")}
+            self.full_reloads += 1
+            return None
+        rows = []
+        for _id, title, content, plain_text in connection.execute(f"SELECT id, title, content, plain_text FROM {table} "
+                                                                  f"WHERE changed > ? ORDER BY id", (last_stamp,)):
+            text_columns = get_text_columns(decode_content(content, expand=False))
+            if text_columns[-1] != plain_text:  # <-- Written by something that only knew about the content
+                stale.append((table, _id, content, text_columns))
+            rows.append((_id, title, content))
+        self.fetched_rows += len(rows)
+        ids = self.ids[table]
+        ids.update(_id for _id, _, _ in rows)
+        removed = set()
+        if len(ids) != count:  # <-- Some notes were deleted, only their ids can tell which ones
+            existing = {_id for (_id,) in connection.execute(f"SELECT id FROM {table}")}
+            removed = ids - existing
+            self.ids[table] = existing
+        return rows, removed
+
+    def read_own_changes(self, connection, table: str, watermark: tuple) -> None:
+        """Follow the ids of a table that only this program changed, nothing has to be read or reported"""
+        count, _ = watermark
+        ids = self.ids[table]
+        ids.update(_id for (_id,) in connection.execute(f"SELECT id FROM {table} WHERE changed > ?",
+                                                         (self.watermarks[table][1],)))
+        if len(ids) != count:
+            self.ids[table] = {_id for (_id,) in connection.execute(f"SELECT id FROM {table}")}
+
+    def refresh_text_columns(self, stale: list) -> None:
+        """Store again the text, preview and counts of the notes another program changed without them, see
+           TEXT_COLUMNS in source/NoteText.py. The search index follows the text through its triggers. It can't be
+           done by a trigger on the content, as other programs don't have note_text(). A note changed again meanwhile
+           is left for the next look"""
+        columns = ", ".join(f"{column} = ?" for column in TEXT_COLUMNS)
+        with self.storage.write() as connection:
+            for table, _id, content, text_columns in stale:
+                connection.execute(f"UPDATE {table} SET {columns} WHERE id = ? AND content IS ?",
+                                   (*text_columns, _id, content))
+        self.refreshed_texts += len(stale)
+
+    def get_status(self) -> dict:
+        """Return how much the watcher has been working"""
+        with self.lock:
+            return {"checks": self.checks, "fetched_rows": self.fetched_rows, "full_reloads": self.full_reloads,
+                    "refreshed_texts": self.refreshed_texts, "skipped_fetches": self.skipped_fetches,
+                    "data_version": self.data_version}
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""Code by Aens"""
+import sqlite3
+import time
+import zlib
+from source.NoteText import expand_html
+
+MAGIC = b"\x00UZ"  # <-- Compressed contents start with this. HTML never starts with a NUL, so old contents are safe
+FORMAT_VERSION = 1  # <-- Goes right after the magic, so the dictionary can change without breaking old contents
+LEVEL = 9  # <-- Notes are small, so the best compression is still fast
+CONTENT_TABLES = ("notes", "private_notes", "notes_deleted")
+CHUNK_SIZE = 500  # <-- Rows converted per transaction by the migration
+
+# Preset dictionary with the boilerplate of QTextEdit.toHtml(), so even the first note compresses well.
+# The most common strings go last, zlib finds them faster. NEVER change a published one, add a new version instead
+ZDICT_V1 = (
+    '<span style=" font-weight:700;"></span><span style=" font-style:italic;"></span>'
+    '<span style=" text-decoration: underline;"></span><span style=" color:#'
+    '; background-color:#'
+    '<a href="http'
+    '<p style="-qt-paragraph-type:empty; margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; '
+    '-qt-block-indent:0; text-indent:0px;"><br /></p>\n'
+    '<ul style="margin-top: 0px; margin-bottom: 0px; margin-left: 0px; margin-right: 0px; -qt-list-indent: 1;">\n'
+    '<ol style="margin-top: 0px; margin-bottom: 0px; margin-left: 0px; margin-right: 0px; -qt-list-indent: 1;">\n'
+    '</li></ul></li></ol>'
+    '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0//EN" "http://www.w3.org/TR/REC-html40/strict.dtd">\n'
+    '<html><head><meta name="qrichtext" content="1" /><meta charset="utf-8" /><style type="text/css">\n'
+    'p, li { white-space: pre-wrap; }\n'
+    'hr { height: 1px; border-width: 0; }\n'
+    'li.unchecked::marker { content: "\\2610"; }\n'
+    'li.checked::marker { content: "\\2612"; }\n'
+    '</style></head><body style=" font-family:\'Segoe UI\'; font-size:9pt; font-weight:400; font-style:normal;">\n'
+    '</p></body></html>'
+    '<li style=" margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; '
+    'text-indent:0px;">'
+    '</p>\n<p style=" margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; '
+    'text-indent:0px;">'
+).encode("UTF-8")
+DICTIONARIES = {1: ZDICT_V1}
+
+
+def encode_content(content: str) -> bytes:
+    """Compress the HTML of a note into the stored format"""
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=DICTIONARIES[FORMAT_VERSION])
+    data = compressor.compress(content.encode("UTF-8")) + compressor.flush()
+    return MAGIC + bytes((FORMAT_VERSION,)) + data
+
+
+def decode_content(value, expand: bool = True):
+    """Return the HTML of a stored content, compressed or not. NULL contents stay as None
+       :param expand: False to leave compact HTML as it is, when only the text matters"""
+    if isinstance(value, bytes):
+        if value.startswith(MAGIC):
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DICTIONARIES[value[len(MAGIC)]])
+            value = decompressor.decompress(value[len(MAGIC) + 1:]) + decompressor.flush()
+        value = value.decode("UTF-8")
+    return expand_html(value) if expand else value
+
+
+def is_compressed(value) -> bool:
+    """Check if a stored content is in the compressed format"""
+    return isinstance(value, bytes) and value.startswith(MAGIC)
+
+
+def get_size(value) -> int:
+    """Return the bytes a stored content takes"""
+    return len(value) if isinstance(value, bytes) else len(value.encode("UTF-8"))
+
+
+def convert_contents(connection: sqlite3.Connection, encode) -> dict:
+    """Rewrite the content of every note in place with a new stored format, a chunk per transaction, so it can be
+       interrupted and run again. Returns the statistics of the conversion
+       :param encode: callable(html) that returns the content as it must be stored"""
+    stats = {"rows": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0, "encode_seconds": 0.0,
+             "decode_seconds": 0.0}
+    for table in CONTENT_TABLES:
+        last_id = 0
+        while True:
+            rows = connection.execute(f"SELECT id, content FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                                      (last_id, CHUNK_SIZE)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for _id, value in rows:
+                stats["rows"] += 1
+                if value is None:
+                    continue
+                stats["bytes_before"] += get_size(value)
+                started = time.perf_counter()
+                content = decode_content(value)
+                stats["decode_seconds"] += time.perf_counter() - started
+                started = time.perf_counter()
+                new_value = encode(content)
+                stats["encode_seconds"] += time.perf_counter() - started
+                stats["bytes_after"] += get_size(new_value)
+                if new_value != value:  # <-- Only the rows whose stored format changes
+                    updates.append((new_value, _id))
+            connection.executemany(f"UPDATE {table} SET content = ? WHERE id = ?", updates)
+            connection.commit()
+            stats["converted"] += len(updates)
+    return stats
@@ -0,0 +1,165 @@
+# coding=utf-8
+"""Code by Aens"""
+from datetime import datetime
+from PySide6.QtWidgets import QApplication, QWidget, QTextEdit, QPlainTextEdit
+import gc
+import os
+import sys
+import tracemalloc
+
+DOCUMENT_BLOCK_BYTES = 400  # <-- Rough memory of a paragraph of a QTextDocument with its layout, besides its text
+TOP_ALLOCATIONS = 15
+TRACE_FRAMES = 1  # <-- Only the line that allocated, more frames make tracing much slower
+
+
+def get_process_memory():
+    """Return the memory the process is using right now in bytes, or None if this system doesn't say"""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+
+            class MemoryCounters(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                    (name, ctypes.c_size_t) for name in (
+                        "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                        "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage",
+                        "PeakPagefileUsage")]
+
+            counters = MemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                            ctypes.byref(counters), counters.cb):
+                return None
+            return counters.WorkingSetSize
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_strings_size(values) -> int:
+    """Return the bytes taken by the strings among the values, and inside their tuples"""
+    size = 0
+    for value in values:
+        if isinstance(value, tuple):
+            size += sum(sys.getsizeof(item) for item in value if isinstance(item, (str, bytes)))
+        elif isinstance(value, (str, bytes)):
+            size += sys.getsizeof(value)
+    return size
+
+
+def get_records_memory(records) -> dict:
+    """Return the entries and bytes of the notes a notepad holds. Only what is in memory is counted,
+       the contents that lazy records read from the body cache are counted there"""
+    if hasattr(records, "overrides"):  # <-- LazyRecords, reading its values would load every content
+        values = tuple(records.fields.values()) + tuple(records.overrides.values())
+    else:
+        values = tuple(records.values())
+    return {"entries": len(records), "bytes": get_strings_size(values)}
+
+
+def get_widgets_memory(widget: QWidget) -> dict:
+    """Return how many widgets and text editors are under a widget, and what their documents take, roughly"""
+    widgets = widget.findChildren(QWidget)
+    editors = [child for child in widgets if isinstance(child, (QTextEdit, QPlainTextEdit))]
+    characters = blocks = 0
+    for editor in editors:
+        document = editor.document()
+        characters += document.characterCount()
+        blocks += document.blockCount()
+    return {"widgets": len(widgets), "text_editors": len(editors), "characters": characters, "blocks": blocks,
+            "document_bytes": characters * 2 + blocks * DOCUMENT_BLOCK_BYTES}  # <-- Qt stores text as UTF-16
+
+
+def build_memory_report(gui) -> dict:
+    """Return where the memory of the program goes: per tab, per floating window, per cache and, if tracing is
+       on, the lines of Python that allocated the most"""
+    report = {"date": datetime.now().isoformat(timespec="seconds"), "process_bytes": get_process_memory(),
+              "python_objects": len(gc.get_objects()), "tabs": {}, "windows": {}, "caches": {}}
+    tab_widget = gui.tab_widget
+    for index in range(tab_widget.count()):
+        page = tab_widget.widget(index)
+        name = tab_widget.tabText(index)
+        report["tabs"][name] = {"built": False} if page in gui.lazy_tabs else {"built": True,
+                                                                              **get_widgets_memory(page)}
+    for window in QApplication.topLevelWidgets():
+        if window is not gui and window.isVisible():
+            report["windows"][window.windowTitle() or type(window).__name__] = get_widgets_memory(window)
+    notepad = gui.notes.notepad
+    report["caches"]["Notas"] = get_records_memory(notepad.notes)
+    report["caches"]["Notas privadas"] = get_records_memory(notepad.private_notes)
+    report["caches"]["Notas borradas"] = get_records_memory(notepad.deleted_notes)
+    if notepad.bodies is not None:
+        status = notepad.bodies.get_status()
+        report["caches"]["Contenidos (caché)"] = {"entries": status["entries"], "bytes": status["bytes"],
+                                                  "max_bytes": status["max_bytes"]}
+    heads = tuple(notepad.revisions.heads.values())  # <-- A copy at once, the writer thread changes it
+    report["caches"]["Historial (últimas versiones)"] = {"entries": len(heads), "bytes": get_strings_size(heads)}
+    if gui.deleted_notes is not None:
+        rows = tuple(gui.deleted_notes.model.rows)
+        report["caches"]["Papelera (filas cargadas)"] = {"entries": len(rows), "bytes": get_strings_size(rows)}
+    themes = tuple(gui.themes.themes.values())
+    report["caches"]["Temas"] = {"entries": len(themes),
+                                 "bytes": get_strings_size(theme.stylesheet for theme in themes)}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["python_traced"] = {"bytes": current, "peak_bytes": peak}
+        report["allocations"] = get_top_allocations()
+    return report
+
+
+def get_top_allocations(limit: int = TOP_ALLOCATIONS) -> list:
+    """Return the lines that hold the most memory allocated since tracing started"""
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),  # <-- Not what the report itself allocates
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")))
+    return [{"line": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "bytes": stat.size,
+             "count": stat.count} for stat in snapshot.statistics("lineno")[:limit]]
+
+
+def set_allocation_tracing(enabled: bool) -> None:
+    """Start or stop tracing the allocations of Python. It makes everything slower while it's on"""
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def format_size(size) -> str:
+    """Return a size in bytes for humans"""
+    if size is None:
+        return "?"
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_memory_report(report: dict) -> str:
+    """Return the report as a text table"""
+    lines = [f"Memoria del proceso: {format_size(report['process_bytes'])}   "
+             f"Objetos de Python: {report['python_objects']:,}"]
+    if "python_traced" in report:
+        lines.append(f"Memoria de Python registrada: {format_size(report['python_traced']['bytes'])} "
+                     f"(pico: {format_size(report['python_traced']['peak_bytes'])})")
+    lines.append("")
+    lines.append(f"{'Pestaña / ventana':<34}{'Widgets':>9}{'Editores':>10}{'Documentos (aprox.)':>21}")
+    for name, stats in list(report["tabs"].items()) + list(report["windows"].items()):
+        if not stats.get("built", True):
+            lines.append(f"{name[:33]:<34}{'sin crear':>9}")
+            continue
+        lines.append(f"{name[:33]:<34}{stats['widgets']:>9,}{stats['text_editors']:>10,}"
+                     f"{format_size(stats['document_bytes']):>21}")
+    lines.append("")
+    lines.append(f"{'Caché':<34}{'Entradas':>9}{'Textos':>31}")
+    for name, stats in report["caches"].items():
+        lines.append(f"{name[:33]:<34}{stats['entries']:>9,}{format_size(stats['bytes']):>31}")
+    if report.get("allocations"):
+        lines.append("")
+        lines.append("Líneas que más memoria reservaron desde que se activó el registro:")
+        for allocation in report["allocations"]:
+            lines.append(f"{format_size(allocation['bytes']):>10}{allocation['count']:>9,}  {allocation['line']}")
+    return "\n".join(lines)
@@ -5,14 +5,21 @@ from pathlib import Path
 from PySide6 import QtWidgets, QtCore
 from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import QApplication, QTabWidget
+from source.ChangeWatcher import ChangeWatcher
 from source.GuiNotesTab import NotesTab
 from source.GuiNotesDeletedTab import DeletedNotesTab
 from source.GuiPrivateNotesTab import PrivateNotesTab
+from source.GuiSearch import SearchWindow
 from source.GuiSettingsTab import SettingsTab
+from source.Metrics import Metrics
+from source.PreviewRenderer import PreviewRenderer
+from source.ThemeEngine import ThemeEngine, set_status_mode
+from source.Tracer import Tracer
 
 __VERSION__ = "v0.11"
 __AUTHOR__ = "Alex"
 RESOURCES = Path.cwd().joinpath("resources")
+EXTERNAL_CHANGES_INTERVAL = 2000  # <-- Milliseconds between checks for what other programs changed in the database
 
 
 class GUI(QtWidgets.QMainWindow):
@@ -25,12 +32,11 @@ class GUI(QtWidgets.QMainWindow):
         self.setWindowIcon(QIcon(str(RESOURCES.joinpath("MainIcon.png"))))
         self.setWindowTitle(f"Unmemorize {__VERSION__} by {__AUTHOR__}")
         # Statusbar
-        self.statusbar_default_themes = {
-                0: "background-color: #E9E9E9; color: black;",  # Gray theme
-                1: "background-color: #46494F; color: white;",  # Dark theme
-                2: "background-color: #A6D8FF; color: black;",  # Blue theme
-                3: "background-color: #58886B; color: black;"}  # Green theme
+        self.themes = ThemeEngine(app)  # <-- Applied by the settings tab, once it has read the theme
         self.statusBar = self.statusBar()
+        self.pending_writes_label = QtWidgets.QLabel("")  # <-- Shows the edits not written to disk yet
+        self.pending_writes_label.setObjectName("statusbarPermLabel")
+        self.statusBar.addPermanentWidget(self.pending_writes_label)
         # Create the tabs
         self.tab_widget = QTabWidget(self)
         self.notes_tab = QtWidgets.QWidget(self)
@@ -43,16 +49,42 @@ class GUI(QtWidgets.QMainWindow):
         self.tab_widget.addTab(self.deleted_notes_tab, "Notas Borradas")
         self.tab_widget.addTab(self.tasks_tab, "Lista de Tareas")
         self.tab_widget.addTab(self.settings_tab, "Opciones")
+        # Global search, at the right of the tabs
+        self.search_window = None
+        self.search_box = QtWidgets.QLineEdit(self)
+        self.search_box.setPlaceholderText("Buscar en todas las notas...")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.setMinimumWidth(250)
+        self.search_box.returnPressed.connect(self.search_notes)
+        self.tab_widget.setCornerWidget(self.search_box, QtCore.Qt.TopRightCorner)
         # Install an event filter on the main window
         self.installEventFilter(self)
-        # Create the Content of those tabs
-        self.settings = SettingsTab(self)  # <-- Settings must always be loaded before any other tab
-        self.notes = NotesTab(self)
-        self.deleted_notes = DeletedNotesTab(self)
-        self.private_notes = PrivateNotesTab(self)
+        # Create the Content of those tabs. Only the visible one is built now, the rest when they are shown first
+        tracer = Tracer.get()
+        with tracer.span("SettingsTab"):
+            self.settings = SettingsTab(self)  # <-- Settings must always be loaded before any other tab
+        with tracer.span("NotesTab"):
+            self.notes = NotesTab(self)  # <-- Always built, the rest of tabs use its notepad
+        self.private_notes = None
+        self.deleted_notes = None
+        self.lazy_tabs = {  # The content is {page: (attribute, class)}, the tabs not built yet
+            self.private_notes_tab: ("private_notes", PrivateNotesTab),
+            self.deleted_notes_tab: ("deleted_notes", DeletedNotesTab)}
+        self.stale_tabs = {}  # The content is {page: refresh}, what each hidden tab must do once it's shown
+        self.tab_widget.currentChanged.connect(self.activate_tab)
         # Set it to the main gui
         self.setCentralWidget(self.tab_widget)
         self.show_in_statusbar("Programa Listo")
+        # Keep an eye on the background writers of the notepads
+        self.pending_writes_timer = QtCore.QTimer(self)
+        self.pending_writes_timer.timeout.connect(self.check_pending_writes)
+        self.pending_writes_timer.start(500)
+        # Notice what other programs, or another window of this one, change in the database
+        self.change_watcher = ChangeWatcher(self.notes.notepad.storage)
+        self.fetching_changes = False  # <-- True while the storage worker reads them
+        self.external_changes_timer = QtCore.QTimer(self)
+        self.external_changes_timer.timeout.connect(self.check_external_changes)
+        self.external_changes_timer.start(EXTERNAL_CHANGES_INTERVAL)
 
     def eventFilter(self, watched, event):
         """Event filter to handle events on the main window"""
@@ -62,20 +94,95 @@ class GUI(QtWidgets.QMainWindow):
                     print("Window minimized")
             elif event.type() == QtCore.QEvent.Close:
                 self.settings.save_program_config()  # Store the window size to the config file
+                self.settings.backups.close()  # Let a backup that is running finish
+                self.notes.notepad.close()  # Write the edits that are still pending, for every notepad
+                self.external_changes_timer.stop()
+                self.change_watcher.close()
+                PreviewRenderer.get().close()  # Let the renders that are being saved finish
+                metrics = Metrics.get()
+                if metrics.output:  # <-- Asked for in the environment, see source/Metrics.py
+                    metrics.dump(metrics.output, extra={"storage": self.settings.get_storage_statuses()})
         return super().eventFilter(watched, event)
 
+    def activate_tab(self, index: int) -> None:
+        """Build a tab the first time it's shown, or bring it up to date if something changed while hidden"""
+        page = self.tab_widget.widget(index)
+        if page in self.lazy_tabs:
+            attribute, tab_class = self.lazy_tabs.pop(page)
+            with Tracer.get().span(tab_class.__name__):
+                setattr(self, attribute, tab_class(self))  # <-- It's built with everything up to date
+        elif page in self.stale_tabs:
+            self.stale_tabs.pop(page)()
+
+    def refresh_tab(self, page: QtWidgets.QWidget, refresh) -> None:
+        """Run the refresh of a tab now if it's visible, or once it's shown if it isn't.
+           Tabs not built yet don't need it, they will read everything when they are built"""
+        if page in self.lazy_tabs:
+            return
+        if self.tab_widget.currentWidget() is page:
+            refresh()
+        else:
+            self.stale_tabs[page] = refresh  # <-- Any older refresh is replaced, they all reload the whole tab
+
     def show_in_statusbar(self, message: str, mode: str = None) -> None:
         """Show something in the statusbar for a little bit"""
-        # Themed modes
-        if mode is None:
-            self.statusBar.setStyleSheet(self.statusbar_default_themes[self.settings.THEME])
-        # Set special modes
-        elif mode == "error":
-            self.statusBar.setStyleSheet("background-color: darkred; color: white;")
-        elif mode == "nothing":
-            self.statusBar.setStyleSheet("")
+        set_status_mode(self.statusBar, mode)  # <-- The theme already has the colors of every mode
         self.statusBar.showMessage(f"{datetime.now().strftime('%H:%M:%S')} - {message}")
 
+    def check_pending_writes(self) -> None:
+        """Show how many edits and commands are still waiting to be written, and any error the writers had"""
+        writer = self.notes.notepad.writer  # <-- Shared by all the notepads
+        pending = writer.get_status()["pending"] + self.notes.notepad.worker.pending
+        error = writer.pop_error()
+        if error is not None:
+            self.show_in_statusbar(f"ERROR: No he podido escribir las notas en el disco: {error}", mode="error")
+        self.pending_writes_label.setText(f"Cambios pendientes: {pending}" if pending else "")
+        self.pending_writes_label.setVisible(bool(pending))
+
+    def check_external_changes(self) -> None:
+        """Read the notes that changed in the database since the last look, only if anyone committed something"""
+        if self.fetching_changes or not self.change_watcher.has_changed():
+            return
+        self.fetching_changes = True
+        self.notes.notepad.worker.run(self.change_watcher.fetch_changes, callback=self.apply_external_changes,
+                                      errback=self.external_changes_failed)
+
+    def apply_external_changes(self, changes: dict) -> None:
+        """Refresh only the notes that changed in the tabs that are built, the rest read everything when built"""
+        self.fetching_changes = False
+        if "notes" in changes:
+            self.notes.apply_changes(changes["notes"])
+        if "private_notes" in changes and self.private_notes is not None:
+            self.private_notes.apply_changes(changes["private_notes"])
+        if "notes_deleted" in changes and self.deleted_notes is not None:
+            self.deleted_notes.apply_changes(changes["notes_deleted"])
+
+    def external_changes_failed(self, error: Exception) -> None:
+        """Try again on the next check"""
+        self.fetching_changes = False
+        print(f"The changes of the database couldn't be read: {error}")
+
+    def search_notes(self) -> None:
+        """Open a window with the notes that match the text of the search box"""
+        text = self.search_box.text().strip()
+        if not text:
+            return
+        if self.search_window is not None:
+            self.search_window.close()
+        self.search_window = SearchWindow(self, text)
+        self.search_window.show()
+
+    def show_note(self, table: str, _id: int) -> None:
+        """Go to the tab of the note and scroll to it"""
+        if table == "notes":
+            self.tab_widget.setCurrentWidget(self.notes_tab)
+            self.notes.notes_grid.scroll_to(_id)
+        elif table == "private_notes":
+            self.tab_widget.setCurrentWidget(self.private_notes_tab)
+            self.private_notes.private_notes_grid.scroll_to(_id)
+        elif table == "notes_deleted":
+            self.tab_widget.setCurrentWidget(self.deleted_notes_tab)
+
     def show_popup(self, message: str) -> None:
         """Show a Pop-up with a message"""
         QtWidgets.QMessageBox.information(self, "Informacion", message)
@@ -1,7 +1,13 @@
 # coding=utf-8
 """Code by Aens"""
-from PySide6 import QtWidgets
-from PySide6.QtWidgets import QTableWidget, QTableWidgetItem, QPushButton, QHeaderView, QTextBrowser
+from PySide6 import QtWidgets, QtCore
+from PySide6.QtCore import QAbstractTableModel, QModelIndex, QSize, QUrl, Qt, Signal
+from PySide6.QtWidgets import QTableView, QHeaderView, QStyledItemDelegate, QStyleOptionButton, QStyle
+from source.Metrics import Metrics
+from source.PreviewRenderer import PreviewRenderer
+
+TOOLTIP_SIZE = QSize(400, 300)  # <-- Size of the render of a note shown when the mouse is over its preview
+METRICS = Metrics.get()
 
 
 class DeletedNotesTab:
@@ -14,7 +20,10 @@ class DeletedNotesTab:
         self.settings = self.gui.settings  # <-- Pointer to the settings tab
         self.notepad = self.gui.notes.notepad  # <-- Pointer to the SQL Notepad
         # Create the Table and the tab
-        self.tableWidget = QTableWidget()
+        self.model = DeletedNotesModel(self.notepad)
+        self.tableView = QTableView()
+        self.restore_delegate = ActionDelegate("⏪", self.tableView)
+        self.delete_delegate = ActionDelegate("❌", self.tableView)
         self.create_deleted_notes_tab()  # Create the note tabs populating info from that memory
 
     ##########
@@ -24,68 +33,272 @@ class DeletedNotesTab:
     def create_deleted_notes_tab(self) -> None:
         """Create the private notes layout and sets it"""
         layout = QtWidgets.QVBoxLayout(self.this_tab)
-        # Create table widget
-        self.tableWidget.setColumnCount(6)
-        self.tableWidget.setHorizontalHeaderLabels(["Nombre", "Notas", "Tipo", "Fecha de borrado", "Restaurar", "Borrar"])
-        self.tableWidget.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)  # Adjust the width
-        self.tableWidget.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)  # Stretch the middle column
-        self.tableWidget.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)  # Adjust the width
-        self.tableWidget.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeToContents)  # Adjust the width
-        self.tableWidget.horizontalHeader().setSectionResizeMode(4, QHeaderView.ResizeToContents)  # Adjust the width
-        # Populate tables with data
-        self.notepad.reload_deleted_notes()  # Load the notes in memory
-        self.populate_table()
+        # Create table view, the rows are fetched by the model page by page while scrolling
+        self.tableView.setModel(self.model)
+        self.tableView.horizontalHeader().setSectionResizeMode(0, QHeaderView.Interactive)  # Let the user adjust it
+        self.tableView.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)  # Stretch the middle column
+        self.tableView.horizontalHeader().setSectionResizeMode(2, QHeaderView.Interactive)  # Let the user adjust it
+        self.tableView.horizontalHeader().setSectionResizeMode(3, QHeaderView.Interactive)  # Let the user adjust it
+        self.tableView.horizontalHeader().setSectionResizeMode(4, QHeaderView.Fixed)  # Only holds a button
+        self.tableView.horizontalHeader().setSectionResizeMode(5, QHeaderView.Fixed)  # Only holds a button
+        self.tableView.setColumnWidth(0, 200)
+        self.tableView.setColumnWidth(2, 100)
+        self.tableView.setColumnWidth(3, 150)
+        self.tableView.setColumnWidth(4, 80)
+        self.tableView.setColumnWidth(5, 80)
+        self.tableView.verticalHeader().setDefaultSectionSize(40)  # Set height to 40 pixels
+        self.tableView.setWordWrap(True)
+        # Buttons are painted by delegates instead of being real widgets on every row
+        self.tableView.setItemDelegateForColumn(4, self.restore_delegate)
+        self.tableView.setItemDelegateForColumn(5, self.delete_delegate)
+        self.restore_delegate.clicked.connect(
+            lambda row: self.restore_note(note_id=self.model.get_id(row), name=self.model.get_title(row)))
+        self.delete_delegate.clicked.connect(
+            lambda row: self.delete_forever(note_id=self.model.get_id(row), name=self.model.get_title(row)))
+        # Sorting is done by the database, only on the indexed columns
+        self.tableView.setSortingEnabled(True)
+        self.tableView.horizontalHeader().setSortIndicator(3, Qt.DescendingOrder)
+        self.tableView.horizontalHeader().sortIndicatorChanged.connect(self.keep_sort_indicator)
         # Add to the layout
-        layout.addWidget(self.tableWidget)
+        layout.addWidget(self.tableView)
         self.this_tab.setLayout(layout)
 
+    def keep_sort_indicator(self, column: int, _order) -> None:
+        """Put the indicator back on the column the notes are sorted by, if the clicked one can't be sorted"""
+        if column in self.model.SORTABLE_COLUMNS:
+            return
+        header = self.tableView.horizontalHeader()
+        header.blockSignals(True)  # <-- It's already sorted like this, don't reload it
+        header.setSortIndicator(self.model.get_sort_section(),
+                                Qt.DescendingOrder if self.model.descending else Qt.AscendingOrder)
+        header.blockSignals(False)
+
+    @METRICS.timed()
     def populate_table(self):
-        """Populate the table with its content"""
-        # Set a fixed amount of rows
-        self.notepad.reload_deleted_notes()  # Load the notes in memory
-        self.tableWidget.setRowCount(len(self.notepad.deleted_notes))
-        self.tableWidget.verticalHeader().setDefaultSectionSize(40)  # Set height to 50 pixels
-        # 2 - Iterate over the items that we have deleted
-        for i, (_id, values) in enumerate(self.notepad.deleted_notes.items()):
-            # 2.1 - Create the items
-            name_item = QTableWidgetItem(str(values[0]))
-            content_item = QTableWidgetItem()
-            text_browser = QTextBrowser()   # SPECIAL: Create a QTextBrowser to render HTML content
-            text_browser.setHtml(values[1])
-            text_browser.setToolTip(values[1])
-            type_item = QTableWidgetItem(str(values[3]))
-            date_item = QTableWidgetItem(str(values[2]))
-            # 2.2 - Set the record to the columns
-            self.tableWidget.setItem(i, 0, name_item)
-            self.tableWidget.setItem(i, 1, content_item)
-            self.tableWidget.setCellWidget(i, 1, text_browser)
-            self.tableWidget.setItem(i, 2, type_item)
-            self.tableWidget.setItem(i, 3, date_item)
-            # Set the buttons to the third column
-            #    We use hackfix as a random param because lambda will CORRUPT the first argument 🙃
-            #    so we trick it and use a 2nd one for our only argument
-            restore_button = QPushButton("⏪")
-            restore_button.clicked.connect(lambda hackfix=None, note_id=_id, name=values[0]:  # <-- Params
-                                           self.restore_note(note_id=note_id, name=name))  # <-- Call
-            delete_button = QPushButton("❌")
-            delete_button.clicked.connect(lambda hackfix=None, note_id=_id, name=values[0]:  # <-- Params
-                                          self.delete_forever(note_id=note_id, name=name))  # <-- Call
-            # Add buttons to the actual columns
-            self.tableWidget.setCellWidget(i, 4, restore_button)
-            self.tableWidget.setCellWidget(i, 5, delete_button)
+        """Reload the table from its first page, the rest is fetched while scrolling"""
+        self.model.reload()
+
+    def apply_changes(self, change) -> None:
+        """Show what another program changed in the trash. Gone notes are removed from the table, and it's only
+           reloaded if notes that it doesn't have yet came in
+           :param change: (rows, removed_ids) from the ChangeWatcher, or None if it changed too much to merge it"""
+        if change is None:
+            self.gui.refresh_tab(self.this_tab, self.populate_table)
+            return
+        rows, removed = change
+        for _id in removed:
+            self.notepad.bodies.forget("notes_deleted", _id)
+            self.model.remove_note(_id)
+        for _id, _, _ in rows:
+            self.notepad.bodies.forget("notes_deleted", _id)
+            self.model.forget_render(_id)  # <-- The tooltip must render the new content
+        if not self.model.has_notes(_id for _id, _, _ in rows):
+            self.gui.refresh_tab(self.this_tab, self.populate_table)
 
     def delete_forever(self, note_id: int, name: str) -> None:
         """Delete a note forever"""
         confirmation = self.gui.ask_for_confirmation(message=f"¿Borrar PERMANENTEMENTE la nota: {name}?")
         if confirmation:
-            self.notepad.delete_note_forever(_id=note_id, name=name)
-            self.populate_table()
+            self.notepad.delete_note_forever(_id=note_id, name=name,
+                                             callback=lambda _result: self.model.remove_note(note_id))
         else:
             self.gui.show_in_statusbar(f"Nota '{name}' no eliminada. Se ha cancelado el borrado.")
 
     def restore_note(self, note_id: int, name: str) -> None:
-        """Restore a note from the deleted section"""
-        self.notepad.restore_note(_id=note_id, name=name)
-        self.gui.notes.reload_notes_layout()
-        self.gui.private_notes.reload_private_notes_layout()
-        self.populate_table()
+        """Restore a note from the deleted section, the storage worker moves it without blocking the GUI"""
+        self.notepad.restore_note(_id=note_id, name=name,
+                                  callback=lambda table: self.refresh_after_restore(note_id, table))
+
+    def refresh_after_restore(self, note_id: int, table: str) -> None:
+        """Once the note is back, show it in its tab and remove it from here"""
+        if table == "private_notes":
+            self.gui.refresh_tab(self.gui.private_notes_tab,
+                                 lambda: self.gui.private_notes.reload_private_notes_layout())
+        else:
+            self.gui.refresh_tab(self.gui.notes_tab, lambda: self.gui.notes.reload_notes_layout())
+        self.model.remove_note(note_id)
+
+
+class DeletedNotesModel(QAbstractTableModel):
+    """The deleted notes, fetched from the database in pages only when the view scrolls to them"""
+    PAGE_SIZE = 200
+    HEADERS = ["Nombre", "Notas", "Tipo", "Fecha de borrado", "Restaurar", "Borrar"]
+    SORTABLE_COLUMNS = {2: "deleted_from", 3: "deleted_at"}
+
+    def __init__(self, notepad):
+        """Start empty, the view asks for the first page through fetchMore"""
+        super().__init__()
+        self.notepad = notepad  # <-- Pointer to the SQL Notepad
+        self.rows = []  # The content is [(id, title, preview, deleted_at, deleted_from, word_count, char_count)]
+        self.sort_column = "deleted_at"
+        self.descending = True
+        self.exhausted = False  # <-- True once the database has no more pages
+        self.loading = False  # <-- True while the storage worker is fetching a page
+        self.generation = 0  # <-- Increased on every reload, so pages of a previous sort are ignored
+        self.previews = PreviewRenderer.get()  # <-- Taken here, it must be created in the GUI thread
+        self.renders = {}  # The content is {1: Path}, the tooltips rendered so far, None while they are being made
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        """Only the rows fetched so far"""
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        """Name, preview, type, date and the two action buttons"""
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        """Column titles"""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        """Return the values of a cell, the buttons are painted by their delegate"""
+        if not index.isValid():
+            return None
+        _id, title, preview, deleted_at, deleted_from, word_count, char_count = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            return {0: title, 1: preview, 2: deleted_from, 3: deleted_at}.get(column)
+        if role == Qt.ToolTipRole and column == 1:
+            return self.get_tooltip(_id, preview, word_count, char_count)
+        return None
+
+    def get_tooltip(self, _id: int, preview: str, word_count: int, char_count: int) -> str:
+        """Show the note as it looks once its render is ready, and the stored preview until then.
+           The render is made in the storage worker the first time the mouse is over the note"""
+        counts = f"{word_count or 0} palabras, {char_count or 0} caracteres"
+        path = self.renders.get(_id)
+        if path is not None and path.exists():  # <-- The oldest renders are deleted from the disk
+            return f'<img src="{QUrl.fromLocalFile(str(path)).toString()}"><br>{counts}'
+        if path is not None or _id not in self.renders:
+            self.renders[_id] = None  # <-- Only asked for once
+            self.notepad.worker.run(self.render_note, _id, callback=lambda path: self.render_ready(_id, path),
+                                    errback=lambda error: self.renders.pop(_id, None))
+        return f"{preview or ''}\n\n{counts}"
+
+    def render_note(self, _id: int):
+        """Return the file of the render of a deleted note, or None if it's gone. It runs in the storage worker"""
+        content = self.notepad.read_content(_id, "notes_deleted")
+        return None if content is None else self.previews.get_file(content, TOOLTIP_SIZE)
+
+    def render_ready(self, _id: int, path) -> None:
+        """Keep the file of a render, the next time the mouse is over the note it's shown"""
+        if _id in self.renders:  # <-- Unless the note was removed or changed meanwhile
+            self.renders[_id] = path
+
+    def forget_render(self, _id: int) -> None:
+        """The note changed or is gone, its render must be made again if it's asked for"""
+        self.renders.pop(_id, None)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        """There is more to fetch until the database returns a short page"""
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()) -> None:
+        """Ask the storage worker for the next page right after the last row we have,
+           using the index of the sort column. The rows are added when it arrives"""
+        if parent.isValid() or self.loading:
+            return
+        after = None
+        if self.rows:
+            last = self.rows[-1]
+            after = (last[3] if self.sort_column == "deleted_at" else last[4], last[0])
+        self.loading = True
+        self.notepad.worker.run(self.read_page, after, self.sort_column, self.descending,
+                                callback=lambda page, generation=self.generation: self.add_page(page, generation),
+                                errback=self.page_failed)
+
+    def read_page(self, after: tuple, sort_column: str, descending: bool) -> list:
+        """Read a page with its stored previews, it runs in the storage worker"""
+        return self.notepad.fetch_deleted_notes_page(after=after, limit=self.PAGE_SIZE,
+                                                     sort_column=sort_column, descending=descending)
+
+    def add_page(self, page: list, generation: int) -> None:
+        """Append a page that arrived from the storage worker"""
+        if generation != self.generation:
+            return  # <-- The table was reloaded meanwhile, that one already asked for its own page
+        self.loading = False
+        self.exhausted = len(page) < self.PAGE_SIZE
+        if not page:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def page_failed(self, error: Exception) -> None:
+        """Stop asking for pages if the database fails, the next reload tries again"""
+        self.loading = False
+        self.exhausted = True
+        print(f"The deleted notes couldn't be read: {error}")
+
+    def sort(self, column: int, order=Qt.AscendingOrder) -> None:
+        """Sort by one of the indexed columns, starting again from the first page"""
+        if column not in self.SORTABLE_COLUMNS:
+            return
+        self.sort_column = self.SORTABLE_COLUMNS[column]
+        self.descending = order == Qt.DescendingOrder
+        self.reload()
+
+    def get_sort_section(self) -> int:
+        """Return the column the notes are sorted by"""
+        return next(column for column, name in self.SORTABLE_COLUMNS.items() if name == self.sort_column)
+
+    def reload(self) -> None:
+        """Forget all the pages and fetch the first one again, the view asks for the rest"""
+        self.beginResetModel()
+        self.rows.clear()
+        self.exhausted = False
+        self.loading = False
+        self.generation += 1
+        self.endResetModel()
+        self.fetchMore()
+
+    def remove_note(self, note_id: int) -> None:
+        """Remove the row of a note that was restored or deleted, without touching the others"""
+        self.forget_render(note_id)
+        for row, values in enumerate(self.rows):
+            if values[0] == note_id:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.rows[row]
+                self.endRemoveRows()
+                return
+
+    def has_notes(self, ids) -> bool:
+        """Check if all these notes are among the rows fetched so far"""
+        fetched = {values[0] for values in self.rows}
+        return all(_id in fetched for _id in ids)
+
+    def get_id(self, row: int) -> int:
+        """Return the id of the note in that row"""
+        return self.rows[row][0]
+
+    def get_title(self, row: int) -> str:
+        """Return the title of the note in that row"""
+        return self.rows[row][1]
+
+
+class ActionDelegate(QStyledItemDelegate):
+    """Paints a push button in every cell of a column and tells which row was clicked"""
+    clicked = Signal(int)
+
+    def __init__(self, text: str, parent=None):
+        """The text is the icon of the button"""
+        super().__init__(parent)
+        self.text = text
+
+    def paint(self, painter, option, index) -> None:
+        """Paint the button using the current style, so themes apply to it"""
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(4, 4, -4, -4)
+        button.text = self.text
+        button.state = QStyle.State_Enabled | (option.state & QStyle.State_MouseOver)
+        style = option.widget.style() if option.widget else QtWidgets.QApplication.style()
+        style.drawControl(QStyle.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index) -> bool:
+        """Emit the row when the button is released"""
+        if event.type() == QtCore.QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            self.clicked.emit(index.row())
+            return True
+        return super().editorEvent(event, model, option, index)
@@ -0,0 +1,317 @@
+# coding=utf-8
+"""Code by Aens"""
+from PySide6 import QtCore
+from PySide6.QtWidgets import QApplication, QGridLayout, QLabel, QScrollArea, QWidget
+from source.PreviewRenderer import PreviewRenderer
+
+CARD_WIDTH = 350  # <-- Width of each card when scrolling horizontally in virtual mode
+CARD_HEIGHT = 300  # <-- Height of each card when scrolling vertically in virtual mode
+CARD_SPACING = 6  # <-- Pixels between cards in virtual mode
+OVERSCAN = 1  # <-- Rows (or columns) materialized beyond the viewport, so scrolling doesn't show empty cells
+POOL_LIMIT = 64  # <-- Maximum amount of hidden cards kept to be recycled
+SCROLL_SETTLE = 150  # <-- Milliseconds without scrolling before the cards shown as renders get their real editor
+
+
+class NotesGrid(QtCore.QObject):
+    """The grid of note cards inside a scroll area. It only creates, updates or removes the cards that changed.
+       In virtual mode it only materializes the cards in and near the viewport, recycling the rest"""
+
+    def __init__(self, scroll_area: QScrollArea, settings, create_widget, update_widget):
+        """Initialize the grid inside the scroll area
+           :param create_widget: callable(_id, record) that returns a new note card
+           :param update_widget: callable(card, _id, record) that refreshes an existing card with new values"""
+        super().__init__(scroll_area)
+        self.scroll_area = scroll_area  # <-- Pointer to the scroll area that holds the grid
+        self.settings = settings  # <-- Pointer to the settings tab
+        self.create_widget = create_widget
+        self.update_widget = update_widget
+        self.virtual = None  # <-- Mode of the current container, it's rebuilt if the settings change it
+        self.container = None
+        self.layout = None  # <-- Only used in grid mode
+        self.cards = {}  # The content is {1: card, 2: card}, only the materialized ones in virtual mode
+        self.positions = {}  # The content is {1: (row, col), 2: (row, col)}, only used in grid mode
+        self.records = {}  # The content is {1: (title, content)}, the last snapshot we reconciled with
+        self.indexes = {}  # The content is {1: 0, 2: 1}, the position of each note in the snapshot
+        self.order = []  # The note ids in the order they must be shown
+        self.pool = []  # Hidden cards waiting to be recycled
+        # While scrolling in virtual mode, the cards show a render of their note kept in memory instead of filling the
+        # editor. Only in memory: loading them from the disk is as slow as filling the editor
+        self.previews = PreviewRenderer.get()
+        self.scrolling = False
+        self.settle_timer = QtCore.QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(SCROLL_SETTLE)
+        self.settle_timer.timeout.connect(self.settle)
+        # Events that make other cards visible
+        self.scroll_area.horizontalScrollBar().valueChanged.connect(self.scrolled)
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self.scrolled)
+        self.scroll_area.viewport().installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        """Recalculate what is visible when the viewport changes its size, and give a card its real editor as soon as
+           the mouse gets into it"""
+        if event.type() == QtCore.QEvent.Resize and self.virtual and watched is self.scroll_area.viewport():
+            self.resize_container()
+            self.refresh_viewport()
+        elif event.type() == QtCore.QEvent.Enter and getattr(watched, "pending_content", None) is not None:
+            self.fill_editor(watched)
+        return super().eventFilter(watched, event)
+
+    def build_container(self) -> None:
+        """Create the widget that holds the cards, dropping any card of the previous mode"""
+        for card in list(self.cards.values()) + self.pool:
+            card.deleteLater()
+        self.cards.clear()
+        self.positions.clear()
+        self.pool.clear()
+        self.virtual = self.settings.VIRTUAL_NOTES
+        self.container = QWidget(self.scroll_area)
+        self.container.setProperty("notesContainer", True)
+        if self.virtual:
+            # Cards are positioned by hand, so the container has no layout and we size it ourselves
+            self.layout = None
+            self.scroll_area.setWidgetResizable(False)
+        else:
+            self.layout = QGridLayout(self.container)
+            self.container.setLayout(self.layout)
+            self.scroll_area.setWidgetResizable(True)
+        self.scroll_area.setWidget(self.container)  # <-- This also deletes the previous container
+
+    def get_position(self, index: int) -> tuple:
+        """Return the (row, col) of the note in that position, following the layout mode of the settings"""
+        if self.settings.NOTES_LAYOUT == 1:  # Horizontal
+            return index % self.settings.NOTES_ROWS, index // self.settings.NOTES_ROWS
+        return index // self.settings.NOTES_COLUMNS, index % self.settings.NOTES_COLUMNS  # Vertical
+
+    def reconcile(self, records: dict) -> None:
+        """Diff the records against the live cards and only touch the ones that changed
+           :param records: the notes as {_id: (title, content)}, in the order they must be shown"""
+        if self.virtual != self.settings.VIRTUAL_NOTES:
+            self.build_container()
+        self.records = records
+        self.order = list(records)
+        self.indexes = {_id: index for index, _id in enumerate(self.order)}
+        if self.virtual:
+            self.reconcile_virtual()
+        else:
+            self.reconcile_grid()
+
+    def get_known_record(self, _id: int, card: QWidget) -> tuple:
+        """Return the record of a note that already has a card. Lazy records don't read its content again if the
+           body cache forgot it, it's still the one the card got"""
+        if hasattr(self.records, "peek"):
+            return self.records.peek(_id, card.record[1])
+        return self.records[_id]
+
+    def refresh_cards(self, ids: list) -> None:
+        """Refresh only the live cards of these notes, when nothing was added or removed so no card has to move"""
+        for _id in ids:
+            card = self.cards.get(_id)
+            if card is not None:
+                self.update_widget(card, _id, self.records[_id])
+
+    def reconcile_grid(self) -> None:
+        """Grid mode: every note has its own card inside the grid layout"""
+        # Remember where we were, so the user doesn't lose the scroll position
+        horizontal_value = self.scroll_area.horizontalScrollBar().value()
+        vertical_value = self.scroll_area.verticalScrollBar().value()
+        # 1 - Remove the cards of the notes that no longer exist
+        for _id in [_id for _id in self.cards if _id not in self.records]:
+            card = self.cards.pop(_id)
+            self.positions.pop(_id)
+            self.layout.removeWidget(card)
+            card.deleteLater()
+        # 2 - Create the new cards, refresh the existing ones and move only those whose place changed
+        for index, _id in enumerate(self.order):
+            position = self.get_position(index)
+            card = self.cards.get(_id)
+            if card is None:
+                card = self.create_widget(_id, self.records[_id])
+                self.cards[_id] = card
+            else:
+                self.update_widget(card, _id, self.get_known_record(_id, card))
+                if self.positions[_id] == position:
+                    continue  # <-- Already in place, don't touch the layout
+                self.layout.removeWidget(card)
+            self.layout.addWidget(card, position[0], position[1], 1, 1)
+            self.positions[_id] = position
+        # 3 - Restore the scroll once the layout has been recalculated
+        QtCore.QTimer.singleShot(0, lambda: self.restore_scroll(horizontal_value, vertical_value))
+
+    def scroll_to(self, _id: int) -> None:
+        """Scroll until the card of this note is visible and put the cursor in it"""
+        if _id not in self.indexes:
+            return
+        if self.virtual:
+            # The card may not exist yet, so move to its cell and let the viewport materialize it
+            cell_width, cell_height = self.get_cell_size()
+            row, col = self.get_position(self.indexes[_id])
+            if self.settings.NOTES_LAYOUT == 1:  # Horizontal
+                self.scroll_area.horizontalScrollBar().setValue(col * cell_width)
+            else:  # Vertical
+                self.scroll_area.verticalScrollBar().setValue(row * cell_height)
+            self.refresh_viewport()
+        card = self.cards.get(_id)
+        if card is not None:
+            self.fill_editor(card)
+            if not self.virtual:
+                self.scroll_area.ensureWidgetVisible(card)
+            card.text_edit.setFocus()
+
+    def restore_scroll(self, horizontal_value: int, vertical_value: int) -> None:
+        """Put the scrollbars back where they were"""
+        self.scroll_area.horizontalScrollBar().setValue(horizontal_value)
+        self.scroll_area.verticalScrollBar().setValue(vertical_value)
+
+    ################
+    # VIRTUAL MODE #
+    ################
+
+    def reconcile_virtual(self) -> None:
+        """Virtual mode: refresh the materialized cards, then let the viewport decide which ones must exist"""
+        for _id in [_id for _id in self.cards if _id not in self.records]:
+            self.release_card(_id)
+        for _id, card in self.cards.items():
+            self.update_widget(card, _id, self.get_known_record(_id, card))
+        self.resize_container()
+        self.refresh_viewport()
+
+    def get_cell_size(self) -> tuple:
+        """Return the (width, height) of each cell. The fixed side depends on the scrolling direction"""
+        viewport = self.scroll_area.viewport()
+        if self.settings.NOTES_LAYOUT == 1:  # Horizontal
+            return CARD_WIDTH, max(1, viewport.height() // self.settings.NOTES_ROWS)
+        return max(1, viewport.width() // self.settings.NOTES_COLUMNS), CARD_HEIGHT  # Vertical
+
+    def get_lines(self) -> int:
+        """Return the amount of rows (vertical mode) or columns (horizontal mode) needed to hold all the notes"""
+        per_line = self.settings.NOTES_ROWS if self.settings.NOTES_LAYOUT == 1 else self.settings.NOTES_COLUMNS
+        return -(-len(self.order) // per_line)  # <-- Ceil division
+
+    def resize_container(self) -> None:
+        """Make the container as big as all the cards would be, so the scrollbars behave like in grid mode"""
+        viewport = self.scroll_area.viewport()
+        cell_width, cell_height = self.get_cell_size()
+        if self.settings.NOTES_LAYOUT == 1:  # Horizontal
+            self.container.resize(self.get_lines() * cell_width, viewport.height())
+        else:  # Vertical
+            self.container.resize(viewport.width(), self.get_lines() * cell_height)
+
+    def get_visible_indexes(self) -> range:
+        """Return the indexes of the notes that are in or near the viewport"""
+        viewport = self.scroll_area.viewport()
+        cell_width, cell_height = self.get_cell_size()
+        if self.settings.NOTES_LAYOUT == 1:  # Horizontal
+            per_line = self.settings.NOTES_ROWS
+            start, length, cell = self.scroll_area.horizontalScrollBar().value(), viewport.width(), cell_width
+        else:  # Vertical
+            per_line = self.settings.NOTES_COLUMNS
+            start, length, cell = self.scroll_area.verticalScrollBar().value(), viewport.height(), cell_height
+        first_line = max(0, start // cell - OVERSCAN)
+        last_line = (start + length) // cell + OVERSCAN
+        return range(first_line * per_line, min(len(self.order), (last_line + 1) * per_line))
+
+    def refresh_viewport(self) -> None:
+        """Materialize the cards that became visible and recycle the ones that went far away"""
+        if not self.virtual:
+            return
+        wanted = {self.order[index] for index in self.get_visible_indexes()}
+        # 1 - Recycle the cards that went away, unless the user is working on them
+        for _id in [_id for _id in self.cards if _id not in wanted]:
+            if not self.is_card_busy(self.cards[_id]):
+                self.release_card(_id)
+        # 2 - Materialize the ones that came into view
+        for _id in wanted:
+            if _id not in self.cards:
+                self.cards[_id] = self.acquire_card(_id, self.records[_id])
+        # 3 - Put every materialized card in its cell
+        cell_width, cell_height = self.get_cell_size()
+        for _id, card in self.cards.items():
+            row, col = self.get_position(self.indexes[_id])
+            card.setGeometry(col * cell_width + CARD_SPACING // 2, row * cell_height + CARD_SPACING // 2,
+                             cell_width - CARD_SPACING, cell_height - CARD_SPACING)
+
+    def scrolled(self) -> None:
+        """The cards that come into view while scrolling may show renders, until it stops for a moment"""
+        if self.virtual:
+            self.scrolling = True
+            self.settle_timer.start()
+        self.refresh_viewport()
+
+    def settle(self) -> None:
+        """Scrolling stopped: fill the editors of the cards that were shown as renders, and keep a render of the
+           ones that had none, so they can be shown like that the next time"""
+        self.scrolling = False
+        for card in self.cards.values():
+            if getattr(card, "pending_content", None) is not None:
+                self.fill_editor(card)
+            else:
+                self.keep_render(card)
+
+    def keep_render(self, card: QWidget) -> None:
+        """Cache what the editor of a card shows, unless it's cached already or the user is working on it"""
+        if getattr(card, "pending_content", None) is not None or self.is_card_busy(card):
+            return
+        if card.text_edit.verticalScrollBar().value() != 0:
+            return  # <-- Not the top of the note, what a render shows
+        viewport = card.text_edit.viewport()
+        if not self.previews.contains(card.record[1], viewport.size(), viewport.devicePixelRatioF(), disk=False):
+            self.previews.store(card.record[1], viewport.grab(), disk=False)  # <-- Exactly what the editor shows
+
+    def set_content(self, card: QWidget, content: str) -> None:
+        """Show a content in the editor of a card. While scrolling in virtual mode, a cached render of it is shown
+           instead if there is one, and the editor is only filled once the scrolling stops or the mouse gets in"""
+        viewport = card.text_edit.viewport()
+        pixmap = None
+        if self.virtual and self.scrolling:  # <-- Only cards already placed get here, so the viewport has its size
+            pixmap = self.previews.find(content, viewport.size(), viewport.devicePixelRatioF(), disk=False)
+        if pixmap is None:
+            card.pending_content = None
+            if getattr(card, "preview_label", None) is not None:
+                card.preview_label.hide()
+            card.text_edit.setHtml(content)
+            return
+        if getattr(card, "preview_label", None) is None:
+            card.preview_label = QLabel(viewport)
+            card.preview_label.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)  # <-- Clicks reach the editor
+            card.installEventFilter(self)
+        card.pending_content = content
+        card.preview_label.setGeometry(viewport.rect())
+        card.preview_label.setPixmap(pixmap)
+        card.preview_label.show()
+
+    def fill_editor(self, card: QWidget) -> None:
+        """Put the content a card is showing as a render in its real editor"""
+        content = getattr(card, "pending_content", None)
+        if content is None:
+            return
+        card.pending_content = None
+        card.text_edit.setHtml(content)
+        card.preview_label.hide()
+
+    def acquire_card(self, _id: int, record: tuple) -> QWidget:
+        """Recycle a hidden card for this note, or create a new one if the pool is empty"""
+        if self.pool:
+            card = self.pool.pop()
+            self.update_widget(card, _id, record)
+        else:
+            card = self.create_widget(_id, record)
+            card.setParent(self.container)
+        card.show()
+        return card
+
+    def release_card(self, _id: int) -> None:
+        """Hide the card of this note and keep it to be recycled later"""
+        card = self.cards.pop(_id)
+        if self.virtual:
+            self.keep_render(card)  # <-- It was just on screen, so it's drawn as it will be shown the next time
+        card.hide()
+        if len(self.pool) < POOL_LIMIT:
+            self.pool.append(card)
+        else:
+            card.deleteLater()
+
+    @staticmethod
+    def is_card_busy(card: QWidget) -> bool:
+        """A card can't be recycled while it has the focus or unsaved changes"""
+        return card.isAncestorOf(QApplication.focusWidget()) or card.text_edit.document().isModified()
@@ -7,7 +7,13 @@ from PySide6.QtCore import QSize, QPoint
 from PySide6.QtGui import QTextCharFormat, QFont, QTextListFormat, QTextCursor, QColor, Qt, QIcon
 from PySide6.QtWidgets import (QInputDialog, QLineEdit, QDialog, QColorDialog, QGridLayout, QPushButton, QLabel,
                                QScrollArea, QWidget, QTextEdit, QFontComboBox, QStatusBar)
+from source.GuiNotesGrid import NotesGrid
+from source.Metrics import Metrics
 from source.Notepad import SQLNotepad
+from source.ThemeEngine import set_status_mode
+from source.Tracer import Tracer
+
+METRICS = Metrics.get()
 
 
 class PrivateNotesTab:
@@ -19,7 +25,7 @@ class PrivateNotesTab:
         self.this_tab = self.gui.private_notes_tab  # <-- Pointer to what holds this tab
         self.settings = self.gui.settings  # <-- Pointer to the settings tab
         self.notepad = SQLNotepad(self.gui)  # Pointer to our virtual notepad
-        self.private_notes_scroll_layout = None  # <-- Pointer so we can reload this tab later
+        self.private_notes_grid = None  # <-- Pointer so we can reload this tab later
         # Ready to load stuff
         self.create_private_notes_tab()  # Create the note tabs populating info from that memory
 
@@ -42,44 +48,26 @@ class PrivateNotesTab:
 
         # NOTES
         scroll_area = QScrollArea(self.gui)
-        scroll_widget = QWidget(scroll_area)
-        self.private_notes_scroll_layout = QGridLayout(scroll_widget)  # <-- pointer to re-populate it
-        scroll_widget.setProperty("notesContainer", True)
+        self.private_notes_grid = NotesGrid(scroll_area, self.settings,  # <-- pointer to re-populate it
+                                            create_widget=self.create_private_note_widget,
+                                            update_widget=self.update_private_note_widget)
         # Build and populate the layout with arbitrary notes
-        self.populate_notes_layout(self.private_notes_scroll_layout)
+        self.populate_notes_layout()
 
         # Add all elements to the current layout
         main_layout.addWidget(add_note_button, 0, 0, 1, 1)  # Add button in the first row, first column
         main_layout.addWidget(deleted_notes_label, 0, 1, 1, 2)  # Add label in the first row, spanning two columns
-        scroll_widget.setLayout(self.private_notes_scroll_layout)
-        scroll_area.setWidget(scroll_widget)
-        scroll_area.setWidgetResizable(True)
         main_layout.addWidget(scroll_area, 1, 0, 1, 3)
 
-    def populate_notes_layout(self, scroll_layout: QGridLayout) -> None:
+    def populate_notes_layout(self) -> None:
         """Populates the private notes into the layout"""
+        tracer = Tracer.get()
         # Reload notes in memory
-        self.notepad.reload_private_notes()
-        # Set defaults
-        row = 0
-        col = 0
-        for index, (_id, record) in enumerate(self.notepad.private_notes.items()):
-            # Add the current note
-            note = self.create_private_note_widget(_id, record)
-            scroll_layout.addWidget(note, row, col, 1, 1)
-            # Choose where to put the next note
-            # IF we are in Vertical Endless mode
-            if self.settings.NOTES_LAYOUT == 0:  # Vertical
-                col += 1
-                if col >= self.settings.NOTES_COLUMNS:
-                    row += 1
-                    col = 0
-            # IF we are in Horizontal Endless mode
-            elif self.settings.NOTES_LAYOUT == 1:  # Horizontal
-                row += 1
-                if row >= self.settings.NOTES_ROWS:
-                    row = 0
-                    col += 1
+        with tracer.span("reload_private_notes"):
+            self.notepad.reload_private_notes()
+        # Only create, update or remove the cards that changed
+        with tracer.span("reconcile private_notes"):
+            self.private_notes_grid.reconcile(self.notepad.private_notes)
 
     def create_private_note_widget(self, _id: int, record: tuple) -> QWidget:
         """Creates a widget with all the data of a private note"""
@@ -94,8 +82,8 @@ class PrivateNotesTab:
         line_edit = QLineEdit(title)
         line_edit.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)  # Set alignment to right
         # Connect the leaveEvent signal to the rename_title method
-        line_edit.leaveEvent = (lambda event, note_id=_id, name_obj=line_edit:  # <-- Params
-                                self.rename_title(event="OnLeave", note_id=note_id, name_obj=name_obj))  # <-- Call
+        line_edit.leaveEvent = (lambda event:  # <-- The note id is read on call, so the card can be refreshed
+                                self.rename_title(event="OnLeave", note_id=note.note_id, name_obj=line_edit))
 
         # Create Editor element
         text_edit = QTextEdit()
@@ -103,8 +91,8 @@ class PrivateNotesTab:
         text_edit.setReadOnly(False)
         # Connect the leaveEvent signal to the save_note method
         text_edit.leaveEvent = (
-            lambda event, note_id=_id, name_obj=line_edit, note_obj=text_edit:  # <-- Params
-            self.save_note(event="OnLeave", note_id=note_id, name_obj=name_obj, content=note_obj))  # <-- Call
+            lambda event:  # <-- The note id is read on call, so the card can be refreshed
+            self.save_note(event="OnLeave", note_id=note.note_id, name_obj=line_edit, content=text_edit))
 
         # Create buttons
         button_open = QPushButton("🔍")
@@ -125,13 +113,16 @@ class PrivateNotesTab:
         button_delete.setFixedSize(30, 30)
 
         # Connect buttons to functions
-        button_open.clicked.connect(lambda note_id=_id, name=title, obj=text_edit:  # <-- Params
-                                    self.open_note(note_id=note_id, name=name, obj=obj))  # <-- Call
+        #    We use hackfix as a random param because clicked sends a first argument that would CORRUPT ours 🙃
+        button_open.clicked.connect(lambda hackfix=None:
+                                    self.open_note(note_id=note.note_id, name=line_edit.text(), obj=text_edit))
         button_save.clicked.connect(
-            lambda note_id=_id, name_obj=line_edit, note_obj=text_edit:  # <-- Params
-            self.save_note(event="OnButtonSave", note_id=note_id, name_obj=name_obj, content=note_obj))  # <-- Call
-        button_delete.clicked.connect(lambda note_id=_id, name=title: self.delete_note(note_id=note_id, name=title))
-        button_copy.clicked.connect(lambda name=title, obj=text_edit: self.copy_note(name=name, obj=obj))
+            lambda hackfix=None:
+            self.save_note(event="OnButtonSave", note_id=note.note_id, name_obj=line_edit, content=text_edit))
+        button_delete.clicked.connect(lambda hackfix=None:
+                                      self.delete_note(note_id=note.note_id, name=line_edit.text()))
+        button_copy.clicked.connect(lambda hackfix=None:
+                                    self.copy_note(note_id=note.note_id, name=line_edit.text(), obj=text_edit))
 
         # 3: Add elements into the layout.
         # Values mean (element, row, col, row_span, column_span, alignment)
@@ -143,19 +134,47 @@ class PrivateNotesTab:
         layout.addWidget(text_edit, 1, 0, 1, 5)
         # Set the layout for the widget
         note.setLayout(layout)
+        # 4: Keep pointers to what the grid needs to refresh this card later
+        note.note_id = _id
+        note.record = record
+        note.line_edit = line_edit
+        note.text_edit = text_edit
         return note
 
+    def update_private_note_widget(self, note: QWidget, _id: int, record: tuple) -> None:
+        """Refresh an existing card with the new values of its private note, only touching what changed"""
+        if note.record == record:
+            return  # <-- Nothing changed since the card was built
+        title, content = record
+        if note.line_edit.text() != title:
+            note.line_edit.setText(title)
+        # Saving from the card itself already updated its record, so its cursor isn't reset
+        if note.note_id != _id or note.record[1] != content:  # <-- A recycled card, or saved from elsewhere
+            self.private_notes_grid.set_content(note, content)  # <-- A cached render of it while scrolling
+        note.note_id = _id
+        note.record = record
+
+    @METRICS.timed()
     def reload_private_notes_layout(self) -> None:
-        """Reload the layout by destroying it and calling to recreate it"""
-        # Delete existing layout if it does exist
-        for i in reversed(range(self.private_notes_scroll_layout.count())):
-            item = self.private_notes_scroll_layout.itemAt(i)
-            widget = item.widget()
-            if isinstance(widget, QTextEdit):
-                widget.disconnect(widget)
-            widget.deleteLater()
-        # Rebuild the layout
-        self.populate_notes_layout(self.private_notes_scroll_layout)
+        """Reload the layout by diffing the notes in the database against the cards we already have"""
+        self.populate_notes_layout()
+
+    @METRICS.timed()
+    def apply_changes(self, change) -> None:
+        """Show what another program changed in the private notes, only reading and refreshing those notes.
+           :param change: (rows, removed_ids) from the ChangeWatcher, or None if they changed too much to merge them"""
+        if change is None:
+            self.reload_private_notes_layout()
+            return
+        rows, removed = change
+        cards = self.private_notes_grid.cards
+        shown = {_id: card.record for _id, card in cards.items()}
+        busy = {_id for _id, card in cards.items() if card.text_edit.document().isModified()}
+        updated, moved = self.notepad.apply_changes("private_notes", rows, removed, shown, busy)
+        if moved:  # <-- Cards must be added, removed or moved
+            self.private_notes_grid.reconcile(self.notepad.private_notes)
+        else:
+            self.private_notes_grid.refresh_cards(updated)
 
     ###########
     # BUTTONS #
@@ -167,40 +186,83 @@ class PrivateNotesTab:
         new_window.show()
         self.gui.show_in_statusbar(f"Nota '{name}' maximizada.")
 
-    def copy_note(self, name: str, obj: QTextEdit) -> None:
-        """Copy the note into notepad"""
+    def copy_note(self, note_id: int, name: str, obj: QTextEdit) -> None:
+        """Copy the text of the note to the clipboard, from its editor, which always has the latest one"""
+        card = self.private_notes_grid.cards.get(note_id)
+        if card is not None and card.text_edit is obj:
+            self.private_notes_grid.fill_editor(card)  # <-- It may still be showing a render
         pyperclip.copy(obj.toPlainText())
         self.gui.show_in_statusbar(f"Nota '{name}' copiada al portapapeles.")
 
+    def show_history(self, note_id: int, name_obj: QLineEdit, obj: QTextEdit) -> None:
+        """Let the user pick an old version of the note and bring it back"""
+        # Whatever is being edited right now becomes a version too, so it isn't lost if we go back
+        self.save_note(event="OnButtonSave", note_id=note_id, name_obj=name_obj, content=obj)
+        self.notepad.list_revisions(_id=note_id, table="private_notes",
+                                    callback=lambda revisions: self.pick_revision(note_id, name_obj, obj, revisions))
+
+    def pick_revision(self, note_id: int, name_obj: QLineEdit, obj: QTextEdit, revisions: list) -> None:
+        """Once the versions of the note are read, ask which one to bring back"""
+        name = name_obj.text()
+        if len(revisions) < 2:
+            self.gui.show_in_statusbar(f"La nota '{name}' no tiene versiones anteriores.")
+            return
+        items = [f"Versión {revision} - {created_at}" for revision, created_at, _ in revisions[1:]]
+        item, ok = QInputDialog.getItem(obj.window(), "Historial de la Nota", "Elige la versión a recuperar:",
+                                        items, 0, False)
+        if not ok:
+            self.gui.show_in_statusbar(f"Nota '{name}' no modificada. Se ha cancelado la recuperación.")
+            return
+        revision = revisions[1:][items.index(item)][0]
+        self.notepad.restore_revision(_id=note_id, title=name, revision=revision, table="private_notes",
+                                      callback=lambda content: self.show_revision(obj, content))
+
+    def show_revision(self, obj: QTextEdit, content: str) -> None:
+        """Once the old version is saved, show it in the editor it was picked from"""
+        obj.setHtml(content)
+        obj.document().setModified(False)
+        self.reload_private_notes_layout()
+
     def delete_note(self, note_id: int, name: str) -> bool:
         """Delete the note and reload the layout"""
         confirmation = self.gui.ask_for_confirmation(message=f"Seguro que quieres eliminar la nota: {name}")
         if confirmation:
-            self.notepad.delete_note(_id=note_id, name=name, table="private_notes")
-            self.reload_private_notes_layout()
-            self.gui.deleted_notes.populate_table()
+            self.notepad.delete_note(_id=note_id, name=name, table="private_notes", callback=self.refresh_after_delete)
         else:
             self.gui.show_in_statusbar(f"Nota '{name}' no eliminada. Se ha cancelado el borrado.")
         return confirmation  # Needed to close floating note if deleted from there
 
+    def refresh_after_delete(self, _result=None) -> None:
+        """Once the storage worker moved a note to the trash, show it gone here and there"""
+        self.reload_private_notes_layout()
+        self.gui.refresh_tab(self.gui.deleted_notes_tab, lambda: self.gui.deleted_notes.populate_table())
+
+    @METRICS.timed()
     def save_note(self, event: str, note_id: int, name_obj: QLineEdit, content: QTextEdit) -> None:
         """Save the text on the note and reload the layout"""
         # 1 - Check if the note for what we triggered the event requires an actual save or nothing changed
         # This is a huge efficiency trick, we don't want thosands of unnecesary reloads on the GUI
-        content = content.toHtml()
+        # The document knows if it was edited, so we don't serialize it to HTML just to find out nothing changed
+        document = content.document()
         name = name_obj.text()
-        if content == self.notepad.private_notes[note_id][1] and name == self.notepad.private_notes[note_id][0]:
+        if not document.isModified() and name == self.notepad.get_title(note_id, "private_notes"):
             return   # DON'T save as it's not needed
         # 2 - Capture Events to make sure we only save on specific conditions
         if event == "OnLeave":
             if not self.settings.AUTOSAVE:
                 return  # DON'T save on Leave Events if autosave is not ON.
         elif event == "OnButtonSave":
-            if not name == self.notepad.private_notes[note_id][0]:  # <-- Only touch DB if needed
+            if not name == self.notepad.get_title(note_id, "private_notes"):  # <-- Only touch DB if needed
                 self.rename_title(event=event, note_id=note_id, name_obj=name_obj)
         # If we made it this far, okay, go ahead and save the note
-        if not content == self.notepad.private_notes[note_id][1]:  # <-- Only touch DB if needed
-            self.notepad.save_note(_id=note_id, title=name, value=content, table="private_notes")
+        if document.isModified():
+            html = content.toHtml()
+            if not html == self.notepad.private_notes[note_id][1]:  # <-- Only touch DB if needed (edits may have been undone)
+                self.notepad.save_note(_id=note_id, title=name, value=html, table="private_notes")
+            document.setModified(False)
+            card = self.private_notes_grid.cards.get(note_id)
+            if card is not None and card.text_edit is content:
+                card.record = (name, html)  # <-- The card already shows what we saved, no need to refresh it
         self.reload_private_notes_layout()
 
     def add_note(self) -> None:
@@ -208,19 +270,19 @@ class PrivateNotesTab:
         # Capture name of the new file by asking in a popup
         name, ok = QInputDialog.getText(self.gui, "Creación de Nota", "Escribe un titulo para la nota:", QLineEdit.Normal, "")
         if ok and name.strip():
-            # Create that file
-            self.notepad.add_note(new_name=name, table="private_notes")
-            # Reload notes and layout to also show the new file
-            self.reload_private_notes_layout()
+            # Create that file, and reload notes and layout to also show it once the storage worker created it
+            self.notepad.add_note(new_name=name, table="private_notes",
+                                  callback=lambda _result: self.reload_private_notes_layout())
         else:
             self.gui.show_popup("Creación de Nota cancelada.")
 
+    @METRICS.timed()
     def rename_title(self, event: str, note_id: int, name_obj: QLineEdit) -> None:
         """Save the text on the note and reload the layout"""
         # 1 - Check if the note for what we triggered the event requires an actual save or nothing changed
         # This is a huge efficiency trick, we don't want thosands of unnecesary reloads on the GUI
         value = name_obj.text()
-        if value and value == self.notepad.private_notes[note_id][0]:
+        if value and value == self.notepad.get_title(note_id, "private_notes"):
             return  # DON'T save as it's not needed
         # 2 - Capture Events to make sure we only save on specific conditions
         if event == "OnLeave":
@@ -263,22 +325,27 @@ class NewWindow(QDialog):
         # Create buttons
         button_copy = QPushButton("📝")
         button_save = QPushButton("💾")
+        button_history = QPushButton("🕘")
         button_delete = QPushButton("❌")
         # Set tooltips
         button_copy.setToolTip('Copia la nota al portapapeles')
         button_save.setToolTip('Guarda la nota de este botón (el resto no serán guardadas)')
+        button_history.setToolTip('Recupera una versión anterior de la nota')
         button_delete.setToolTip('Borra la nota de este botón')
         # Set fixed size for buttons
         button_save.setFixedSize(30, 30)
         button_copy.setFixedSize(30, 30)
+        button_history.setFixedSize(30, 30)
         button_delete.setFixedSize(30, 30)
         # Connect buttons to functions
         button_save.clicked.connect(
             lambda _id=self.note_id, name_obj=line_edit, obj=self.text_edit:  # <-- params
             self.private_notes_tab.save_note(event="OnButtonSave", note_id=note_id, name_obj=name_obj, content=obj))  # <-- call
         button_delete.clicked.connect(self.delete_note_from_here)
+        button_history.clicked.connect(lambda hackfix=None, name_obj=line_edit, obj=self.text_edit:  # <-- params
+                                       self.private_notes_tab.show_history(note_id, name_obj, obj))  # <-- call
         button_copy.clicked.connect(lambda _name=self.name, obj=self.text_edit:  # <-- params
-                                    self.private_notes_tab.copy_note(_name, obj))  # <-- call
+                                    self.private_notes_tab.copy_note(note_id, _name, obj))  # <-- call
         # Create a status bar
         self.statusbar = QStatusBar()
         self.statusbar.setSizeGripEnabled(False)
@@ -290,13 +357,14 @@ class NewWindow(QDialog):
         layout.addWidget(line_edit, 0, 0, 1, 1)
         layout.addWidget(button_copy, 0, 1, 1, 1)
         layout.addWidget(button_save, 0, 2, 1, 1)
-        layout.addWidget(button_delete, 0, 3, 1, 1)
-        layout.addWidget(self.text_edit, 1, 0, 1, 4)
+        layout.addWidget(button_history, 0, 3, 1, 1)
+        layout.addWidget(button_delete, 0, 4, 1, 1)
+        layout.addWidget(self.text_edit, 1, 0, 1, 5)
         # Add the bottom Format Editor
         formatbar_layout = self.add_format_editor(layout)
-        layout.addWidget(formatbar_layout, 2, 0, 1, 4)
+        layout.addWidget(formatbar_layout, 2, 0, 1, 5)
         # Add the statusbar
-        layout.addWidget(self.statusbar, 3, 0, 1, 4)
+        layout.addWidget(self.statusbar, 3, 0, 1, 5)
         self.setLayout(layout)
         # Install an event filter on these new windows
         self.installEventFilter(self)
@@ -305,14 +373,7 @@ class NewWindow(QDialog):
 
     def show_in_statusbar(self, message: str, mode: str = None) -> None:
         """Show something in the statusbar for a little bit"""
-        # Themed modes
-        if mode is None:
-            self.statusbar.setStyleSheet(self.private_notes_tab.gui.statusbar_default_themes[self.settings.THEME])
-        # Set special modes
-        elif mode == "error":
-            self.statusbar.setStyleSheet("background-color: darkred; color: white;")
-        elif mode == "nothing":
-            self.statusbar.setStyleSheet("")
+        set_status_mode(self.statusbar, mode)  # <-- The theme already has the colors of every mode
         self.statusbar.showMessage(f"{datetime.now().strftime('%H:%M:%S')} - {message}")
 
     def delete_note_from_here(self):
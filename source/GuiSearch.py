@@ -0,0 +1,52 @@
+# coding=utf-8
+"""Code by Aens"""
+import html
+from PySide6.QtCore import QUrl
+from PySide6.QtWidgets import QDialog, QGridLayout, QTextBrowser
+
+TABLE_NAMES = {"notes": "Notas", "private_notes": "Notas Privadas", "notes_deleted": "Notas Borradas"}
+
+
+class SearchWindow(QDialog):
+    """Shows the results of a global search among all the notes, the best matches first"""
+
+    def __init__(self, gui, text: str):
+        """Start the search, its results are shown once the storage worker finds them"""
+        super().__init__(gui)
+        self.gui = gui  # <-- Pointer to the main GUI
+        self.setWindowTitle(f"Buscar: {text}")
+        self.resize(700, 500)
+        # Results are links, clicking one of them takes you to its note
+        self.results_browser = QTextBrowser(self)
+        self.results_browser.setOpenLinks(False)
+        self.results_browser.anchorClicked.connect(self.open_result)
+        layout = QGridLayout(self)
+        layout.addWidget(self.results_browser, 0, 0, 1, 1)
+        self.setLayout(layout)
+        self.search(text)
+
+    def search(self, text: str) -> None:
+        """Search the text in the storage worker, so the GUI doesn't wait for the last edits to be written"""
+        self.results_browser.setHtml(f"<p>Buscando: <b>{html.escape(text)}</b>...</p>")
+        notepad = self.gui.notes.notepad
+        notepad.worker.run(notepad.search_notes, text, callback=lambda results: self.show_results(text, results),
+                           errback=lambda error: self.gui.show_in_statusbar(
+                               f"ERROR: No he podido buscar '{text}': {error}", mode="error"))
+
+    def show_results(self, text: str, results: list) -> None:
+        """List the notes found with the matches highlighted"""
+        if not results:
+            self.results_browser.setHtml(f"<p>No se ha encontrado nada con: <b>{html.escape(text)}</b></p>")
+            self.gui.show_in_statusbar(f"Búsqueda '{text}' sin resultados.")
+            return
+        lines = []
+        for table, _id, title, snippet in results:
+            lines.append(f'<p><a href="note:{table}:{_id}">{title or "(sin título)"}</a> '
+                        f'<i>({TABLE_NAMES[table]})</i><br/>{snippet}</p>')
+        self.results_browser.setHtml("".join(lines))
+        self.gui.show_in_statusbar(f"Búsqueda '{text}': {len(results)} resultados.")
+
+    def open_result(self, url: QUrl) -> None:
+        """Take the user to the note of the result"""
+        _, table, _id = url.toString().split(":")
+        self.gui.show_note(table=table, _id=int(_id))
@@ -2,6 +2,23 @@
 """Code by Aens"""
 from PySide6 import QtWidgets, QtCore
 from PySide6.QtCore import QSize, QPoint
+from PySide6.QtGui import QFontDatabase
+from datetime import datetime
+import json
+from pathlib import Path
+from source.Backup import BackupManager, KEEP_BACKUPS, INTERVAL_HOURS, list_backups
+from source.Diagnostics import build_memory_report, format_memory_report, set_allocation_tracing
+from source.Metrics import Metrics, format_metrics
+from source.PreviewRenderer import PreviewRenderer
+from source.Storage import Storage
+from source.ThemeEngine import THEME_FILES
+from source.Tracer import Tracer
+from source.TrashRetention import TrashRetention, MAX_AGE_DAYS, MAX_NOTES, MAX_MB
+
+
+BACKUP_CHECK_INTERVAL = 10 * 60 * 1000  # <-- Milliseconds between checks for a scheduled backup
+TRASH_PURGE_INTERVAL = 60 * 60 * 1000  # <-- Milliseconds between purges of the trash
+TRASH_FIRST_PURGE = 30 * 1000  # <-- The first one waits a little, so it doesn't slow down the start
 
 
 class SettingsTab:
@@ -19,12 +36,39 @@ class SettingsTab:
         self.notes_layout_combobox = QtWidgets.QComboBox()
         self.notes_layout_columns = QtWidgets.QSpinBox()
         self.notes_layout_rows = QtWidgets.QSpinBox()
+        self.virtual_notes_checkbox = QtWidgets.QCheckBox("Crear solo las notas visibles (para miles de notas)")
+        self.backup_compress_checkbox = QtWidgets.QCheckBox("Comprimir las copias")
+        self.backup_keep = QtWidgets.QSpinBox()
+        self.backup_interval = QtWidgets.QSpinBox()
+        self.backup_button = QtWidgets.QPushButton("Hacer una copia ahora")
+        self.backup_label = QtWidgets.QLabel("")
+        self.memory_report_text = QtWidgets.QPlainTextEdit()
+        self.memory_tracing_checkbox = QtWidgets.QCheckBox("Registrar qué líneas reservan memoria (más lento)")
+        self.memory_report = None  # <-- The last report shown, so it can be exported as it was
+        self.metrics_text = QtWidgets.QPlainTextEdit()
+        self.trash_max_age = QtWidgets.QSpinBox()
+        self.trash_max_notes = QtWidgets.QSpinBox()
+        self.trash_max_mb = QtWidgets.QSpinBox()
+        self.trash_purge_button = QtWidgets.QPushButton("Vaciar lo caducado ahora")
+        # Backups, in a thread of their own
+        self.backups = BackupManager(Storage.get(), Path.cwd().joinpath("notes"))
+        self.backup_timer = QtCore.QTimer(self.gui)
+        # Retention of the trash, run in the storage worker of the notepads
+        self.trash_retention = TrashRetention(Storage.get())
+        self.trash_timer = QtCore.QTimer(self.gui)
         # Settings
         self.AUTOSAVE = False
         self.THEME = 0
         self.NOTES_LAYOUT = 0
         self.NOTES_ROWS = 0
         self.NOTES_COLUMNS = 0
+        self.VIRTUAL_NOTES = False
+        self.BACKUP_COMPRESS = False
+        self.BACKUP_KEEP = KEEP_BACKUPS
+        self.BACKUP_INTERVAL = INTERVAL_HOURS
+        self.TRASH_MAX_AGE = MAX_AGE_DAYS
+        self.TRASH_MAX_NOTES = MAX_NOTES
+        self.TRASH_MAX_MB = MAX_MB
         self.load_program_config()  # Override default settings with the ones from file
         # Initialize
         self.create_settings_tab()  # Create the new tab
@@ -48,6 +92,19 @@ class SettingsTab:
         self.NOTES_LAYOUT = self.settings_file.value("Settings/notes_layout", 0, int)
         self.NOTES_ROWS = self.settings_file.value("Settings/notes_rows", 4, int)
         self.NOTES_COLUMNS = self.settings_file.value("Settings/notes_columns", 5, int)
+        self.VIRTUAL_NOTES = self.settings_file.value("Settings/virtual_notes", "false", bool)
+        self.BACKUP_COMPRESS = self.settings_file.value("Backup/compress", "false", bool)
+        self.BACKUP_KEEP = self.settings_file.value("Backup/keep", KEEP_BACKUPS, int)
+        self.BACKUP_INTERVAL = self.settings_file.value("Backup/interval_hours", INTERVAL_HOURS, int)
+        self.backups.compress = self.BACKUP_COMPRESS
+        self.backups.keep = self.BACKUP_KEEP
+        self.backups.interval_hours = self.BACKUP_INTERVAL
+        self.TRASH_MAX_AGE = self.settings_file.value("Trash/max_age_days", MAX_AGE_DAYS, int)
+        self.TRASH_MAX_NOTES = self.settings_file.value("Trash/max_notes", MAX_NOTES, int)
+        self.TRASH_MAX_MB = self.settings_file.value("Trash/max_mb", MAX_MB, int)
+        self.trash_retention.max_age_days = self.TRASH_MAX_AGE
+        self.trash_retention.max_notes = self.TRASH_MAX_NOTES
+        self.trash_retention.max_mb = self.TRASH_MAX_MB
         self.change_stylesheet(style=self.THEME)
 
     def save_program_config(self) -> None:
@@ -63,6 +120,13 @@ class SettingsTab:
         self.settings_file.setValue("Settings/notes_layout", self.NOTES_LAYOUT)
         self.settings_file.setValue("Settings/notes_rows", self.NOTES_ROWS)
         self.settings_file.setValue("Settings/notes_columns", self.NOTES_COLUMNS)
+        self.settings_file.setValue("Settings/virtual_notes", self.VIRTUAL_NOTES)
+        self.settings_file.setValue("Backup/compress", self.BACKUP_COMPRESS)
+        self.settings_file.setValue("Backup/keep", self.BACKUP_KEEP)
+        self.settings_file.setValue("Backup/interval_hours", self.BACKUP_INTERVAL)
+        self.settings_file.setValue("Trash/max_age_days", self.TRASH_MAX_AGE)
+        self.settings_file.setValue("Trash/max_notes", self.TRASH_MAX_NOTES)
+        self.settings_file.setValue("Trash/max_mb", self.TRASH_MAX_MB)
 
     ##########
     # LAYOUT #
@@ -117,6 +181,10 @@ class SettingsTab:
         self.notes_layout_columns.setValue(4)
         self.notes_layout_columns.setToolTip('Solo modificable en modo Vertical')
         self.notes_layout_columns.setDisabled(True if self.NOTES_LAYOUT == 1 else False)
+        # virtual
+        self.virtual_notes_checkbox.setChecked(self.VIRTUAL_NOTES)  # Set the initial state from memory
+        self.virtual_notes_checkbox.setToolTip('Las notas fuera de la vista no se crean hasta que llegas a ellas. '
+                                               'Las notas tienen un tamaño fijo en este modo.')
         # add to layout
         layout_notes_layout.addWidget(layout_label, 0, 0)
         layout_notes_layout.addWidget(self.notes_layout_combobox, 0, 1)
@@ -124,8 +192,102 @@ class SettingsTab:
         layout_notes_layout.addWidget(self.notes_layout_rows, 1, 1)
         layout_notes_layout.addWidget(notes_layout_columns_label, 2, 0)
         layout_notes_layout.addWidget(self.notes_layout_columns, 2, 1)
+        layout_notes_layout.addWidget(self.virtual_notes_checkbox, 3, 0, 1, 2)
         group_box_notes_layout.setLayout(layout_notes_layout)
 
+        # 4 - Backups
+        group_box_backups = QtWidgets.QGroupBox('Copias de seguridad')
+        layout_backups = QtWidgets.QGridLayout()
+        # controls
+        backup_interval_label = QtWidgets.QLabel("Copia automática cada (horas): ")
+        self.backup_interval.setRange(0, 24 * 30)
+        self.backup_interval.setValue(self.BACKUP_INTERVAL)  # Set the initial state from memory
+        self.backup_interval.setToolTip('0 para no hacer copias automáticas')
+        backup_keep_label = QtWidgets.QLabel("Copias que se guardan: ")
+        self.backup_keep.setRange(1, 1000)
+        self.backup_keep.setValue(self.BACKUP_KEEP)  # Set the initial state from memory
+        self.backup_keep.setToolTip('Las copias más antiguas se borran de la carpeta notes')
+        self.backup_compress_checkbox.setChecked(self.BACKUP_COMPRESS)  # Set the initial state from memory
+        self.backup_compress_checkbox.setToolTip('Ocupan mucho menos, pero hay que descomprimirlas (gzip) para usarlas')
+        self.backup_button.setToolTip('Copia la base de datos en la carpeta notes sin parar el programa')
+        self.show_last_backup()
+        # add to layout
+        layout_backups.addWidget(backup_interval_label, 0, 0)
+        layout_backups.addWidget(self.backup_interval, 0, 1)
+        layout_backups.addWidget(backup_keep_label, 1, 0)
+        layout_backups.addWidget(self.backup_keep, 1, 1)
+        layout_backups.addWidget(self.backup_compress_checkbox, 2, 0, 1, 2)
+        layout_backups.addWidget(self.backup_button, 3, 0)
+        layout_backups.addWidget(self.backup_label, 3, 1)
+        group_box_backups.setLayout(layout_backups)
+
+        # 5 - Retention of the trash
+        group_box_trash = QtWidgets.QGroupBox('Papelera')
+        layout_trash = QtWidgets.QGridLayout()
+        # controls
+        trash_max_age_label = QtWidgets.QLabel("Borrar para siempre tras (días): ")
+        self.trash_max_age.setRange(0, 3650)
+        self.trash_max_age.setValue(self.TRASH_MAX_AGE)  # Set the initial state from memory
+        self.trash_max_age.setToolTip('0 para no borrar nunca por antigüedad')
+        trash_max_notes_label = QtWidgets.QLabel("Máximo de notas en la papelera: ")
+        self.trash_max_notes.setRange(0, 1000000)
+        self.trash_max_notes.setValue(self.TRASH_MAX_NOTES)  # Set the initial state from memory
+        self.trash_max_notes.setToolTip('Se guardan las borradas más recientes. 0 para no tener límite')
+        trash_max_mb_label = QtWidgets.QLabel("Tamaño máximo de la papelera (MB): ")
+        self.trash_max_mb.setRange(0, 100000)
+        self.trash_max_mb.setValue(self.TRASH_MAX_MB)  # Set the initial state from memory
+        self.trash_max_mb.setToolTip('Se guardan las borradas más recientes. 0 para no tener límite')
+        self.trash_purge_button.setToolTip('Se revisa sola cada hora. El espacio liberado se devuelve al disco')
+        # add to layout
+        layout_trash.addWidget(trash_max_age_label, 0, 0)
+        layout_trash.addWidget(self.trash_max_age, 0, 1)
+        layout_trash.addWidget(trash_max_notes_label, 1, 0)
+        layout_trash.addWidget(self.trash_max_notes, 1, 1)
+        layout_trash.addWidget(trash_max_mb_label, 2, 0)
+        layout_trash.addWidget(self.trash_max_mb, 2, 1)
+        layout_trash.addWidget(self.trash_purge_button, 3, 0, 1, 2)
+        group_box_trash.setLayout(layout_trash)
+
+        # 6 - Memory diagnostics, only measured when asked for
+        group_box_memory = QtWidgets.QGroupBox('Diagnóstico de memoria')
+        layout_memory = QtWidgets.QGridLayout()
+        # controls
+        self.memory_report_text.setReadOnly(True)
+        self.memory_report_text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.memory_report_text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.memory_report_text.setMinimumSize(620, 200)
+        self.memory_report_text.setPlaceholderText("Pulsa 'Medir' para ver en qué se va la memoria.")
+        self.memory_tracing_checkbox.setToolTip('Usa tracemalloc. Actívalo, repite lo que gasta memoria y mide')
+        memory_refresh_button = QtWidgets.QPushButton("Medir")
+        memory_export_button = QtWidgets.QPushButton("Exportar informe...")
+        memory_export_button.setToolTip('Guarda el último informe como JSON')
+        # add to layout
+        layout_memory.addWidget(self.memory_tracing_checkbox, 0, 0, 1, 2)
+        layout_memory.addWidget(memory_refresh_button, 1, 0)
+        layout_memory.addWidget(memory_export_button, 1, 1)
+        layout_memory.addWidget(self.memory_report_text, 2, 0, 1, 2)
+        group_box_memory.setLayout(layout_memory)
+
+        # 7 - Metrics of the operations, they are always recorded but only shown when asked for
+        group_box_metrics = QtWidgets.QGroupBox('Métricas de rendimiento')
+        layout_metrics = QtWidgets.QGridLayout()
+        # controls
+        self.metrics_text.setReadOnly(True)
+        self.metrics_text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.metrics_text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.metrics_text.setMinimumSize(620, 200)
+        self.metrics_text.setPlaceholderText("Pulsa 'Mostrar' para ver cuánto tarda cada operación.")
+        metrics_refresh_button = QtWidgets.QPushButton("Mostrar")
+        metrics_export_button = QtWidgets.QPushButton("Exportar JSON...")
+        metrics_reset_button = QtWidgets.QPushButton("Reiniciar")
+        metrics_reset_button.setToolTip('Olvida todo lo medido hasta ahora')
+        # add to layout
+        layout_metrics.addWidget(metrics_refresh_button, 0, 0)
+        layout_metrics.addWidget(metrics_export_button, 0, 1)
+        layout_metrics.addWidget(metrics_reset_button, 0, 2)
+        layout_metrics.addWidget(self.metrics_text, 1, 0, 1, 3)
+        group_box_metrics.setLayout(layout_metrics)
+
         # Set up a grid layout for the label and combobox
         settings_layout = QtWidgets.QGridLayout(self.this_tab)
         settings_layout.setAlignment(QtCore.Qt.AlignTop | QtCore.Qt.AlignLeft)  # Align to top-left
@@ -133,6 +295,10 @@ class SettingsTab:
         settings_layout.addWidget(group_box_stylesheet, 0, 0)
         settings_layout.addWidget(group_box_checkboxes, 1, 0)
         settings_layout.addWidget(group_box_notes_layout, 2, 0)
+        settings_layout.addWidget(group_box_backups, 3, 0)
+        settings_layout.addWidget(group_box_trash, 4, 0)
+        settings_layout.addWidget(group_box_memory, 0, 1, 2, 1)
+        settings_layout.addWidget(group_box_metrics, 2, 1, 3, 1)
 
         # Connections/Events
         self.stylesheet_combobox.currentIndexChanged.connect(self.change_stylesheet)
@@ -140,6 +306,26 @@ class SettingsTab:
         self.notes_layout_combobox.currentIndexChanged.connect(self.change_notes_layout)
         self.notes_layout_rows.valueChanged.connect(self.change_amount_of_rows)
         self.notes_layout_columns.valueChanged.connect(self.change_amount_of_columns)
+        self.virtual_notes_checkbox.stateChanged.connect(self.handle_virtual_notes_checkbox)
+        self.backup_interval.valueChanged.connect(self.change_backup_interval)
+        self.backup_keep.valueChanged.connect(self.change_backup_keep)
+        self.backup_compress_checkbox.stateChanged.connect(self.handle_backup_compress_checkbox)
+        self.backup_button.clicked.connect(self.make_backup)
+        self.backup_timer.timeout.connect(self.make_scheduled_backup)
+        self.trash_max_age.valueChanged.connect(self.change_trash_max_age)
+        self.trash_max_notes.valueChanged.connect(self.change_trash_max_notes)
+        self.trash_max_mb.valueChanged.connect(self.change_trash_max_mb)
+        self.trash_purge_button.clicked.connect(self.purge_trash)
+        self.trash_timer.timeout.connect(self.purge_trash)
+        self.memory_tracing_checkbox.stateChanged.connect(lambda state: set_allocation_tracing(bool(state)))
+        memory_refresh_button.clicked.connect(self.show_memory_report)
+        memory_export_button.clicked.connect(self.export_memory_report)
+        metrics_refresh_button.clicked.connect(self.show_metrics)
+        metrics_export_button.clicked.connect(self.export_metrics)
+        metrics_reset_button.clicked.connect(lambda: (Metrics.get().reset(), self.show_metrics()))
+        self.backup_timer.start(BACKUP_CHECK_INTERVAL)
+        self.trash_timer.start(TRASH_PURGE_INTERVAL)
+        QtCore.QTimer.singleShot(TRASH_FIRST_PURGE, self.gui, self.purge_trash)
 
     ############
     # SETTINGS #
@@ -155,16 +341,12 @@ class SettingsTab:
 
     def change_stylesheet(self, style: int) -> None:
         """Change the application stylesheet"""
-        mapped_options = {
-            "0": "resources/theme_gray.QSS",
-            "1": "resources/theme_dark.QSS",
-            "2": "resources/theme_light.QSS",
-            "3": "resources/theme_green.QSS"}
-        with open(mapped_options[str(style)], encoding="UTF-8") as file:
-            stylesheet = file.read()
         self.THEME = style
-        self.gui.app.setStyleSheet(stylesheet)
-        self.gui.show_in_statusbar(f"Paleta de colores cambiada a: {mapped_options[str(style)]}", mode="nothing")
+        PreviewRenderer.get().set_theme(style, self.gui.themes.get_theme(style).palette)
+        with Tracer.get().span("apply theme"):
+            changed = self.gui.themes.apply(style)  # <-- Each theme file is read only the first time
+        if changed:
+            self.gui.show_in_statusbar(f"Paleta de colores cambiada a: {THEME_FILES[style]}", mode="nothing")
 
     def change_notes_layout(self, style: int) -> None:
         """Change the layout of the notes: horizontal or vertical"""
@@ -175,18 +357,159 @@ class SettingsTab:
             self.notes_layout_rows.setDisabled(False)
             self.notes_layout_columns.setDisabled(True)
         self.NOTES_LAYOUT = style
-        self.gui.notes.reload_notes_layout()
+        self.reload_notes_tabs()
 
     def change_amount_of_rows(self, value: int) -> None:
         """Reload the notes with a fixed amount of rows
            :param value: values can be from 1 to 20"""
         self.NOTES_ROWS = value
-        self.gui.notes.reload_notes_layout()
+        self.reload_notes_tabs()
         self.gui.show_in_statusbar(f"Notas recargadas. Cantidad de filas: {value}")
 
     def change_amount_of_columns(self, value: int) -> None:
         """Reload the notes with a fixed amount of columns
            :param value: values can be from 1 to 20"""
         self.NOTES_COLUMNS = value
-        self.gui.notes.reload_notes_layout()
-        self.gui.show_in_statusbar(f"Notas recargadas. Cantidad de columnas: {value}")
\ No newline at end of file
+        self.reload_notes_tabs()
+        self.gui.show_in_statusbar(f"Notas recargadas. Cantidad de columnas: {value}")
+
+    def reload_notes_tabs(self) -> None:
+        """Both grids of notes follow these settings, the hidden ones are reloaded when they are shown"""
+        self.gui.refresh_tab(self.gui.notes_tab, lambda: self.gui.notes.reload_notes_layout())
+        self.gui.refresh_tab(self.gui.private_notes_tab, lambda: self.gui.private_notes.reload_private_notes_layout())
+
+    def handle_virtual_notes_checkbox(self, state: int) -> None:
+        """Switch the notes grids between creating every note or only the visible ones
+           :param state: values can be 0 or 2"""
+        self.VIRTUAL_NOTES = bool(state)
+        self.reload_notes_tabs()
+        mode = "activado" if self.VIRTUAL_NOTES else "desactivado"
+        self.gui.show_in_statusbar(f"Notas recargadas. Modo virtual: {mode}")
+
+    def change_backup_interval(self, value: int) -> None:
+        """Change the hours between the scheduled backups
+           :param value: 0 to not make them"""
+        self.BACKUP_INTERVAL = value
+        self.backups.interval_hours = value
+
+    def change_backup_keep(self, value: int) -> None:
+        """Change how many backups are kept before deleting the oldest"""
+        self.BACKUP_KEEP = value
+        self.backups.keep = value
+
+    def handle_backup_compress_checkbox(self, state: int) -> None:
+        """Make the next backups compressed or not
+           :param state: values can be 0 or 2"""
+        self.BACKUP_COMPRESS = bool(state)
+        self.backups.compress = self.BACKUP_COMPRESS
+
+    def make_backup(self) -> None:
+        """Make a backup now, in the background"""
+        if self.backups.backup(callback=self.backup_done, errback=self.backup_failed):
+            self.backup_button.setDisabled(True)
+            self.gui.show_in_statusbar("Haciendo una copia de seguridad...")
+
+    def make_scheduled_backup(self) -> None:
+        """Make a backup if enough time passed since the last one"""
+        if self.backups.is_due():
+            self.make_backup()
+
+    def backup_done(self, path: Path) -> None:
+        """Runs once a backup is written"""
+        self.backup_button.setDisabled(False)
+        self.show_last_backup()
+        self.gui.show_in_statusbar(f"Copia de seguridad guardada en {path}")
+
+    def backup_failed(self, error: Exception) -> None:
+        """Runs if a backup couldn't be written"""
+        self.backup_button.setDisabled(False)
+        self.gui.show_in_statusbar(f"ERROR: No he podido hacer la copia de seguridad: {error}", mode="error")
+
+    def show_last_backup(self) -> None:
+        """Show when the last backup was made"""
+        backups = list_backups(self.backups.folder)
+        if backups:
+            last = datetime.fromtimestamp(backups[0].stat().st_mtime).strftime("%Y-%m-%d %H:%M")
+            self.backup_label.setText(f"Última copia: {last}")
+        else:
+            self.backup_label.setText("Sin copias todavía")
+
+    def change_trash_max_age(self, value: int) -> None:
+        """Change the days a deleted note is kept
+           :param value: 0 to keep them forever"""
+        self.TRASH_MAX_AGE = value
+        self.trash_retention.max_age_days = value
+
+    def change_trash_max_notes(self, value: int) -> None:
+        """Change how many deleted notes are kept
+           :param value: 0 for no limit"""
+        self.TRASH_MAX_NOTES = value
+        self.trash_retention.max_notes = value
+
+    def change_trash_max_mb(self, value: int) -> None:
+        """Change how much space the deleted notes can take
+           :param value: 0 for no limit"""
+        self.TRASH_MAX_MB = value
+        self.trash_retention.max_mb = value
+
+    def purge_trash(self) -> None:
+        """Permanently delete what the limits of the trash don't keep, in the background"""
+        if not self.trash_retention.is_enabled() or not self.trash_purge_button.isEnabled():
+            return
+        self.trash_purge_button.setDisabled(True)  # <-- Until this one is done
+        self.gui.notes.notepad.purge_trash(self.trash_retention, callback=self.trash_purged,
+                                           errback=lambda error: self.trash_purge_button.setDisabled(False))
+
+    def trash_purged(self, result: dict) -> None:
+        """Runs once the expired notes are gone"""
+        self.trash_purge_button.setDisabled(False)
+        if result["ids"]:
+            self.gui.refresh_tab(self.gui.deleted_notes_tab, lambda: self.gui.deleted_notes.populate_table())
+
+    def show_memory_report(self) -> None:
+        """Measure where the memory goes right now and show it"""
+        self.memory_report = build_memory_report(self.gui)
+        self.memory_report_text.setPlainText(format_memory_report(self.memory_report))
+
+    def export_memory_report(self) -> None:
+        """Save the last report, or a new one, as a JSON file"""
+        if self.memory_report is None:
+            self.show_memory_report()
+        default_name = f"memory_report_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self.gui, "Exportar informe de memoria", default_name,
+                                                        "JSON (*.json)")
+        if not path:
+            return
+        try:
+            with open(path, "w", encoding="UTF-8") as file:
+                json.dump(self.memory_report, file, indent=1, ensure_ascii=False)
+            self.gui.show_in_statusbar(f"Informe de memoria guardado en {path}")
+        except OSError as e:
+            self.gui.show_in_statusbar(f"ERROR: No he podido guardar el informe de memoria: {e}", mode="error")
+
+    def get_storage_statuses(self) -> dict:
+        """Return the status of the writer and of the body cache, to show them with the metrics"""
+        notepad = self.gui.notes.notepad
+        statuses = {"Escritor": notepad.writer.get_status(), "Comandos en cola": {"pending": notepad.worker.pending}}
+        if notepad.bodies is not None:
+            statuses["Caché de contenidos"] = notepad.bodies.get_status()
+        statuses["Previsualizaciones"] = PreviewRenderer.get().get_status()
+        if getattr(self.gui, "change_watcher", None) is not None:  # <-- Created after this tab
+            statuses["Cambios externos"] = self.gui.change_watcher.get_status()
+        return statuses
+
+    def show_metrics(self) -> None:
+        """Show the latencies of every operation measured so far"""
+        self.metrics_text.setPlainText(format_metrics(Metrics.get().get_snapshot(), self.get_storage_statuses()))
+
+    def export_metrics(self) -> None:
+        """Save the metrics as a JSON file"""
+        default_name = f"metrics_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self.gui, "Exportar métricas", default_name, "JSON (*.json)")
+        if not path:
+            return
+        try:
+            Metrics.get().dump(path, extra={"storage": self.get_storage_statuses()})
+            self.gui.show_in_statusbar(f"Métricas guardadas en {path}")
+        except OSError as e:
+            self.gui.show_in_statusbar(f"ERROR: No he podido guardar las métricas: {e}", mode="error")
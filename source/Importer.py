@@ -0,0 +1,190 @@
+# coding=utf-8
+"""Code by Aens"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from html import escape, unescape
+from itertools import islice
+from pathlib import Path
+import os
+import re
+import time
+import zipfile
+from source.ContentCodec import encode_content
+from source.NoteText import QT_HTML_HEAD, QT_BLOCK_STYLE, QT_LIST_STYLE, TEXT_COLUMNS, compact_html, get_text_columns
+
+SUPPORTED = {".txt": "text", ".text": "text", ".md": "markdown", ".markdown": "markdown",
+             ".html": "html", ".htm": "html"}
+BATCH_SIZE = 500  # <-- Files converted by a process in one go
+TRANSACTION_SIZE = 5000  # <-- Notes inserted per transaction, the search index is updated faster in big ones
+BATCHES_IN_FLIGHT = 2  # <-- Per process, so the pool never waits for us but memory stays bounded
+ENCODINGS = ("utf-8-sig", "cp1252", "latin-1")  # <-- Old notes written in Windows are usually cp1252
+HTML_TITLE = re.compile(r"<title>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+MARKDOWN_BULLET = re.compile(r"^\s*[-*+]\s+(.*)$")
+MARKDOWN_NUMBER = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+MARKDOWN_INLINE = (  # <-- Applied in order over the escaped text
+    (re.compile(r"`([^`]+)`"), r"""<span style=" font-family:'Courier New';">\1</span>"""),
+    (re.compile(r"\*\*(.+?)\*\*|__(.+?)__"), lambda m: f'<span style=" font-weight:700;">{m[1] or m[2]}</span>'),
+    (re.compile(r"(?<![\w*])\*(?!\s)(.+?)\*|(?<!\w)_(?!\s)(.+?)_(?!\w)"),
+     lambda m: f'<span style=" font-style:italic;">{m[1] or m[2]}</span>'),
+    (re.compile(r"\[([^\]]+)\]\(([^)\s]+)\)"), r'<a href="\2">\1</a>'))
+
+
+def iter_sources(paths: list):
+    """Yield every note to import as (title, kind, raw bytes), one file at a time. Folders are walked
+       and zip archives are read member by member, so nothing is loaded before it's needed"""
+    for path in map(Path, paths):
+        if path.is_dir():
+            for child in sorted(path.rglob("*")):
+                if child.is_file():
+                    yield from iter_file(child)
+        elif path.is_file():
+            yield from iter_file(path)
+
+
+def iter_file(path: Path):
+    """Yield the notes of a single file, or of every member of an archive"""
+    suffix = path.suffix.lower()
+    if suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                member_path = Path(member.filename)
+                kind = SUPPORTED.get(member_path.suffix.lower())
+                if not member.is_dir() and kind is not None:
+                    yield member_path.stem, kind, archive.read(member)
+    elif suffix in SUPPORTED:
+        yield path.stem, SUPPORTED[suffix], path.read_bytes()
+
+
+def decode_text(data: bytes) -> str:
+    """Return the text of a file in the first encoding that fits"""
+    for encoding in ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+
+
+def build_html(blocks: list) -> str:
+    """Return a note in the same HTML QTextEdit writes, so it's stored compact like the ones written in the program.
+       Each block is (tag, inner html), where tag is "p", "h1".."h6", "ul" or "ol" (these with a list of items)"""
+    body = []
+    for tag, inner in blocks:
+        if tag in ("ul", "ol"):
+            items = "\n".join(f'<li style=" {QT_BLOCK_STYLE}">{item}</li>' for item in inner)
+            body.append(f'<{tag} style="{QT_LIST_STYLE}">\n{items}</{tag}>')
+        elif tag == "p" and not inner:
+            body.append(f'<p style="-qt-paragraph-type:empty; {QT_BLOCK_STYLE}"><br /></p>')
+        elif tag == "p":
+            body.append(f'<p style=" {QT_BLOCK_STYLE}">{inner}</p>')
+        else:
+            body.append(f'<{tag} style=" {QT_BLOCK_STYLE}">{inner}</{tag}>')
+    return f'{QT_HTML_HEAD}<body>\n' + "\n".join(body) + "</body></html>"
+
+
+def text_to_html(text: str) -> str:
+    """Plain text: a paragraph per line"""
+    return build_html([("p", escape(line, quote=False)) for line in text.splitlines()])
+
+
+def markdown_to_html(text: str) -> str:
+    """Markdown: headings, bullet and numbered lists, bold, italic, code and links. The rest stays as text"""
+    blocks = []
+    for line in text.splitlines():
+        for pattern, tag in ((MARKDOWN_BULLET, "ul"), (MARKDOWN_NUMBER, "ol")):
+            match = pattern.match(line)
+            if match:
+                if not blocks or blocks[-1][0] != tag:
+                    blocks.append((tag, []))
+                blocks[-1][1].append(markdown_inline(match[1]))
+                break
+        else:
+            match = MARKDOWN_HEADING.match(line)
+            if match:
+                blocks.append((f"h{len(match[1])}", markdown_inline(match[2])))
+            else:
+                blocks.append(("p", markdown_inline(line)))
+    return build_html(blocks)
+
+
+def markdown_inline(line: str) -> str:
+    """Return the inline formatting of a line of markdown as HTML"""
+    line = escape(line.rstrip(), quote=False)
+    for pattern, replacement in MARKDOWN_INLINE:
+        line = pattern.sub(replacement, line)
+    return line
+
+
+def convert_batch(sources: list, compact: bool, compress: bool) -> tuple:
+    """Runs in the process pool: turn a batch of (title, kind, raw bytes) into rows (title, stored content, *text).
+       Returns (rows, bytes read, errors), where errors are (title, message)"""
+    rows, errors, size = [], [], 0
+    for title, kind, data in sources:
+        size += len(data)
+        try:
+            text = decode_text(data)
+            if kind == "html":
+                match = HTML_TITLE.search(text)
+                if match and match[1].strip():
+                    title = unescape(match[1].strip())
+                content = text
+            elif kind == "markdown":
+                content = markdown_to_html(text)
+            else:
+                content = text_to_html(text)
+            text_columns = get_text_columns(content)
+            if compact:
+                content = compact_html(content)
+            rows.append((title, encode_content(content) if compress else content, *text_columns))
+        except Exception as e:
+            errors.append((title, str(e)))
+    return rows, size, errors
+
+
+def import_notes(storage, paths: list, table: str = "notes", processes: int = None, progress=None) -> dict:
+    """Import every supported file under the paths as new notes, converting them in a pool of processes while
+       the notes already converted are inserted in big transactions. Returns the statistics of the import
+       :param processes: size of the pool, 0 converts them in this process
+       :param progress: callable(stats) called after every transaction"""
+    stats = {"files": 0, "imported": 0, "errors": [], "bytes": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    sources = iter_sources(paths)
+    batches = iter(lambda: list(islice(sources, BATCH_SIZE)), [])
+    options = (storage.compact_html, storage.compress_content)
+    pending = []  # <-- Rows converted but not inserted yet
+
+    def insert(result: tuple, files: int, last: bool = False) -> None:
+        rows, size, errors = result
+        pending.extend(rows)
+        stats["files"] += files
+        stats["bytes"] += size
+        stats["errors"].extend(errors)
+        if len(pending) < TRANSACTION_SIZE and not last:
+            return
+        with storage.write() as connection:
+            connection.executemany(f"INSERT INTO {table} (title, content, {', '.join(TEXT_COLUMNS)}) "
+                                   f"VALUES (?, ?{', ?' * len(TEXT_COLUMNS)})", pending)
+        stats["imported"] += len(pending)
+        stats["seconds"] = time.perf_counter() - started
+        pending.clear()
+        if progress is not None:
+            progress(stats)
+
+    processes = (os.cpu_count() or 1) if processes is None else processes
+    if processes == 0:
+        for batch in batches:
+            insert(convert_batch(batch, *options), len(batch))
+        insert(([], 0, []), 0, last=True)
+        return stats
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        in_flight = deque()  # <-- (future, files) in the order they were read, so notes keep the order of the files
+        for batch in batches:
+            in_flight.append((pool.submit(convert_batch, batch, *options), len(batch)))
+            if len(in_flight) >= processes * BATCHES_IN_FLIGHT:
+                future, files = in_flight.popleft()
+                insert(future.result(), files)
+        while in_flight:
+            future, files = in_flight.popleft()
+            insert(future.result(), files)
+    insert(([], 0, []), 0, last=True)
+    return stats
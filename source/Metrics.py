@@ -0,0 +1,155 @@
+# coding=utf-8
+"""Code by Aens"""
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import json
+import os
+import threading
+import time
+
+ENV_VARIABLE = "UNMEMORIZE_METRICS"  # <-- Path of a JSON file where the metrics are written when the program closes
+SAMPLES_PER_TIMER = 2048  # <-- Latest durations kept per operation, the percentiles are computed over them
+RECENT_EVENTS = 500
+PERCENTILES = (50, 95, 99)
+
+
+class Timer:
+    """Durations of an operation: every call is counted, but only the latest ones are kept for the percentiles"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.samples = deque(maxlen=SAMPLES_PER_TIMER)
+
+    def add(self, duration_ns: int, failed: bool) -> None:
+        self.count += 1
+        self.errors += failed
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+        self.samples.append(duration_ns)
+
+    def get_status(self) -> dict:
+        """Return the count and the latencies in milliseconds"""
+        samples = sorted(self.samples)
+        status = {"count": self.count, "errors": self.errors, "total_ms": round(self.total_ns / 1e6, 3),
+                  "mean_ms": round(self.total_ns / self.count / 1e6, 3), "max_ms": round(self.max_ns / 1e6, 3)}
+        for percentile in PERCENTILES:
+            index = min(len(samples) - 1, len(samples) * percentile // 100)
+            status[f"p{percentile}_ms"] = round(samples[index] / 1e6, 3)
+        return status
+
+
+class Metrics:
+    """Always-on counters and timers of the operations that matter, from any thread, and a ring buffer of the
+       latest ones. Recording one is a couple of microseconds, so it never needs to be turned off"""
+    instance = None
+
+    @classmethod
+    def get(cls):
+        """Return the shared metrics"""
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.counters = {}  # The content is {"name": 1}
+        self.timers = {}  # The content is {"name": Timer}
+        self.events = deque(maxlen=RECENT_EVENTS)  # The content is [(time, name, milliseconds, failed)]
+        self.output = os.environ.get(ENV_VARIABLE, "")
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """Add to a counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name: str, duration_ns: int, failed: bool = False) -> None:
+        """Add a duration to the timer of an operation"""
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Timer()
+            timer.add(duration_ns, failed)
+            self.events.append((time.time(), name, duration_ns / 1e6, failed))
+
+    @contextmanager
+    def measure(self, name: str):
+        """Time the code inside the block as an operation. It's counted as an error if it raises"""
+        started = time.perf_counter_ns()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(name, time.perf_counter_ns() - started, failed)
+
+    def timed(self, name: str = None):
+        """Decorator that times every call of a function, named after it unless a name is given"""
+        def decorator(function):
+            label = name or function.__qualname__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.measure(label):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def get_snapshot(self) -> dict:
+        """Return everything measured since the program started, or since the last reset"""
+        with self.lock:
+            timers = {name: timer.get_status() for name, timer in self.timers.items()}
+            counters = dict(self.counters)
+            events = list(self.events)
+        return {"started": self.started.isoformat(timespec="seconds"),
+                "date": datetime.now().isoformat(timespec="seconds"), "counters": counters,
+                "timers": dict(sorted(timers.items(), key=lambda item: -item[1]["total_ms"])),
+                "events": [{"time": datetime.fromtimestamp(moment).isoformat(timespec="milliseconds"), "name": name,
+                            "ms": round(milliseconds, 3), "failed": failed}
+                           for moment, name, milliseconds, failed in events]}
+
+    def reset(self) -> None:
+        """Forget everything measured so far"""
+        with self.lock:
+            self.started = datetime.now()
+            self.counters.clear()
+            self.timers.clear()
+            self.events.clear()
+
+    def dump(self, path: str, extra: dict = None) -> None:
+        """Write the snapshot as JSON
+           :param extra: other statuses to write with it, like the ones of the caches"""
+        snapshot = self.get_snapshot()
+        if extra:
+            snapshot.update(extra)
+        with open(path, "w", encoding="UTF-8") as file:
+            json.dump(snapshot, file, indent=1, ensure_ascii=False)
+
+
+def format_metrics(snapshot: dict, statuses: dict = None) -> str:
+    """Return the snapshot as a text table, the operations that took the most time first"""
+    lines = [f"Desde {snapshot['started']}", "",
+             f"{'Operación':<42}{'Veces':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'Máx ms':>9}{'Total s':>9}"]
+    for name, timer in snapshot["timers"].items():
+        errors = f"  ({timer['errors']} errores)" if timer["errors"] else ""
+        lines.append(f"{name[:41]:<42}{timer['count']:>8,}{timer['p50_ms']:>9.2f}{timer['p95_ms']:>9.2f}"
+                     f"{timer['p99_ms']:>9.2f}{timer['max_ms']:>9.1f}{timer['total_ms'] / 1000:>9.2f}{errors}")
+    if snapshot["counters"]:
+        lines.append("")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name[:41]:<42}{value:>8,}")
+    for title, status in (statuses or {}).items():
+        lines.append("")
+        lines.append(f"{title}: " + ", ".join(f"{key}: {value}" for key, value in status.items()))
+    if snapshot["events"]:
+        lines.append("")
+        lines.append("Últimas operaciones:")
+        for event in snapshot["events"][-20:][::-1]:
+            failed = "  ERROR" if event["failed"] else ""
+            lines.append(f"{event['time'][11:]}  {event['name']:<42}{event['ms']:>9.2f} ms{failed}")
+    return "\n".join(lines)
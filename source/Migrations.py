@@ -0,0 +1,272 @@
+# coding=utf-8
+"""Code by Aens"""
+import sqlite3
+from source.ContentCodec import decode_content
+from source.NoteText import SEARCH_SOURCES, get_text_columns
+
+CHUNK_SIZE = 2000  # <-- Rows per transaction in the migrations that go through whole tables
+STARTUP_VACUUM_PAGES = 256  # <-- Databases up to these many pages (1MB with 4KB pages) are vacuumed right away
+MIGRATIONS = []  # The content is [(version, description, function, transaction)], in the order they must run
+NOTES_TABLES = {  # <-- The columns every table of notes must have, besides its id
+    "notes": ("title", "content"),
+    "private_notes": ("title", "content"),
+    "notes_deleted": ("title", "content", "deleted_at", "deleted_from")}
+
+
+def migration(version: int, description: str, transaction: bool = True):
+    """Register a function as the migration to a version of the database. Versions must go up by one, and a
+       published migration must never change: anything new goes in a new one
+       :param transaction: False for the ones that can't run inside a transaction, like a VACUUM"""
+    def register(function):
+        assert version == len(MIGRATIONS) + 1, f"Migration {version} is out of order"
+        MIGRATIONS.append((version, description, function, transaction))
+        return function
+    return register
+
+
+class Migrator:
+    """Brings the database up to the last version, which is stored in PRAGMA user_version.
+       Each migration runs in one transaction, together with the new version number, so it's either fully done or
+       not at all, except the few that can't run in one, which must be safe to repeat. The ones that go through
+       whole tables commit a chunk at a time and remember where they were, so an interrupted migration goes on from
+       there the next time"""
+
+    def __init__(self, connection: sqlite3.Connection, progress=None):
+        """
+        :param progress: callable(version, description, done, total) called after every chunk"""
+        self.connection = connection
+        self.progress = progress
+        self.version = None  # <-- Migration running right now
+
+    @staticmethod
+    def get_latest_version() -> int:
+        """Return the version the program needs"""
+        return MIGRATIONS[-1][0]
+
+    def get_version(self) -> int:
+        """Return the version of the database, 0 for new ones and the ones from before the migrations"""
+        return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def is_outdated(self) -> bool:
+        """Check if some migration is pending. It only reads the header of the file"""
+        return self.get_version() < self.get_latest_version()
+
+    def run(self) -> list:
+        """Run every pending migration in order. Returns the versions migrated to"""
+        current = self.get_version()
+        if current >= self.get_latest_version():
+            return []
+        self.connection.commit()
+        self.connection.execute("CREATE TABLE IF NOT EXISTS migration_progress "
+                                "(version INTEGER, task TEXT, last_id INTEGER, PRIMARY KEY (version, task))")
+        done = []
+        for version, description, function, transaction in MIGRATIONS:
+            if version <= current:
+                continue
+            self.version = version
+            try:
+                if transaction:
+                    self.connection.execute("BEGIN")
+                    function(self)
+                else:
+                    function(self)  # <-- It must be safe to run again if it's interrupted
+                    self.connection.execute("BEGIN")
+                self.connection.execute("DELETE FROM migration_progress WHERE version = ?", (version,))
+                self.connection.execute(f"PRAGMA user_version = {version}")  # <-- Part of the same transaction
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()  # <-- The chunks already committed are kept, it resumes from there
+                raise
+            print(f"Database migrated to version {version}: {description}")
+            done.append(version)
+        self.version = None
+        self.connection.execute("DROP TABLE migration_progress")
+        self.connection.commit()
+        return done
+
+    def has_progress(self) -> bool:
+        """Check if the running migration was interrupted after committing some chunk"""
+        return self.connection.execute("SELECT 1 FROM migration_progress WHERE version = ?",
+                                       (self.version,)).fetchone() is not None
+
+    def chunks(self, table: str, task: str, step) -> None:
+        """Run step(first_id, last_id) over the ids of a table, a chunk per transaction, remembering the last chunk
+           done, so it's never repeated if the migration is interrupted
+           :param task: name of this pass through the table, unique in the migration"""
+        row = self.connection.execute("SELECT last_id FROM migration_progress WHERE version = ? AND task = ?",
+                                      (self.version, task)).fetchone()
+        last_id = row[0] if row else 0
+        total = self.connection.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+        while True:
+            first_id = last_id + 1
+            last_id = min(last_id + CHUNK_SIZE, total)
+            if first_id <= last_id:
+                step(first_id, last_id)
+            self.connection.execute("INSERT OR REPLACE INTO migration_progress (version, task, last_id) "
+                                    "VALUES (?, ?, ?)", (self.version, task, last_id))
+            self.connection.commit()
+            self.connection.execute("BEGIN")
+            if self.progress is not None:
+                self.progress(self.version, task, last_id, total)
+            if last_id >= total:
+                break
+
+    def get_columns(self, table: str) -> list:
+        """Return the names of the columns of a table"""
+        return [row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")]
+
+
+@migration(1, "tables of notes with all their columns")
+def create_notes_tables(migrator: Migrator) -> None:
+    """Create the tables, or add the columns that older versions of the program didn't have.
+       They are added in place, at the end like before, so the notes keep their ids"""
+    for table, columns in NOTES_TABLES.items():
+        migrator.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                    f"{', '.join(f'{column} TEXT' for column in columns)})")
+        existing = migrator.get_columns(table)
+        for column in columns:
+            if column not in existing:
+                migrator.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+    migrator.connection.execute("DROP TABLE IF EXISTS private_notes_deleted")  # <-- Unused since the trash is shared
+
+
+@migration(2, "origin and date of the deleted notes")
+def fill_deleted_notes(migrator: Migrator) -> None:
+    """Notes deleted before the trash knew where they came from were all normal notes. The trash tab pages by
+       (deleted_at, id) and NULLs would break that order"""
+    def step(first_id: int, last_id: int) -> None:
+        migrator.connection.execute("UPDATE notes_deleted SET deleted_from = 'notes' "
+                                    "WHERE id BETWEEN ? AND ? AND (deleted_from IS NULL OR deleted_from = '')",
+                                    (first_id, last_id))
+        migrator.connection.execute("UPDATE notes_deleted SET deleted_at = '' "
+                                    "WHERE id BETWEEN ? AND ? AND deleted_at IS NULL", (first_id, last_id))
+    migrator.chunks("notes_deleted", "notes_deleted", step)
+
+
+@migration(3, "indexes of the trash")
+def create_trash_indexes(migrator: Migrator) -> None:
+    """The indexes the trash tab uses to sort and page through the deleted notes"""
+    migrator.connection.execute("CREATE INDEX IF NOT EXISTS notes_deleted_deleted_at ON notes_deleted (deleted_at)")
+    migrator.connection.execute("CREATE INDEX IF NOT EXISTS notes_deleted_deleted_from "
+                                "ON notes_deleted (deleted_from)")
+
+
+@migration(4, "full-text search index")
+def create_search_index(migrator: Migrator) -> None:
+    """Create the full-text search table of all the notes and the triggers that keep it in sync.
+       The text is extracted from the HTML by note_text(), a function every connection of the Storage has"""
+    connection = migrator.connection
+    index_exists = connection.execute("SELECT 1 FROM sqlite_master "
+                                      "WHERE type = 'table' AND name = 'notes_search'").fetchone() is not None
+    connection.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS notes_search
+        USING fts5(title, body, tokenize = 'unicode61 remove_diacritics 2')
+        """)
+    for table, source in SEARCH_SOURCES.items():
+        connection.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO notes_search (rowid, title, body)
+                VALUES (new.id * 4 + {source}, new.title, note_text(new.content));
+            END""")
+        connection.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF title, content ON {table} BEGIN
+                UPDATE notes_search SET title = new.title, body = note_text(new.content)
+                WHERE rowid = old.id * 4 + {source};
+            END""")
+        connection.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM notes_search WHERE rowid = old.id * 4 + {source};
+            END""")
+    # Fill it with the notes we already had, unless an older version of the program already did
+    if index_exists and not migrator.has_progress():
+        return
+    for table, source in SEARCH_SOURCES.items():
+        migrator.chunks(table, f"search {table}", lambda first_id, last_id, table=table, source=source:
+                        connection.execute(f"INSERT INTO notes_search (rowid, title, body) "
+                                           f"SELECT id * 4 + {source}, title, note_text(content) FROM {table} "
+                                           f"WHERE id BETWEEN ? AND ?", (first_id, last_id)))
+
+
+@migration(5, "history of the notes")
+def create_revisions_table(migrator: Migrator) -> None:
+    """Create the table with the history of every note, see source/Revisions.py for the format"""
+    migrator.connection.execute("""
+        CREATE TABLE IF NOT EXISTS notes_revisions
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_table TEXT,
+        note_id INTEGER,
+        revision INTEGER,
+        is_snapshot INTEGER,
+        data BLOB,
+        created_at TEXT)
+        """)
+    migrator.connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS notes_revisions_note "
+                                "ON notes_revisions (note_table, note_id, revision)")
+
+
+@migration(6, "space of the purged notes given back to the system", transaction=False)
+def enable_incremental_vacuum(migrator: Migrator) -> None:
+    """Let the free pages be returned in small steps with incremental_vacuum, see source/TrashRetention.py.
+       In a database that already has tables it only changes with a full VACUUM, which rewrites the whole file, so
+       it's left for `python Main.py --vacuum` unless the database is still small. It can't run in a transaction"""
+    connection = migrator.connection
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # <-- 2 is INCREMENTAL
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")  # <-- Waits for the next VACUUM
+        if connection.execute("PRAGMA page_count").fetchone()[0] <= STARTUP_VACUUM_PAGES:
+            connection.execute("VACUUM")
+
+
+@migration(7, "plain text, preview and counts of the notes")
+def add_text_columns(migrator: Migrator) -> None:
+    """Store the text of every note next to its content, see TEXT_COLUMNS in source/NoteText.py, and make the search
+       index read it from there, or from the content if something wrote a note without it. The search triggers are
+       dropped while the tables are filled, so the index isn't rewritten with the same text"""
+    connection = migrator.connection
+    columns = (("preview", "TEXT"), ("word_count", "INTEGER"), ("char_count", "INTEGER"), ("plain_text", "TEXT"))
+    for table in SEARCH_SOURCES:
+        connection.execute(f"DROP TRIGGER IF EXISTS {table}_search_insert")
+        connection.execute(f"DROP TRIGGER IF EXISTS {table}_search_update")
+        existing = migrator.get_columns(table)
+        for column, kind in columns:
+            if column not in existing:
+                connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    def step(first_id: int, last_id: int, table: str) -> None:
+        rows = connection.execute(f"SELECT id, content FROM {table} WHERE id BETWEEN ? AND ?",
+                                  (first_id, last_id)).fetchall()
+        connection.executemany(f"UPDATE {table} SET preview = ?, word_count = ?, char_count = ?, plain_text = ? "
+                               f"WHERE id = ?", ((*get_text_columns(decode_content(content, expand=False)), _id)
+                                                 for _id, content in rows))
+    for table, source in SEARCH_SOURCES.items():
+        migrator.chunks(table, f"text {table}", lambda first_id, last_id, table=table: step(first_id, last_id, table))
+        connection.execute(f"""
+            CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO notes_search (rowid, title, body)
+                VALUES (new.id * 4 + {source}, new.title, ifnull(new.plain_text, note_text(new.content)));
+            END""")
+        connection.execute(f"""
+            CREATE TRIGGER {table}_search_update AFTER UPDATE OF title, plain_text ON {table} BEGIN
+                UPDATE notes_search SET title = new.title, body = new.plain_text WHERE rowid = old.id * 4 + {source};
+            END""")
+
+
+@migration(8, "change stamps of the notes")
+def add_change_stamps(migrator: Migrator) -> None:
+    """Stamp every note that is inserted or updated with the next value of a counter, so source/ChangeWatcher.py can
+       find what other programs changed by reading only the notes stamped after the last one it saw. They are
+       triggers, so it works for anything that writes to the file. The notes from before have no stamp, older than
+       any other"""
+    connection = migrator.connection
+    connection.execute("CREATE TABLE IF NOT EXISTS change_counter (id INTEGER PRIMARY KEY CHECK (id = 1), "
+                       "value INTEGER NOT NULL)")
+    connection.execute("INSERT OR IGNORE INTO change_counter (id, value) VALUES (1, 0)")
+    for table in NOTES_TABLES:
+        if "changed" not in migrator.get_columns(table):
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN changed INTEGER")
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_changed ON {table} (changed)")
+        for name, event in (("insert", "INSERT"), ("update", "UPDATE OF title, content")):
+            connection.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_changed_{name} AFTER {event} ON {table} BEGIN
+                    UPDATE change_counter SET value = value + 1 WHERE id = 1;
+                    UPDATE {table} SET changed = (SELECT value FROM change_counter WHERE id = 1) WHERE id = new.id;
+                END""")
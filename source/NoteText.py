@@ -0,0 +1,92 @@
+# coding=utf-8
+"""Code by Aens"""
+from html import escape, unescape
+import re
+
+HTML_HEAD = re.compile(r"<head>.*?</head>", re.IGNORECASE | re.DOTALL)
+HTML_LINE_BREAKS = re.compile(r"<br\s*/?>\s*</p>|<br\s*/?>|</p>|</li>|</h\d>|</tr>", re.IGNORECASE)
+HTML_TAGS = re.compile(r"<[^>]+>")
+# Canonical compact form of the HTML of QTextEdit.toHtml(): the fixed head is dropped and the default inline styles
+# become bare tags. It's still HTML, and it's expanded back to the exact same text before Qt sees it
+COMPACT_MARKER = "<!--qt1-->"  # <-- Compact notes start with this instead of the head
+QT_HTML_HEAD = ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0//EN" "http://www.w3.org/TR/REC-html40/strict.dtd">\n'
+                '<html><head><meta name="qrichtext" content="1" /><meta charset="utf-8" /><style type="text/css">\n'
+                'p, li { white-space: pre-wrap; }\n'
+                'hr { height: 1px; border-width: 0; }\n'
+                'li.unchecked::marker { content: "\\2610"; }\n'
+                'li.checked::marker { content: "\\2612"; }\n'
+                '</style></head>')
+QT_BLOCK_STYLE = ("margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; "
+                  "text-indent:0px;")
+QT_LIST_STYLE = "margin-top: 0px; margin-bottom: 0px; margin-left: 0px; margin-right: 0px; -qt-list-indent: 1;"
+COMPACT_TAGS = (  # <-- (what Qt writes, what we store). Qt always writes the style, so the short tags never clash
+    (f'<p style="-qt-paragraph-type:empty; {QT_BLOCK_STYLE}">', '<p class="e">'),
+    (f'<p style=" {QT_BLOCK_STYLE}">', "<p>"),
+    (f'<li style=" {QT_BLOCK_STYLE}">', "<li>"),
+    (f'<ul style="{QT_LIST_STYLE}">', "<ul>"),
+    (f'<ol style="{QT_LIST_STYLE}">', "<ol>"))
+# Every table of notes is indexed in the same search table, its rowid is (id * 4 + source)
+SEARCH_SOURCES = {"notes": 1, "private_notes": 2, "notes_deleted": 3}
+# Columns derived from the content, written with it, so previews, copies and the search never parse the HTML again.
+# The small ones go first: a row is read from its start, and the plain text may spill over several pages
+TEXT_COLUMNS = ("preview", "word_count", "char_count", "plain_text")
+PREVIEW_LENGTH = 300  # <-- Characters of the text stored as its preview
+
+
+def html_to_text(html: str) -> str:
+    """Extract the plain text of a note stored as Qt HTML, without needing a QTextDocument"""
+    if not html:
+        return ""
+    text = HTML_HEAD.sub("", html).replace("\n", "")  # <-- Qt never stores real line breaks as text
+    text = HTML_LINE_BREAKS.sub("\n", text)
+    text = HTML_TAGS.sub("", text)
+    return unescape(text).strip()
+
+
+def get_text_columns(html: str) -> tuple:
+    """Return the values of the TEXT_COLUMNS for the content of a note, in the same order"""
+    text = html_to_text(html)
+    return text[:PREVIEW_LENGTH], len(text.split()), len(text), text
+
+
+def compact_html(html: str) -> str:
+    """Return the canonical compact form of a note. Anything that wouldn't expand back exactly is returned as is"""
+    if not html or not html.startswith(QT_HTML_HEAD):
+        return html
+    compact = html[len(QT_HTML_HEAD):]
+    if COMPACT_MARKER in compact or any(short in compact for _, short in COMPACT_TAGS):
+        return html  # <-- Not written by Qt, the short tags would be ambiguous
+    for tag, short in COMPACT_TAGS:
+        compact = compact.replace(tag, short)
+    compact = COMPACT_MARKER + compact
+    return compact if expand_html(compact) == html else html
+
+
+def expand_html(text: str) -> str:
+    """Return the exact HTML Qt wrote for a note stored in compact form, other texts are returned as they are"""
+    if not text or not text.startswith(COMPACT_MARKER):
+        return text
+    html = text[len(COMPACT_MARKER):]
+    for tag, short in COMPACT_TAGS:
+        html = html.replace(short, tag)
+    return QT_HTML_HEAD + html
+
+
+def search_rowid_to_note(rowid: int) -> tuple:
+    """Return the (table, id) of a row of the search table"""
+    source = rowid % 4
+    for table, number in SEARCH_SOURCES.items():
+        if number == source:
+            return table, rowid // 4
+    raise ValueError(f"The search row {rowid} doesn't belong to any table")
+
+
+def build_search_query(text: str) -> str:
+    """Turn what the user typed into an FTS5 query: every word must appear, as a prefix of a word of the note"""
+    words = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def highlight_matches(text: str) -> str:
+    """Escape a text returned by the search table and turn its match markers into <b> tags"""
+    return escape(text or "").replace("\x02", "<b>").replace("\x03", "</b>")
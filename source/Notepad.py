@@ -1,9 +1,20 @@
 # coding=utf-8
 """Code by Aens"""
+from concurrent.futures import Future
 from datetime import datetime
-import sqlite3
 from pathlib import Path
-import shutil
+from source.Backup import create_backup, MIGRATION_PREFIX
+from source.BodyCache import LazyRecords
+from source.ContentCodec import decode_content
+from source.Metrics import Metrics
+from source.Migrations import Migrator
+from source.NoteText import search_rowid_to_note, build_search_query, highlight_matches
+from source.NoteText import TEXT_COLUMNS, PREVIEW_LENGTH
+from source.Storage import Storage
+from source.TrashRetention import reclaim_space, VACUUM_STEP_PAGES
+
+METRICS = Metrics.get()
+NOTE_COLUMNS = ", ".join(("title", "content", *TEXT_COLUMNS))  # <-- What goes with a note when it's moved
 
 
 class SQLNotepad:
@@ -12,238 +23,322 @@ class SQLNotepad:
     def __init__(self, gui):
         """Initialize SQLite database connection, create notes table if not exists and load all notes"""
         self.gui = gui
-        self.notes = {}  # The content is {{1: (title, content)}, {2: (title, content)}}
-        self.private_notes = {}  # The content is {{1: (title, content)}, {2: (title, content)}}
-        self.deleted_notes = {}  # The content is {{1: (title, content, deleted_at)}, {2: (title, content, deleted_at)}}
-        # Database file
-        self.db_path = Path.cwd().joinpath("notes/notes.db")
-        self.connection = sqlite3.connect(self.db_path)
-        self.cursor = self.connection.cursor()
+        # Database, shared with every other notepad
+        self.storage = Storage.get()
+        self.db_path = self.storage.db_path
+        self.writer = self.storage.get_writer()  # <-- Saves and renames are written from a background thread
+        self.worker = self.storage.get_worker()  # <-- Runs the slow commands without blocking the GUI
+        self.revisions = self.storage.get_revisions()  # <-- Every saved version of the notes
+        self.bodies = self.storage.get_body_cache()  # <-- Contents of the notes, only used if they are lazy
+        self.lazy = self.storage.lazy_bodies
+        # Notes. Lazy ones only hold the titles and read each content from the body cache when it's needed
+        self.notes = LazyRecords(self.bodies, "notes") if self.lazy else {}  # The content is {1: (title, content)}
+        self.private_notes = LazyRecords(self.bodies, "private_notes") if self.lazy else {}  # Same as notes
+        # The content is {1: (title, content, deleted_at, deleted_from)}
+        self.deleted_notes = LazyRecords(self.bodies, "notes_deleted") if self.lazy else {}
 
+    def close(self) -> None:
+        """Write everything that is still pending, it must be called before the program exits"""
+        self.worker.close()  # <-- First, its commands may still need the writer
+        self.writer.close()
+
+    @METRICS.timed()
     def reload_notes(self):
         """Clean the previous list. Load notes from the database into the class"""
         self.notes.clear()
-        self.cursor.execute('SELECT id, title, content FROM notes')
-        rows = self.cursor.fetchall()
-        for row in rows:
-            _id, title, content = row
-            self.notes[_id] = (title, content)
+        with self.storage.read() as connection:
+            if self.lazy:  # Only the titles, each content is read when something needs it
+                for _id, title in connection.execute('SELECT id, title FROM notes'):
+                    self.notes.add(_id, title)
+            else:
+                for _id, title, content in connection.execute('SELECT id, title, content FROM notes'):
+                    self.notes[_id] = (title, decode_content(content))
+        self.writer.overlay("notes", self.notes)  # <-- Edits still waiting to be written
 
+    @METRICS.timed()
     def reload_private_notes(self):
         """Clean the previous list. Load private notes from the database into the class"""
         self.private_notes.clear()
-        self.cursor.execute('SELECT id, title, content FROM private_notes')
-        rows = self.cursor.fetchall()
-        for row in rows:
-            _id, title, content = row
-            self.private_notes[_id] = (title, content)
+        with self.storage.read() as connection:
+            if self.lazy:  # Only the titles, each content is read when something needs it
+                for _id, title in connection.execute('SELECT id, title FROM private_notes'):
+                    self.private_notes.add(_id, title)
+            else:
+                for _id, title, content in connection.execute('SELECT id, title, content FROM private_notes'):
+                    self.private_notes[_id] = (title, decode_content(content))
+        self.writer.overlay("private_notes", self.private_notes)  # <-- Edits still waiting to be written
 
+    @METRICS.timed()
     def reload_deleted_notes(self):
         """Clean the previous list. Load notes from the database into the class"""
         self.deleted_notes.clear()
-        self.cursor.execute('SELECT id, title, content, deleted_at, deleted_from FROM notes_deleted')
-        rows = self.cursor.fetchall()
-        for row in rows:
-            _id, title, content, deleted_at, deleted_from = row
-            self.deleted_notes[_id] = (title, content, deleted_at, deleted_from)
-
-    def add_note(self, new_name: str, table: str):
-        """Adds a new note to the database"""
-        try:
-            # Insert the new note into the database
-            self.cursor.execute(f'INSERT INTO {table} (id, title, content) '
-                                'VALUES (NULL, ?, NULL)',
-                                (new_name,))
-            self.connection.commit()
-            self.gui.show_in_statusbar(f"Nota '{new_name}' creada con éxito.")
-        except Exception as e:
-            self.gui.show_in_statusbar(f"ERROR: No he podido crear la nota '{new_name}': {e}", mode="error")
+        with self.storage.read() as connection:
+            if self.lazy:  # Only the titles and dates, each content is read when something needs it
+                for _id, title, deleted_at, deleted_from in connection.execute(
+                        'SELECT id, title, deleted_at, deleted_from FROM notes_deleted'):
+                    self.deleted_notes.add(_id, title, deleted_at, deleted_from)
+            else:
+                for _id, title, content, deleted_at, deleted_from in connection.execute(
+                        'SELECT id, title, content, deleted_at, deleted_from FROM notes_deleted'):
+                    self.deleted_notes[_id] = (title, decode_content(content), deleted_at, deleted_from)
+
+    def apply_changes(self, table: str, rows: list, removed: set, shown: dict, busy: set) -> tuple:
+        """Merge the notes that another program changed into the records, without reading the rest of them.
+           :param rows: [(id, title, content)] as they are stored, see ChangeWatcher.fetch_changes
+           :param shown: {_id: (title, content)} of what the cards show, the rows that match them are our own writes
+           :param busy: ids of the notes with unsaved edits, the version of the user wins for those
+           Returns (ids updated, True if notes were added or removed)"""
+        records = self.notes if table == "notes" else self.private_notes
+        pending = self.writer.get_pending_ids(table)  # <-- Their next write overwrites the row we read
+        updated = []
+        moved = False
+        for _id, title, content in rows:
+            if _id in busy or _id in pending:
+                continue
+            if _id in shown and shown[_id][0] == title and self.storage.encode_content(shown[_id][1]) == content:
+                continue  # <-- Already on screen, we wrote it
+            moved = moved or _id not in records
+            if self.lazy:
+                self.bodies.put(table, _id, decode_content(content))
+                records.add(_id, title)
+                records.overrides.pop(_id, None)  # <-- A content we wrote earlier, it must not win over this one
+            else:
+                records[_id] = (title, decode_content(content))
+            updated.append(_id)
+        for _id in removed:
+            self.bodies.forget(table, _id)
+            if _id in records:
+                del records[_id]
+                moved = True
+        return updated, moved
+
+    @METRICS.timed()
+    def fetch_deleted_notes_page(self, after: tuple = None, limit: int = 200, sort_column: str = "deleted_at",
+                                 descending: bool = True) -> list:
+        """Load one page of deleted notes, continuing after the (sort value, id) of the last row we already have.
+           It walks the index of the sort column, so every page costs the same no matter how big the trash is.
+           Returns [(id, title, preview, deleted_at, deleted_from, word_count, char_count)], never the content"""
+        if sort_column not in ("deleted_at", "deleted_from"):
+            raise ValueError(f"Can't sort deleted notes by {sort_column}")
+        direction, comparison = ("DESC", "<") if descending else ("ASC", ">")
+        where = f"WHERE ({sort_column}, id) {comparison} (?, ?) " if after else ""
+        with self.storage.read() as connection:
+            return connection.execute('SELECT id, title, '
+                                      f'ifnull(preview, substr(note_text(content), 1, {PREVIEW_LENGTH})), '
+                                      'deleted_at, deleted_from, word_count, char_count FROM notes_deleted '
+                                      f'{where}'
+                                      f'ORDER BY {sort_column} {direction}, id {direction} '
+                                      'LIMIT ?', (*after, limit) if after else (limit,)).fetchall()
+
+    def get_title(self, _id: int, table: str) -> str:
+        """Return the title of a note without reading its content, even if it's no longer in the body cache"""
+        records = self.notes if table == "notes" else self.private_notes
+        return records.get_title(_id) if self.lazy else records[_id][0]
 
+    def read_content(self, _id: int, table: str):
+        """Return the content of a note as the database has it, or None if it's gone.
+           It doesn't use the body cache, so any thread can call it"""
+        with self.storage.read() as connection:
+            row = connection.execute(f"SELECT content FROM {table} WHERE id = ?", (_id,)).fetchone()
+        return decode_content(row[0]) if row else None
+
+    @METRICS.timed()
+    def search_notes(self, text: str, limit: int = 50) -> list:
+        """Search a text among all the notes, private notes and deleted notes, the best matches first. It waits for
+           the writer, so it must run in the storage worker.
+           Returns a list of (table, _id, title, snippet) where the matches are highlighted with <b> tags"""
+        query = build_search_query(text)
+        if not query:
+            return []
+        self.writer.flush()  # <-- So the last edits can be found too, or what is on disk if they can't be written
+        with self.storage.read() as connection:
+            # Matches are marked with control characters, so the text can be escaped before turning them into tags
+            rows = connection.execute("SELECT rowid, highlight(notes_search, 0, char(2), char(3)), "
+                                      "snippet(notes_search, 1, char(2), char(3), '…', 16) "
+                                      "FROM notes_search WHERE notes_search MATCH ? "
+                                      "ORDER BY rank LIMIT ?", (query, limit)).fetchall()
+        return [(*search_rowid_to_note(rowid), highlight_matches(title), highlight_matches(snippet))
+                for rowid, title, snippet in rows]
+
+    def add_note(self, new_name: str, table: str, callback=None) -> Future:
+        """Adds a new note to the database, in the storage worker. callback(None) runs once it's there"""
+        def add():
+            with self.storage.write() as connection:
+                connection.execute(f'INSERT INTO {table} (id, title, content) '
+                                   'VALUES (NULL, ?, NULL)',
+                                   (new_name,))
+        return self.run_command(add, done_message=f"Nota '{new_name}' creada con éxito.",
+                                error_message=f"ERROR: No he podido crear la nota '{new_name}'", callback=callback)
+
+    @METRICS.timed()
     def save_note(self, _id: int, title: str, value: str, table: str) -> None:
-        """Saves a note with these new values to the database"""
+        """Saves a note with these new values to the database, the writer thread does it in the background"""
         try:
-            # Update the content of the existing note in the database
-            self.cursor.execute(f'UPDATE {table} '
-                                'SET content = ? '
-                                'WHERE id = ?', (value, _id))
-            self.connection.commit()
+            # Queue the new content of the existing note, the last one wins if it's saved again before writing
+            self.writer.queue_job(lambda connection: self.revisions.record(connection, table, _id, value))
+            self.writer.queue(table, _id, content=value)
+            self.bodies.put(table, _id, value)  # <-- The cache must never hold an older content
             self.gui.show_in_statusbar(f"Nota '{title}' guardada con éxito.")
         except Exception as e:
             self.gui.show_in_statusbar(f"ERROR: No he podido guardar la nota '{title}': {e}", mode="error")
 
+    @METRICS.timed()
     def rename_note(self, _id: int, title: str, table: str) -> None:
-        """Saves a note with these new values to the database"""
+        """Saves a note with these new values to the database, the writer thread does it in the background"""
         try:
-            # Update the content of the existing note in the database
-            self.cursor.execute(f'UPDATE {table} '
-                                'SET title = ? '
-                                'WHERE id = ?', (title, _id))
-            self.connection.commit()
+            # Queue the new title of the existing note, the last one wins if it's renamed again before writing
+            self.writer.queue(table, _id, title=title)
             self.gui.show_in_statusbar(f"Titulo de '{title}' renombrado con éxito.")
         except Exception as e:
             self.gui.show_in_statusbar(f"ERROR: No he podido renombrar la nota '{title}': {e}", mode="error")
 
-    def delete_note(self, _id: int, name: str, table: str) -> None:
-        """It doesn't delete notes, it just moves them to a different table"""
-        try:
+    def delete_note(self, _id: int, name: str, table: str, callback=None) -> Future:
+        """It doesn't delete notes, it just moves them to a different table, in the storage worker.
+           callback(None) runs once it's moved"""
+        def delete():
+            if not self.writer.flush():  # <-- The note must be moved with its latest content
+                raise IOError("the last changes of the note couldn't be written")
             deleted_time = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
-            # Move the note to a different table
-            self.cursor.execute(f"INSERT INTO notes_deleted (title, content, deleted_at, deleted_from) "
-                                "SELECT title, content, ?, ? "
-                                f"FROM {table} "
-                                "WHERE id = ?",
-                                (deleted_time, table, _id))
-            # Delete the note on this table
-            self.cursor.execute(f"DELETE FROM {table} WHERE id = ?", (_id,))
-            self.connection.commit()
-            self.gui.show_in_statusbar(f"Se ha movido la nota: {name} a la tabla de notas borradas")
-        except Exception as e:
-            self.gui.show_in_statusbar(f"ERROR: No he podido mover la nota '{name}': {e}", mode="error")
+            with self.storage.write() as connection:
+                # Move the note to a different table
+                cursor = connection.execute(f"INSERT INTO notes_deleted ({NOTE_COLUMNS}, deleted_at, deleted_from) "
+                                            f"SELECT {NOTE_COLUMNS}, ?, ? "
+                                            f"FROM {table} "
+                                            "WHERE id = ?",
+                                            (deleted_time, table, _id))
+                # Its history goes to the trash with it
+                self.revisions.move(connection, table, _id, "notes_deleted", cursor.lastrowid)
+                # Delete the note on this table
+                connection.execute(f"DELETE FROM {table} WHERE id = ?", (_id,))
 
-    def delete_note_forever(self, _id: int, name: str) -> None:
-        """Permanently delete the note"""
-        try:
-            # Delete the note
-            self.cursor.execute(f"DELETE FROM notes_deleted WHERE id = ?", (_id,))
-            self.connection.commit()
-            self.gui.show_in_statusbar(f"Se ha eliminado permanentemente la nota: {name}")
-        except Exception as e:
-            self.gui.show_in_statusbar(f"ERROR: No he podido eliminar la nota '{name}': {e}", mode="error")
+        def deleted(result):
+            self.bodies.forget(table, _id)
+            if callback is not None:
+                callback(result)
+        return self.run_command(delete, done_message=f"Se ha movido la nota: {name} a la tabla de notas borradas",
+                                error_message=f"ERROR: No he podido mover la nota '{name}'", callback=deleted)
 
-    def restore_note(self, _id: int, name: str) -> None:
-        """Permanently delete the note"""
-        try:
-            # Get table name
-            self.cursor.execute("SELECT deleted_from FROM notes_deleted WHERE id = ?", (_id,))
-            table = self.cursor.fetchone()[0]
-            # Restore the note
-            self.cursor.execute(f"INSERT INTO {table} (title, content)"
-                                "SELECT title, content "
-                                "FROM notes_deleted "
-                                "WHERE id = ?",
-                                (_id,))
-            # Delete the note on this table
-            self.cursor.execute(f"DELETE FROM notes_deleted WHERE id = ?", (_id,))
-            self.connection.commit()
-            self.gui.show_in_statusbar(f"Se ha restaurado la nota: {name}.")
-        except Exception as e:
-            self.gui.show_in_statusbar(f"ERROR: No he podido restaurar la nota '{name}': {e}", mode="error")
+    def delete_note_forever(self, _id: int, name: str, callback=None) -> Future:
+        """Permanently delete the note, in the storage worker. callback(None) runs once it's gone"""
+        def delete():
+            with self.storage.write() as connection:
+                connection.execute(f"DELETE FROM notes_deleted WHERE id = ?", (_id,))
+                self.revisions.forget(connection, "notes_deleted", _id)
+            reclaim_space(self.storage, max_pages=VACUUM_STEP_PAGES)  # <-- A step, the rest goes with the next purge
+
+        def deleted(result):
+            self.bodies.forget("notes_deleted", _id)
+            if callback is not None:
+                callback(result)
+        return self.run_command(delete, done_message=f"Se ha eliminado permanentemente la nota: {name}",
+                                error_message=f"ERROR: No he podido eliminar la nota '{name}'", callback=deleted)
+
+    def restore_note(self, _id: int, name: str, callback=None) -> Future:
+        """Move a deleted note back to the table it came from, in the storage worker.
+           callback(table) runs once it's back"""
+        def restore():
+            with self.storage.write() as connection:
+                # Get table name
+                table = connection.execute("SELECT deleted_from FROM notes_deleted WHERE id = ?", (_id,)).fetchone()[0]
+                # Restore the note
+                cursor = connection.execute(f"INSERT INTO {table} ({NOTE_COLUMNS}) "
+                                            f"SELECT {NOTE_COLUMNS} "
+                                            "FROM notes_deleted "
+                                            "WHERE id = ?",
+                                            (_id,))
+                self.revisions.move(connection, "notes_deleted", _id, table, cursor.lastrowid)
+                # Delete the note on this table
+                connection.execute(f"DELETE FROM notes_deleted WHERE id = ?", (_id,))
+            return table
+
+        def restored(table):
+            self.bodies.forget("notes_deleted", _id)
+            if callback is not None:
+                callback(table)
+        return self.run_command(restore, done_message=f"Se ha restaurado la nota: {name}.",
+                                error_message=f"ERROR: No he podido restaurar la nota '{name}'", callback=restored)
+
+    def purge_trash(self, retention, callback=None, errback=None) -> Future:
+        """Permanently delete the notes of the trash that the retention limits don't keep, in the storage worker.
+           callback(result) runs once they are gone, see TrashRetention.purge for the result"""
+        def purged(result):
+            for _id in result["ids"]:
+                self.bodies.forget("notes_deleted", _id)
+                if _id in self.deleted_notes:
+                    del self.deleted_notes[_id]
+            if callback is not None:
+                callback(result)
+        return self.run_command(retention.purge, callback=purged,
+                                done_message=lambda result: f"Papelera revisada: {len(result['ids'])} notas "
+                                                            f"eliminadas permanentemente.",
+                                error_message="ERROR: No he podido vaciar la papelera", errback=errback)
+
+    def run_command(self, command, done_message, error_message: str, callback=None, errback=None) -> Future:
+        """Run a database command in the storage worker and tell how it went in the status bar.
+           callback(result) runs in the GUI thread if it worked, errback(error) if it didn't
+           :param done_message: a text, or callable(result) that returns it"""
+        def done(result):
+            self.gui.show_in_statusbar(done_message(result) if callable(done_message) else done_message)
+            if callback is not None:
+                callback(result)
+
+        def failed(error):
+            self.gui.show_in_statusbar(f"{error_message}: {error}", mode="error")
+            if errback is not None:
+                errback(error)
+
+        def measured():
+            with METRICS.measure(name):  # <-- Timed in the worker, what it takes to run, not to queue
+                return command()
+        name = command.__qualname__.split(".<locals>")[0]  # <-- Named after the method that queued it
+        return self.worker.run(measured, callback=done, errback=failed)
+
+    def list_revisions(self, _id: int, table: str, callback) -> Future:
+        """Read the saved versions of a note in the storage worker, after the saves still waiting in the writer.
+           callback(revisions) runs once they are read, the newest first, as [(revision, created_at, stored_bytes)]"""
+        def read():
+            self.writer.flush()  # <-- So the last saves are listed too, or only what is on disk if they can't be
+            return self.revisions.list_revisions(table, _id)
+
+        def failed(error):
+            self.gui.show_in_statusbar(f"ERROR: No he podido leer el historial de la nota: {error}", mode="error")
+        return self.worker.run(read, callback=callback, errback=failed)
+
+    def restore_revision(self, _id: int, title: str, revision: int, table: str, callback) -> Future:
+        """Rebuild an old version of a note in the storage worker, and save it as its newest one, so the restore can be
+           undone too. callback(content) runs once it's saved"""
+        def saved(content):
+            self.save_note(_id, title, content, table)
+            self.gui.show_in_statusbar(f"Se ha recuperado la versión {revision} de la nota '{title}'.")
+            callback(content)
+
+        def failed(error):
+            self.gui.show_in_statusbar(f"ERROR: No he podido recuperar la versión {revision} de '{title}': {error}",
+                                       mode="error")
+        return self.worker.run(self.revisions.get_content, table, _id, revision, callback=saved, errback=failed)
 
 
 class PrepareDatabase:
     """Class that makes sure your database is correctc"""
 
     def __init__(self):
-        """Initialize SQLite database connection and check if we need to fix something"""
-        self.connection = None
-        # IF database file doesn't exists
+        """Open the database and run the migrations it's missing, see source/Migrations.py.
+           When it's up to date this only reads its version"""
         self.db_path = Path.cwd().joinpath("notes/notes.db")
         db_exists = self.db_path.exists()  # Store temporary
-        self.connection = sqlite3.connect(self.db_path)  # Because this line creates the file automatically
-        self.cursor = self.connection.cursor()
-        if not db_exists:
-            self.create_database_tables()
-        # IF database is missing some columns
-        self.check_if_fixes_are_needed()
-        self.fix_deletion()
-
-    def fix_deletion(self):  # TODO temporary
-        """Automatically assign values to new column, and delete old table"""
-        self.cursor.execute("SELECT * FROM notes_deleted WHERE deleted_from IS NULL OR deleted_from = ''")
-        records = self.cursor.fetchall()
-        if records:
-            for record in records:
-                self.cursor.execute("UPDATE notes_deleted SET deleted_from = 'notes' WHERE id = ?", (record[0],))
-        self.connection.commit()
-        # Remove the unudes table
-        self.cursor.execute("DROP TABLE IF EXISTS private_notes_deleted")
-        self.connection.commit()
-
-    def create_database_tables(self) -> None:
-        """Create all the needed tables for the program to work with"""
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS notes 
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT, 
-            content TEXT)
-            """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS private_notes 
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT, 
-            content TEXT)
-            """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS notes_deleted 
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT, 
-            content TEXT, 
-            deleted_at TEXT,
-            deleted_from TEXT)
-            """)
-        self.connection.commit()
-
-    def check_if_fixes_are_needed(self) -> None:
-        """Check if we have all the needed databases with the correct columns"""
-        tables = {
-            "notes":                 ['id', 'title', 'content'],
-            "private_notes":         ['id', 'title', 'content'],
-            "notes_deleted":         ['id', 'title', 'content', 'deleted_at', 'deleted_from']
-        }
-        tables_to_fix = []
-        # 1 - Check if the table doesn't have all the required columns
-        for table, columns in tables.items():
-            if not self.check_table_columns(table, columns):
-                tables_to_fix.append(table)  # Missing some columns
-        # 2 - For those identified to have missing values, fix them
-        if tables_to_fix:
-            # 2.1 - First, create a backup of the entire thing
+        self.storage = Storage.get()  # Because this line creates the file automatically
+        self.connection = self.storage.connection  # <-- Nothing else is running yet, so we can use the writer
+        migrator = Migrator(self.connection, progress=self.show_progress)
+        if db_exists and migrator.is_outdated():
             self.create_database_backup()
-            # 2.2 - Second, fix the columns in the current database
-            self.fix_tables(tables_to_fix)
-
-    def fix_tables(self, tables_to_fix: list) -> None:
-        """Make sure to create the missing columns in the tables"""
-        # 1 - Copy data to a temp table and delete original table
-        for table in tables_to_fix:
-            # In order to ignore the auto-increment column, we need to get column names and then remove it
-            columns = self.cursor.execute(f"PRAGMA table_info('{table}')")
-            column_names = ", ".join([col[1] for col in columns if col[1] != 'id'])  # We ignore ID column
-            # Now copy to the temporary column all data except ID column
-            self.cursor.execute(f"CREATE TABLE temp_{table} AS SELECT {column_names} FROM {table};")
-            self.cursor.execute(f"DROP TABLE {table};")
-        # 2 - Recreate original tables with the good scheme this time
-        self. create_database_tables()
-        # 3 - Copy data back to the tables and delete temp tables
-        for table in tables_to_fix:
-            # Get the number of columns of both new table and temporal table
-            columns_new = self.cursor.execute(f"PRAGMA table_info('{table}')")
-            column_names_new = [col[1] for col in columns_new if col[1] != 'id']
-            columns_temp = self.cursor.execute(f"PRAGMA table_info('temp_{table}')")
-            column_names_temp = [col[1] for col in columns_temp]
-            # Build a list of NULLS with the amount of new added columns
-            new_empty_fields = (len(column_names_new) - len(column_names_temp))
-            new_empty_fields = ', '.join(["NULL"] * new_empty_fields) if new_empty_fields > 1 else "NULL"
-            try:
-                self.cursor.execute(f"INSERT INTO {table} SELECT NULL, *, {new_empty_fields} FROM temp_{table};")
-            except sqlite3.OperationalError:
-                self.cursor.execute(f"INSERT INTO {table} SELECT NULL, * FROM temp_{table};")
-            self.cursor.execute(f"DROP TABLE temp_{table};")
-        # 4 - Save all changes
-        self.connection.commit()
+        migrator.run()
 
     def create_database_backup(self) -> None:
         """Create a database backup just in case"""
-        time_now = datetime.strftime(datetime.now(), "%y-%m-%d %H_%M_%S")
-        backup_db_path = Path.cwd().joinpath(f"notes/notes_backup_{time_now}.db")
-        shutil.copy(self.db_path, backup_db_path)
-        print("Database structure needs update, so I've created a backup in the Notes folder for safety")
-
-    def check_table_columns(self, table_name: str, required_columns: list) -> bool:
-        """Check if all columns exists in a table"""
-        self.cursor.execute(f"PRAGMA table_info({table_name})")
-        existing_columns = [row[1] for row in self.cursor.fetchall()]
-        for column in required_columns:
-            if column not in existing_columns:
-                return False
-        return True
+        backup_db_path = create_backup(self.storage, self.db_path.parent, prefix=MIGRATION_PREFIX)
+        print(f"Database structure needs update, so I've created a backup in {backup_db_path} for safety")
+
+    @staticmethod
+    def show_progress(version: int, task: str, done: int, total: int) -> None:
+        """Show how far a long migration is"""
+        print(f"Migrating the database to version {version}, {task}: {done}/{total}")
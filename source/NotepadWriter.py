@@ -0,0 +1,161 @@
+# coding=utf-8
+"""Code by Aens"""
+import threading
+from source.Metrics import Metrics
+from source.NoteText import TEXT_COLUMNS, get_text_columns
+
+METRICS = Metrics.get()
+
+
+class NotepadWriter:
+    """Writes the edits of the notes from a background thread, so the GUI never waits for the disk.
+       Edits are kept in memory, merged per note (the last write wins) and written in one transaction per batch"""
+    FLUSH_DELAY = 0.5  # <-- Seconds to wait for more edits before writing a batch
+    RETRY_DELAY = 2.0  # <-- Seconds to wait before retrying a batch that failed
+    FLUSH_TIMEOUT = 10.0  # <-- Seconds a flush waits at most, the writes may keep failing
+    COLUMNS = ("title", "content")  # <-- The only columns that can be written from here
+
+    def __init__(self, storage):
+        """Start the thread that writes the batches"""
+        self.storage = storage  # <-- Pointer to the storage that owns the writer connection
+        self.pending = {}  # The content is {("notes", 1): {"title": title, "content": content}}
+        self.writing = {}  # The batch being written right now, same format as pending
+        self.jobs = []  # Callables(connection) to run in order inside the next batch, before its updates
+        self.writing_jobs = []  # The jobs of the batch being written right now
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # <-- Notified when there are new edits or a flush request
+        self.flushed = threading.Condition(self.lock)  # <-- Notified when a batch has been written
+        self.flush_requested = False
+        self.closed = False
+        # Status
+        self.written_batches = 0
+        self.written_edits = 0
+        self.failed_batches = 0  # <-- A flush stops waiting when it grows, the batch it waited for went back
+        self.last_error = None
+        # Ready to go
+        self.thread = threading.Thread(target=self.run, name="NotepadWriter", daemon=True)
+        self.thread.start()
+
+    def queue(self, table: str, _id: int, **values) -> None:
+        """Queue new values for the columns of a note, replacing anything still pending for them"""
+        for column in values:
+            if column not in self.COLUMNS:
+                raise ValueError(f"Can't write the column {column} in the background")
+        with self.lock:
+            self.pending.setdefault((table, _id), {}).update(values)
+            self.changed.notify()
+
+    def queue_job(self, job) -> None:
+        """Queue a callable(connection) that must run inside the transaction of the next batch.
+           Jobs run in the order they were queued and before the updates, so they still see the previous values"""
+        with self.lock:
+            self.jobs.append(job)
+            self.changed.notify()
+
+    def overlay(self, table: str, records: dict) -> None:
+        """Apply the edits that are not in the database yet to the records we just read from it
+           :param records: the notes as {_id: (title, content)}, they are updated in place"""
+        with self.lock:
+            for batch in (self.writing, self.pending):  # <-- Pending ones are newer, so they go last
+                for (batch_table, _id), values in batch.items():
+                    if batch_table == table and _id in records:
+                        title, content = records[_id][:2]
+                        records[_id] = (values.get("title", title), values.get("content", content),
+                                        *records[_id][2:])
+
+    def get_pending_ids(self, table: str) -> set:
+        """Return the ids of the notes of a table with edits that are not in the database yet"""
+        with self.lock:
+            return {_id for batch in (self.writing, self.pending)
+                    for batch_table, _id in batch if batch_table == table}
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT) -> bool:
+        """Write everything pending right now and wait for it.
+           Returns False if it timed out or the batch failed, it's retried later in the background"""
+        with self.lock:
+            failed_batches = self.failed_batches
+            self.flush_requested = True
+            self.changed.notify()
+            self.flushed.wait_for(lambda: self.is_idle() or self.failed_batches != failed_batches, timeout=timeout)
+            self.flush_requested = False
+            return self.is_idle()
+
+    def close(self, timeout: float = FLUSH_TIMEOUT) -> None:
+        """Write everything pending and stop the thread"""
+        self.flush(timeout=timeout)
+        with self.lock:
+            self.closed = True
+            self.changed.notify()
+        self.thread.join(timeout=timeout)
+
+    def get_status(self) -> dict:
+        """Return how many edits are waiting and how the writer is doing"""
+        with self.lock:
+            return {"pending": len(self.pending) + len(self.writing) + len(self.jobs) + len(self.writing_jobs),
+                    "written_batches": self.written_batches,
+                    "written_edits": self.written_edits,
+                    "failed_batches": self.failed_batches,
+                    "last_error": self.last_error}
+
+    def is_idle(self) -> bool:
+        """Nothing waiting and nothing being written, it must be called with the lock held"""
+        return not self.pending and not self.writing and not self.jobs and not self.writing_jobs
+
+    def pop_error(self):
+        """Return the last error only once, so the GUI shows it only once"""
+        with self.lock:
+            error, self.last_error = self.last_error, None
+            return error
+
+    ##########
+    # THREAD #
+    ##########
+
+    def run(self) -> None:
+        """Wait for edits, give them a moment to pile up and write them all in one transaction"""
+        while True:
+            with self.lock:
+                self.changed.wait_for(lambda: self.pending or self.jobs or self.closed)
+                if self.closed and not self.pending and not self.jobs:
+                    break
+                # Give some time for more edits, unless someone is waiting for them
+                self.changed.wait_for(lambda: self.flush_requested or self.closed, timeout=self.FLUSH_DELAY)
+                self.writing, self.pending = self.pending, {}
+                self.writing_jobs, self.jobs = self.jobs, []
+            failed = not self.write_batch(self.writing, self.writing_jobs)
+            with self.lock:
+                if failed:  # Put the batch back, without overwriting anything newer that came meanwhile
+                    self.failed_batches += 1
+                    self.flush_requested = False  # <-- Served, with a failure. Only a new flush retries sooner
+                    for key, values in self.writing.items():
+                        self.pending[key] = {**values, **self.pending.get(key, {})}
+                    self.jobs = self.writing_jobs + self.jobs
+                self.writing = {}
+                self.writing_jobs = []
+                self.flushed.notify_all()
+            if failed:
+                with self.lock:
+                    self.changed.wait_for(lambda: self.closed or self.flush_requested, timeout=self.RETRY_DELAY)
+
+    @METRICS.timed()
+    def write_batch(self, batch: dict, jobs: list) -> bool:
+        """Write a whole batch in a single transaction"""
+        try:
+            with self.storage.write() as connection:  # <-- Commits at the end, or rolls back everything
+                for job in jobs:
+                    job(connection)
+                for (table, _id), values in batch.items():
+                    if "content" in values:  # <-- Compressed and turned into text here, never in the GUI
+                        values = {**values, "content": self.storage.encode_content(values["content"]),
+                                  **dict(zip(TEXT_COLUMNS, get_text_columns(values["content"])))}
+                    columns = ", ".join(f"{column} = ?" for column in values)
+                    connection.execute(f"UPDATE {table} SET {columns} WHERE id = ?", (*values.values(), _id))
+            with self.lock:
+                self.written_batches += 1
+                self.written_edits += len(batch)
+            METRICS.increment("NotepadWriter.edits", len(batch))
+            return True
+        except Exception as e:
+            with self.lock:
+                self.last_error = e
+            return False
@@ -0,0 +1,176 @@
+# coding=utf-8
+"""Code by Aens"""
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from pathlib import Path
+import os
+import threading
+from PySide6.QtCore import QRectF, QSize
+from PySide6.QtGui import (QAbstractTextDocumentLayout, QImage, QPainter, QPalette, QPixmap, QPixmapCache,
+                           QTextDocument)
+from source.Metrics import Metrics
+
+DISK_CACHE_MB = 64  # <-- Renders kept in notes/previews, the least used ones are deleted past this
+MEMORY_CACHE_MB = 128  # <-- Minimum size of the QPixmapCache, shared with Qt. A screen of cards is about 6MB
+EVICT_TO = 0.9  # <-- Once the disk cache is over its size, it's trimmed down to this part of it
+METRICS = Metrics.get()
+
+
+class PreviewRenderer:
+    """Renders of the notes as small pixmaps, for the places that only show them and never edit them.
+       Each one is keyed by a hash of the content, the theme and the size, so a note that didn't change is never
+       rendered again: they live in the QPixmapCache, and on disk between sessions"""
+    instance = None
+
+    @classmethod
+    def get(cls):
+        """Return the shared renderer, its files go to notes/previews"""
+        if cls.instance is None:
+            cls.instance = cls(Path.cwd().joinpath("notes", "previews"))
+        return cls.instance
+
+    def __init__(self, folder: Path, max_bytes: int = DISK_CACHE_MB * 1024 * 1024):
+        """Nothing is read from the disk until the first render is looked for. It must be created in the GUI thread"""
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.theme = 0  # <-- Part of every key, the colors of a render depend on it
+        self.palette = QPalette()  # <-- Colors of that theme, see set_theme
+        self.disk_bytes = None  # <-- Size of the files in the folder, measured the first time it's needed
+        self.lock = threading.Lock()  # <-- For disk_bytes, the files are written from another thread
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PreviewRenderer")
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), MEMORY_CACHE_MB * 1024))
+        # Status
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_theme(self, number: int, palette: QPalette) -> None:
+        """Paint the next renders with the colors of a theme, the ones of other themes are kept but no longer used"""
+        self.palette = QPalette(palette)
+        self.theme = number
+
+    def get_key(self, content: str, size: QSize, ratio: float = 1.0) -> str:
+        """Return the key of the render of a content at that size"""
+        text = f"{self.theme}:{size.width()}x{size.height()}@{ratio}:{content or ''}"
+        return sha1(text.encode("UTF-8")).hexdigest()
+
+    def get_path(self, key: str) -> Path:
+        return self.folder.joinpath(f"{key}.png")
+
+    def find(self, content: str, size: QSize, ratio: float = 1.0, disk: bool = True):
+        """Return the cached render of a content, from memory or from the disk, or None if there isn't any.
+           Loading a PNG costs about as much as painting the note again, so hot paths only look in memory"""
+        key = self.get_key(content, size, ratio)
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None:
+            self.memory_hits += 1
+            return pixmap
+        path = self.get_path(key)
+        pixmap = QPixmap()
+        if not disk or not path.exists() or not pixmap.load(str(path), "PNG"):
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        pixmap.setDevicePixelRatio(ratio)
+        QPixmapCache.insert(key, pixmap)
+        try:
+            os.utime(path)  # <-- The least recently used files are the first deleted
+        except OSError:
+            pass
+        return pixmap
+
+    def contains(self, content: str, size: QSize, ratio: float = 1.0, disk: bool = True) -> bool:
+        """Check if a content has a cached render, without loading it"""
+        key = self.get_key(content, size, ratio)
+        return QPixmapCache.find(key) is not None or (disk and self.get_path(key).exists())
+
+    def store(self, content: str, pixmap: QPixmap, disk: bool = True) -> None:
+        """Cache the render of a content, in memory now and, unless disk is False, on disk in the background"""
+        ratio = pixmap.devicePixelRatio()
+        key = self.get_key(content, pixmap.deviceIndependentSize().toSize(), ratio)
+        QPixmapCache.insert(key, pixmap)
+        if disk:
+            self.writer.submit(self.write_file, key, pixmap.toImage())  # <-- QImage, QPixmap can't leave this thread
+
+    def render(self, content: str, size: QSize, ratio: float = 1.0) -> QPixmap:
+        """Return the render of a content, rasterizing it offscreen if it isn't cached. Only for the GUI thread"""
+        pixmap = self.find(content, size, ratio)
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(self.rasterize(content, size, ratio))
+            self.store(content, pixmap)
+        return pixmap
+
+    def get_file(self, content: str, size: QSize) -> Path:
+        """Return the file of the render of a content, rasterizing and writing it right here if it isn't there.
+           It can run in any thread, so the storage worker makes the ones the GUI needs as images"""
+        key = self.get_key(content, size)
+        path = self.get_path(key)
+        if not path.exists():
+            self.write_file(key, self.rasterize(content, size))
+        return path
+
+    @METRICS.timed("PreviewRenderer.rasterize")
+    def rasterize(self, content: str, size: QSize, ratio: float = 1.0) -> QImage:
+        """Paint the top of a note as its editor would, with the colors of the theme. On a QImage, as any thread can"""
+        document = QTextDocument()
+        document.setHtml(content or "")
+        document.setTextWidth(size.width())
+        image = QImage(size * ratio, QImage.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(ratio)
+        image.fill(self.palette.color(QPalette.Base))
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette = self.palette  # <-- The text without a color of its own takes the one of the theme
+        context.clip = QRectF(0, 0, size.width(), size.height())
+        painter = QPainter(image)
+        painter.setClipRect(context.clip)
+        document.documentLayout().draw(painter, context)
+        painter.end()
+        return image
+
+    def write_file(self, key: str, image) -> None:
+        """Save a render and delete the oldest ones if the folder got too big, in any thread but the GUI one"""
+        path = self.get_path(key)
+        if path.exists():
+            return
+        self.folder.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{key}.{threading.get_ident()}.tmp")  # <-- Two threads may write the same one
+        if not image.save(str(temporary), "PNG"):
+            return
+        os.replace(temporary, path)  # <-- Never half written for the GUI thread
+        with self.lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.folder)
+                                      if entry.name.endswith(".png"))
+            else:
+                self.disk_bytes += path.stat().st_size
+            if self.disk_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+        """Delete the least used files until the folder is back under its size, it must be called with the lock"""
+        files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.folder)
+                       if entry.name.endswith(".png"))
+        self.disk_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.disk_bytes <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_bytes -= size
+            self.evictions += 1
+
+    def get_status(self) -> dict:
+        """Return how well the cache is doing"""
+        with self.lock:
+            disk_bytes = self.disk_bytes
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "evictions": self.evictions, "disk_bytes": "?" if disk_bytes is None else disk_bytes,
+                "max_disk_bytes": self.max_bytes}
+
+    def close(self) -> None:
+        """Wait for the renders that are still being written"""
+        self.writer.shutdown(wait=True)
+        PreviewRenderer.instance = None
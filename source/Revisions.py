@@ -0,0 +1,140 @@
+# coding=utf-8
+"""Code by Aens"""
+from collections import OrderedDict
+from datetime import datetime
+from difflib import SequenceMatcher
+import json
+import sqlite3
+import zlib
+from source.ContentCodec import decode_content
+
+SNAPSHOT_EVERY = 20  # <-- Every this many revisions a full copy is stored, so rebuilding one never needs more deltas
+HEADS_CACHE_SIZE = 64  # <-- Notes whose last revision is kept in memory to compute the next delta
+
+
+def make_delta(old: str, new: str) -> bytes:
+    """Encode the new text as the lines it copies from the old one plus the lines it adds, compressed.
+       Qt writes one paragraph per line, so lines are a good unit for notes"""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    operations = []  # The content is [[start, end], "added text", [start, end]], the ranges are old lines to copy
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            operations.append([i1, i2])
+        elif j2 > j1:  # replace or insert
+            operations.append("".join(new_lines[j1:j2]))
+    return zlib.compress(json.dumps(operations, ensure_ascii=False).encode("UTF-8"))
+
+
+def apply_delta(old: str, delta: bytes) -> str:
+    """Rebuild a text from the previous one and its delta"""
+    old_lines = old.splitlines(keepends=True)
+    parts = []
+    for operation in json.loads(zlib.decompress(delta).decode("UTF-8")):
+        if isinstance(operation, str):
+            parts.append(operation)
+        else:
+            parts.extend(old_lines[operation[0]:operation[1]])
+    return "".join(parts)
+
+
+class NoteRevisions:
+    """Every saved version of every note, stored as compressed deltas against the previous version.
+       A full compressed snapshot is stored every few revisions, so any of them is rebuilt from a few deltas"""
+
+    def __init__(self, storage):
+        """Initialize the cache of the last revision of each note"""
+        self.storage = storage  # <-- Pointer to the storage that owns the connections
+        self.heads = OrderedDict()  # The content is {("notes", 1): (revision, content)}, the newest used last
+
+    def record(self, connection: sqlite3.Connection, table: str, _id: int, content: str) -> None:
+        """Store a new revision of a note. It must be called inside a write transaction, before the note is updated,
+           so the first time a note is saved its previous content is kept as revision 1"""
+        content = content or ""
+        head = self.get_head(connection, table, _id)
+        if head is None:  # First save ever of this note, what was there before is the first revision
+            previous = connection.execute(f"SELECT content FROM {table} WHERE id = ?", (_id,)).fetchone()
+            head = (1, (decode_content(previous[0]) if previous else None) or "")
+            self.insert(connection, table, _id, head[0], True, zlib.compress(head[1].encode("UTF-8")))
+            self.set_head(table, _id, *head)
+        revision, previous_content = head
+        if content == previous_content:
+            return  # Nothing new to remember
+        revision += 1
+        is_snapshot = (revision - 1) % SNAPSHOT_EVERY == 0
+        if is_snapshot:
+            data = zlib.compress(content.encode("UTF-8"))
+        else:
+            data = make_delta(previous_content, content)
+        self.insert(connection, table, _id, revision, is_snapshot, data)
+        self.set_head(table, _id, revision, content)
+
+    def insert(self, connection: sqlite3.Connection, table: str, _id: int, revision: int, is_snapshot: bool,
+               data: bytes) -> None:
+        """Insert the row of a revision"""
+        created_at = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
+        connection.execute("INSERT INTO notes_revisions (note_table, note_id, revision, is_snapshot, data, created_at) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", (table, _id, revision, int(is_snapshot), data, created_at))
+
+    def get_head(self, connection: sqlite3.Connection, table: str, _id: int):
+        """Return the (revision, content) of the last revision of a note, or None if it has none.
+           The cache is checked against the database, in case a transaction that updated it was rolled back"""
+        last_revision = connection.execute("SELECT MAX(revision) FROM notes_revisions "
+                                           "WHERE note_table = ? AND note_id = ?", (table, _id)).fetchone()[0]
+        if last_revision is None:
+            self.heads.pop((table, _id), None)
+            return None
+        head = self.heads.get((table, _id))
+        if head is None or head[0] != last_revision or head[1] is None:
+            head = (last_revision, self.get_content(table, _id, last_revision, connection=connection))
+            self.set_head(table, _id, *head)
+        return head
+
+    def set_head(self, table: str, _id: int, revision: int, content) -> None:
+        """Remember the last revision of a note, forgetting the least used ones"""
+        self.heads[(table, _id)] = (revision, content)
+        self.heads.move_to_end((table, _id))
+        while len(self.heads) > HEADS_CACHE_SIZE:
+            self.heads.popitem(last=False)
+
+    def move(self, connection: sqlite3.Connection, table: str, _id: int, new_table: str, new_id: int) -> None:
+        """Give the history of a note to its new place, when it goes to the trash or comes back from it"""
+        connection.execute("UPDATE notes_revisions SET note_table = ?, note_id = ? WHERE note_table = ? AND note_id = ?",
+                           (new_table, new_id, table, _id))
+        self.heads.pop((table, _id), None)
+
+    def forget(self, connection: sqlite3.Connection, table: str, _id: int) -> None:
+        """Delete the history of a note that no longer exists"""
+        connection.execute("DELETE FROM notes_revisions WHERE note_table = ? AND note_id = ?", (table, _id))
+        self.heads.pop((table, _id), None)
+
+    def forget_many(self, connection: sqlite3.Connection, table: str, ids: list) -> None:
+        """Delete the history of several notes that no longer exist"""
+        marks = ", ".join("?" * len(ids))
+        connection.execute(f"DELETE FROM notes_revisions WHERE note_table = ? AND note_id IN ({marks})", (table, *ids))
+        for _id in ids:
+            self.heads.pop((table, _id), None)
+
+    def list_revisions(self, table: str, _id: int) -> list:
+        """Return the revisions of a note, the newest first, as [(revision, created_at, stored_bytes)]"""
+        with self.storage.read() as connection:
+            return connection.execute("SELECT revision, created_at, length(data) FROM notes_revisions "
+                                      "WHERE note_table = ? AND note_id = ? ORDER BY revision DESC",
+                                      (table, _id)).fetchall()
+
+    def get_content(self, table: str, _id: int, revision: int, connection: sqlite3.Connection = None) -> str:
+        """Rebuild the content of a note as it was in that revision, from the closest snapshot and its deltas"""
+        if connection is None:
+            with self.storage.read() as connection:
+                return self.get_content(table, _id, revision, connection=connection)
+        rows = connection.execute("SELECT is_snapshot, data FROM notes_revisions "
+                                  "WHERE note_table = ? AND note_id = ? AND revision <= ? AND revision >= "
+                                  "(SELECT MAX(revision) FROM notes_revisions "
+                                  " WHERE note_table = ? AND note_id = ? AND revision <= ? AND is_snapshot = 1) "
+                                  "ORDER BY revision", (table, _id, revision, table, _id, revision)).fetchall()
+        if not rows:
+            raise KeyError(f"The note {_id} of {table} doesn't have the revision {revision}")
+        content = zlib.decompress(rows[0][1]).decode("UTF-8")
+        for _, delta in rows[1:]:
+            content = apply_delta(content, delta)
+        return content
@@ -0,0 +1,163 @@
+# coding=utf-8
+"""Code by Aens"""
+from configparser import ConfigParser
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote
+import queue
+import sqlite3
+import threading
+from source.BodyCache import BodyCache
+from source.ContentCodec import encode_content, decode_content
+from source.NoteText import html_to_text, compact_html
+from source.NotepadWriter import NotepadWriter
+from source.StorageWorker import StorageWorker
+from source.Revisions import NoteRevisions
+
+# Pragma profile of every connection. It can be overridden from the [Database] section of program_settings.ini
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",  # <-- Readers never wait for the writer and the writer never waits for readers
+    "synchronous": "NORMAL",  # <-- Safe with WAL, and commits don't need to wait for a full fsync
+    "cache_size": -16000,  # <-- Negative means KiB, so 16MB of page cache per connection
+    "mmap_size": 268435456,  # <-- Reads are served from a 256MB memory map of the file
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000}  # <-- Milliseconds to wait for a lock before failing
+WRITER_ONLY_PRAGMAS = ("journal_mode", "synchronous")  # <-- Persistent or only meaningful on the writer
+READERS = 3  # <-- Read-only connections in the pool
+CACHED_STATEMENTS = 256  # <-- Prepared statements kept by each connection
+BODY_CACHE_MB = 32  # <-- Memory for the contents of the notes when they are loaded lazily
+SETTINGS_FILE = "program_settings.ini"
+
+
+class Storage:
+    """The single owner of the connections to notes.db: one writer connection and a pool of read-only ones.
+       Everything that touches the database, from any tab or thread, goes through here"""
+    instance = None
+
+    @classmethod
+    def get(cls):
+        """Return the shared storage, opening it the first time"""
+        if cls.instance is None:
+            cls.instance = cls(Path.cwd().joinpath("notes/notes.db"))
+        return cls.instance
+
+    def __init__(self, db_path: Path):
+        """Open the writer connection first, as it creates the file and sets the journal mode for everyone"""
+        self.db_path = db_path
+        self.pragmas, options = self.load_profile()
+        self.compress_content = options["compress_content"]  # <-- Store new contents compressed
+        self.compact_html = options["compact_html"]  # <-- Store new contents in the canonical compact HTML
+        self.lazy_bodies = options["lazy_bodies"]  # <-- Notepads only load titles, contents come from the body cache
+        self.body_cache_bytes = int(options["body_cache_mb"] * 1024 * 1024)
+        self.write_lock = threading.RLock()
+        self.connection = self.connect(readonly=False)  # <-- The only connection that writes
+        self.readers = queue.Queue()
+        for _ in range(options["readers"]):
+            self.readers.put(self.connect(readonly=True))
+        self.writer = None  # <-- Background writer, created the first time a notepad needs it
+        self.revisions = None  # <-- History of the notes, created the first time a notepad needs it
+        self.body_cache = None  # <-- Contents of the notes, created the first time a notepad needs it
+        self.worker = None  # <-- Thread for the slow commands, created the first time a notepad needs it
+
+    @staticmethod
+    def load_profile() -> tuple:
+        """Return the pragmas and the options of the storage, with the overrides from the settings file"""
+        pragmas = dict(DEFAULT_PRAGMAS)
+        options = {"readers": READERS, "compress_content": False, "compact_html": True, "lazy_bodies": True,
+                   "body_cache_mb": BODY_CACHE_MB}
+        config = ConfigParser(interpolation=None)
+        config.read(SETTINGS_FILE, encoding="UTF-8")
+        if config.has_section("Database"):
+            for key, value in config.items("Database"):
+                if key in pragmas:
+                    pragmas[key] = value
+            options["readers"] = max(1, config.getint("Database", "readers", fallback=READERS))
+            for option in ("compress_content", "compact_html", "lazy_bodies"):
+                options[option] = config.getboolean("Database", option, fallback=options[option])
+            options["body_cache_mb"] = max(1.0, config.getfloat("Database", "body_cache_mb", fallback=BODY_CACHE_MB))
+        return pragmas, options
+
+    def connect(self, readonly: bool) -> sqlite3.Connection:
+        """Open a connection to the database with the pragma profile applied"""
+        mode = "ro" if readonly else "rwc"
+        uri = f"file:{quote(self.db_path.as_posix())}?mode={mode}"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        connection.create_function("note_text", 1, lambda value: html_to_text(decode_content(value, expand=False)),
+                                   deterministic=True)  # <-- Used by the search triggers
+        for pragma, value in self.pragmas.items():
+            if readonly and pragma in WRITER_ONLY_PRAGMAS:
+                continue
+            connection.execute(f"PRAGMA {pragma} = {value}")
+        return connection
+
+    @contextmanager
+    def read(self):
+        """Borrow a read-only connection from the pool"""
+        connection = self.readers.get()
+        try:
+            yield connection
+        finally:
+            self.readers.put(connection)
+
+    @contextmanager
+    def write(self):
+        """Lock the writer connection and commit when done, or roll back if something failed"""
+        with self.write_lock:
+            try:
+                yield self.connection
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+
+    def get_foreign_version(self) -> int:
+        """Return the PRAGMA data_version of the writer connection. It only changes with the commits of the other
+           connections, and no other connection of this program writes, so it only changes with other programs"""
+        with self.write_lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def encode_content(self, content):
+        """Return the content of a note as it must be stored, compact and compressed if the settings ask for it"""
+        if content is None:
+            return content
+        if self.compact_html:
+            content = compact_html(content)
+        if self.compress_content:
+            return encode_content(content)
+        return content
+
+    def get_writer(self):
+        """Return the background writer shared by all the notepads"""
+        if self.writer is None:
+            self.writer = NotepadWriter(self)
+        return self.writer
+
+    def get_worker(self):
+        """Return the worker thread shared by all the notepads. The first call must come from the GUI thread"""
+        if self.worker is None:
+            self.worker = StorageWorker()
+        return self.worker
+
+    def get_revisions(self):
+        """Return the history of the notes shared by all the notepads"""
+        if self.revisions is None:
+            self.revisions = NoteRevisions(self)
+        return self.revisions
+
+    def get_body_cache(self):
+        """Return the cache of contents shared by all the notepads"""
+        if self.body_cache is None:
+            self.body_cache = BodyCache(self, self.body_cache_bytes)
+        return self.body_cache
+
+    def close(self) -> None:
+        """Write everything pending and close all the connections"""
+        if self.worker is not None:
+            self.worker.close()
+        if self.writer is not None:
+            self.writer.close()
+        while not self.readers.empty():
+            self.readers.get().close()
+        with self.write_lock:
+            self.connection.close()
+        Storage.instance = None
@@ -0,0 +1,52 @@
+# coding=utf-8
+"""Code by Aens"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from PySide6 import QtCore
+
+
+class StorageWorker(QtCore.QObject):
+    """Runs the database commands in a background thread, one after the other in the order they came,
+       and hands their results back to the GUI thread through a signal, so the event loop never waits for them"""
+    done = QtCore.Signal(object, object, object, object)  # <-- (callback, errback, result, error)
+    pending_changed = QtCore.Signal(int)
+
+    def __init__(self):
+        """Start the thread. It must be created from the GUI thread, that is where the results are delivered"""
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="StorageWorker")
+        self.pending = 0  # <-- Commands queued or running, only touched from the GUI thread
+        self.done.connect(self.deliver)  # <-- Queued, as the signal is emitted from the worker thread
+
+    def run(self, command, *args, callback=None, errback=None) -> Future:
+        """Queue a command to run in the worker thread
+           :param callback: callable(result) that runs in the GUI thread if the command worked
+           :param errback: callable(error) that runs in the GUI thread if the command failed"""
+        self.pending += 1
+        self.pending_changed.emit(self.pending)
+        return self.executor.submit(self.execute, command, args, callback, errback)
+
+    def execute(self, command, args: tuple, callback, errback):
+        """Run a command in the worker thread and send its result, or its error, to the GUI thread"""
+        try:
+            result = command(*args)
+        except Exception as e:
+            self.done.emit(callback, errback, None, e)
+            raise  # <-- Whoever holds the future gets it too
+        self.done.emit(callback, errback, result, None)
+        return result
+
+    def deliver(self, callback, errback, result, error) -> None:
+        """Run the callback of a finished command, in the GUI thread"""
+        self.pending -= 1
+        self.pending_changed.emit(self.pending)
+        if error is None:
+            if callback is not None:
+                callback(result)
+        elif errback is not None:
+            errback(error)
+        else:
+            print(f"Unhandled error in the storage worker: {error}")
+
+    def close(self) -> None:
+        """Wait for the commands that are still queued and stop the thread"""
+        self.executor.shutdown(wait=True)
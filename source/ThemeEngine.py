@@ -0,0 +1,100 @@
+# coding=utf-8
+"""Code by Aens"""
+from PySide6.QtGui import QColor, QPalette
+from PySide6.QtWidgets import QApplication, QStatusBar
+import re
+
+THEME_FILES = {
+    0: "resources/theme_gray.QSS",
+    1: "resources/theme_dark.QSS",
+    2: "resources/theme_light.QSS",
+    3: "resources/theme_green.QSS"}
+STATUSBAR_THEMES = {  # <-- Colors of the status bars in their default mode
+    0: "background-color: #E9E9E9; color: black;",  # Gray theme
+    1: "background-color: #46494F; color: white;",  # Dark theme
+    2: "background-color: #A6D8FF; color: black;",  # Blue theme
+    3: "background-color: #58886B; color: black;"}  # Green theme
+STATUSBAR_ERROR = "background-color: darkred; color: white;"
+STATUS_MODE_PROPERTY = "statusMode"  # <-- Dynamic property of the status bars, the stylesheet colors each mode
+PALETTE_SOURCES = {  # The content is {selector: {css property: palette roles}}, where each palette color comes from
+    "QMainWindow": {"background-color": (QPalette.Window,), "color": (QPalette.WindowText,)},
+    "QTextEdit, QPlainTextEdit, QSpinBox": {"background-color": (QPalette.Base,), "color": (QPalette.Text,)},
+    "QPushButton": {"background-color": (QPalette.Button,), "color": (QPalette.ButtonText,)},
+    "QToolTip": {"background-color": (QPalette.ToolTipBase,), "color": (QPalette.ToolTipText,)}}
+CSS_RULE = re.compile(r"^([^{}/\n][^{}]*?)\s*\{([^{}]*)\}", re.MULTILINE)
+CSS_DECLARATION = re.compile(r"([\w-]+)\s*:\s*([^;]+);?")
+
+
+class Theme:
+    """A theme compiled once: its full stylesheet, with the status bar modes, and the palette that matches it"""
+
+    def __init__(self, number: int, stylesheet: str, palette: QPalette):
+        self.number = number
+        self.stylesheet = stylesheet
+        self.palette = palette
+
+
+class ThemeEngine:
+    """Reads and compiles each theme only the first time it's used, and applies them without reading the disk.
+       The status bars change their colors through a dynamic property, so a message only restyles its status bar"""
+
+    def __init__(self, app: QApplication):
+        """Nothing is read until a theme is applied"""
+        self.app = app
+        self.themes = {}  # The content is {0: Theme}, the ones compiled so far
+        self.current = None  # <-- Number of the theme applied right now
+
+    def get_theme(self, number: int) -> Theme:
+        """Return a compiled theme, reading its file only the first time"""
+        if number not in self.themes:
+            with open(THEME_FILES[number], encoding="UTF-8") as file:
+                stylesheet = file.read()
+            rules = self.parse_rules(stylesheet)
+            stylesheet += (f'\n/* Status bar modes, added by the theme engine */\n'
+                           f'QStatusBar[{STATUS_MODE_PROPERTY}="default"] {{{STATUSBAR_THEMES[number]}}}\n'
+                           f'QStatusBar[{STATUS_MODE_PROPERTY}="error"] {{{STATUSBAR_ERROR}}}\n')
+            self.themes[number] = Theme(number, stylesheet, self.build_palette(rules))
+        return self.themes[number]
+
+    def apply(self, number: int) -> bool:
+        """Apply a theme to the whole application. Returns False if it was already applied, as nothing changes"""
+        if number == self.current:
+            return False
+        theme = self.get_theme(number)
+        self.app.setPalette(theme.palette)  # <-- Before the stylesheet, so everything is polished only once
+        self.app.setStyleSheet(theme.stylesheet)
+        self.current = number
+        return True
+
+    @staticmethod
+    def parse_rules(stylesheet: str) -> dict:
+        """Return the plain rules of a stylesheet as {selector: {property: value}}, comments are ignored"""
+        stylesheet = re.sub(r"/\*.*?\*/", "", stylesheet, flags=re.DOTALL)
+        rules = {}
+        for selector, body in CSS_RULE.findall(stylesheet):
+            rules.setdefault(selector.strip(), {}).update(
+                (name, value.strip()) for name, value in CSS_DECLARATION.findall(body))
+        return rules
+
+    @staticmethod
+    def build_palette(rules: dict) -> QPalette:
+        """Build the palette with the colors of the stylesheet, for everything the stylesheet doesn't cover"""
+        palette = QPalette()
+        for selector, sources in PALETTE_SOURCES.items():
+            for css_property, roles in sources.items():
+                color = QColor(rules.get(selector, {}).get(css_property, ""))
+                if color.isValid():
+                    for role in roles:
+                        palette.setColor(role, color)
+        return palette
+
+
+def set_status_mode(statusbar: QStatusBar, mode: str = None) -> None:
+    """Switch the colors of a status bar to one of its modes: None (the theme), "error" or "nothing".
+       Only that status bar is polished again, and only if the mode changed"""
+    mode = mode or "default"
+    if statusbar.property(STATUS_MODE_PROPERTY) == mode:
+        return
+    statusbar.setProperty(STATUS_MODE_PROPERTY, mode)
+    statusbar.style().unpolish(statusbar)
+    statusbar.style().polish(statusbar)
@@ -0,0 +1,88 @@
+# coding=utf-8
+"""Code by Aens"""
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+import json
+import os
+import sys
+import threading
+import time
+
+ENV_VARIABLE = "UNMEMORIZE_TRACE"  # <-- "1" to trace into the default file, or the path of the file
+CLI_FLAG = "--trace"
+DEFAULT_OUTPUT = "startup_trace.json"
+
+
+class Tracer:
+    """Measures the startup in named phases, nested as spans, with their wall and CPU time.
+       It's off unless asked for, and then it writes a Chrome trace (chrome://tracing or ui.perfetto.dev)
+       and prints a summary table once the window is ready"""
+    instance = None
+
+    @classmethod
+    def get(cls):
+        """Return the shared tracer, it starts counting the first time it's asked for"""
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def __init__(self):
+        """Start the clock if tracing was asked for in the environment or in the command line"""
+        output = os.environ.get(ENV_VARIABLE, "")
+        self.enabled = bool(output) or CLI_FLAG in sys.argv
+        self.output = Path(output if output not in ("", "1") else DEFAULT_OUTPUT)
+        self.started = time.perf_counter_ns()
+        self.spans = []  # The content is [(name, depth, start_ns, wall_ns, cpu_ns, thread_id)], in the order they end
+        self.depth = 0  # <-- Only spans of the main thread are nested, the rest are always top level
+
+    def span(self, name: str):
+        """Return a context manager that measures what runs inside it. It does nothing if tracing is off"""
+        if not self.enabled:
+            return nullcontext()
+        return self.measure(name)
+
+    @contextmanager
+    def measure(self, name: str):
+        """Record the wall and CPU time of the code inside the block"""
+        main_thread = threading.current_thread() is threading.main_thread()
+        depth = self.depth if main_thread else 0
+        if main_thread:
+            self.depth += 1
+        start = time.perf_counter_ns()
+        cpu_start = time.thread_time_ns()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter_ns() - start
+            cpu = time.thread_time_ns() - cpu_start
+            if main_thread:
+                self.depth -= 1
+            self.spans.append((name, depth, start - self.started, wall, cpu, threading.get_ident()))
+
+    def finish(self) -> None:
+        """Stop tracing, write the Chrome trace and print the summary"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        total = time.perf_counter_ns() - self.started
+        self.spans.append(("startup", -1, 0, total, time.process_time_ns(), threading.get_ident()))
+        self.export_chrome_trace(self.output)
+        print(self.get_summary())
+        print(f"Startup trace written to {self.output.resolve()}")
+
+    def export_chrome_trace(self, path: Path) -> None:
+        """Write the spans in the Chrome trace-event format, as complete events in microseconds"""
+        events = [{"name": name, "cat": "startup", "ph": "X", "ts": start / 1000, "dur": wall / 1000,
+                   "pid": os.getpid(), "tid": thread_id, "args": {"cpu_ms": round(cpu / 1e6, 3)}}
+                  for name, _, start, wall, cpu, thread_id in self.spans]
+        with open(path, "w", encoding="UTF-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file, indent=1)
+
+    def get_summary(self) -> str:
+        """Return a table with every span in the order they started, indented by nesting"""
+        total = max(wall for _, _, _, wall, _, _ in self.spans) or 1
+        lines = [f"{'Phase':<48}{'Wall ms':>10}{'CPU ms':>10}{'%':>7}"]
+        for name, depth, _, wall, cpu, _ in sorted(self.spans, key=lambda span: (span[2], span[1])):
+            label = ("  " * max(0, depth) + name)[:47]
+            lines.append(f"{label:<48}{wall / 1e6:>10.1f}{cpu / 1e6:>10.1f}{wall / total:>7.1%}")
+        return "\n".join(lines)
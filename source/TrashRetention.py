@@ -0,0 +1,87 @@
+# coding=utf-8
+"""Code by Aens"""
+from datetime import datetime, timedelta
+
+MAX_AGE_DAYS = 0  # <-- Deleted notes older than this are purged, 0 to keep them forever. Opt-in, like the rest
+MAX_NOTES = 0  # <-- Only the newest deleted notes up to this amount are kept, 0 for no limit
+MAX_MB = 0  # <-- Only the newest deleted notes up to this size are kept, 0 for no limit
+PURGE_BATCH = 200  # <-- Notes deleted per transaction, so the writer is never held for long
+VACUUM_STEP_PAGES = 256  # <-- Free pages given back to the system per transaction, 1MB with 4KB pages
+INCREMENTAL = 2  # <-- Value of PRAGMA auto_vacuum when free pages can be given back with incremental_vacuum
+
+
+def reclaim_space(storage, max_pages: int = None) -> int:
+    """Give the free pages of notes.db back to the system, a few at a time so the writer is never held for long.
+       Returns the bytes the file shrank
+       :param max_pages: stop after these many pages, None to give back all of them"""
+    with storage.write() as connection:
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL:
+            return 0  # <-- Not migrated yet, the pages are reused by the next notes instead
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    freed = 0
+    while max_pages is None or freed < max_pages:
+        with storage.write() as connection:
+            free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            step = min(free, VACUUM_STEP_PAGES, VACUUM_STEP_PAGES if max_pages is None else max_pages - freed)
+            if step <= 0:
+                break
+            connection.execute(f"PRAGMA incremental_vacuum({step})").fetchall()  # <-- It frees a page per row
+            left = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if left >= free:
+            break  # <-- Nothing could be given back, don't loop forever
+        freed += free - left
+    return freed * page_size
+
+
+class TrashRetention:
+    """Decides which deleted notes are too old, or too many, or take too much space, and purges them.
+       It only works with the database, the notepads run it in their storage worker and update themselves"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.max_age_days = MAX_AGE_DAYS
+        self.max_notes = MAX_NOTES
+        self.max_mb = MAX_MB
+
+    def is_enabled(self) -> bool:
+        """Check if any of the limits is set"""
+        return self.max_age_days > 0 or self.max_notes > 0 or self.max_mb > 0
+
+    def find_expired(self, connection) -> list:
+        """Return the ids of the deleted notes that the limits don't keep. The newest ones are always kept first"""
+        expired = set()
+        if self.max_age_days > 0:
+            cutoff = (datetime.now() - timedelta(days=self.max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+            expired.update(row[0] for row in connection.execute(
+                "SELECT id FROM notes_deleted WHERE deleted_at != '' AND deleted_at < ?", (cutoff,)))
+        if self.max_mb > 0:  # <-- Needs the size of every note, the newest first, so it walks the whole trash
+            max_bytes = self.max_mb * 1024 * 1024
+            kept = size = 0
+            for _id, length in connection.execute(
+                    "SELECT id, ifnull(length(CAST(title AS BLOB)), 0) + ifnull(length(CAST(content AS BLOB)), 0) "
+                    "FROM notes_deleted ORDER BY deleted_at DESC, id DESC"):
+                if _id in expired:
+                    continue
+                kept += 1
+                size += length
+                if size > max_bytes or 0 < self.max_notes < kept:
+                    expired.add(_id)
+        elif self.max_notes > 0:  # <-- Only the ids past the limit, straight from the index of deleted_at
+            expired.update(row[0] for row in connection.execute(
+                "SELECT id FROM notes_deleted ORDER BY deleted_at DESC, id DESC LIMIT -1 OFFSET ?",
+                (self.max_notes,)))
+        return sorted(expired)
+
+    def purge(self) -> dict:
+        """Delete the expired notes in batches and give their space back. Runs in the storage worker.
+           Returns {"ids": [purged ids], "freed_bytes": 1}"""
+        with self.storage.read() as connection:
+            ids = self.find_expired(connection)
+        revisions = self.storage.get_revisions()
+        for start in range(0, len(ids), PURGE_BATCH):
+            batch = ids[start:start + PURGE_BATCH]
+            with self.storage.write() as connection:
+                marks = ", ".join("?" * len(batch))
+                connection.execute(f"DELETE FROM notes_deleted WHERE id IN ({marks})", batch)
+                revisions.forget_many(connection, "notes_deleted", batch)
+        return {"ids": ids, "freed_bytes": reclaim_space(self.storage)}